@@ -0,0 +1,146 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import argparse
+import datetime
+import os.path
+import sys
+
+from .db import Database, connect
+from .export import (EDIT_FIELDS, SPAN_FIELDS, TIME_FORMATS, WRITERS,
+                     edit_records, span_records)
+from .importer import READERS, spans_from_records
+from .report import day_start
+
+
+OUTPUT_BUFFER = 1 << 20
+
+
+def date_arg(text):
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid date {!r}, expected YYYY-MM-DD'.format(text))
+
+
+def open_output(path, newline=None):
+    if path is None or path == '-':
+        return open(sys.stdout.fileno(), 'w', buffering=OUTPUT_BUFFER,
+                    encoding='utf-8', newline=newline, closefd=False)
+    return open(path, 'w', buffering=OUTPUT_BUFFER, encoding='utf-8',
+                newline=newline)
+
+
+def export(args, filename):
+    db = Database(connect(filename, readonly=True))
+    time_from = (day_start(args.first.toordinal())
+                 if args.first else -2**31)
+    time_to = (day_start(args.last.toordinal() + 1)
+               if args.last else 2**31 - 1)
+    format_time = TIME_FORMATS[args.time_format]
+    if args.history:
+        records = edit_records(db, time_from, time_to, format_time)
+        fields = EDIT_FIELDS
+    else:
+        records = span_records(db, time_from, time_to, format_time)
+        fields = SPAN_FIELDS
+    try:
+        with open_output(args.output,
+                         '' if args.format == 'csv' else None) as out:
+            count = WRITERS[args.format](records, fields, out)
+    finally:
+        db.conn.close()
+    print('exported {} records'.format(count), file=sys.stderr)
+
+
+def import_(args, filename):
+    if args.format is None:
+        args.format = 'jsonl' if args.input.endswith('.jsonl') else 'csv'
+    if args.input == '-':
+        f = open(sys.stdin.fileno(), encoding='utf-8', newline='',
+                 closefd=False)
+    else:
+        f = open(args.input, encoding='utf-8', newline='')
+    db = Database.open(filename)
+    try:
+        with f:
+            records = READERS[args.format](
+                f, args.start, args.end or None, args.tags or ['tags'])
+            result = db.bulk_load(spans_from_records(records),
+                                  args.chunk_size, args.rebuild_indexes)
+    except ValueError as e:
+        sys.exit('import stopped at {}: {}'.format(args.input, e))
+    finally:
+        db.close()
+    print('imported {} spans with {} tags'.format(*result), file=sys.stderr)
+
+
+parser = argparse.ArgumentParser(description='Manage Alho time-tracking data.')
+parser.add_argument('-f', '--file', default='~/.alho.db',
+                    help='SQLite DB file to use.')
+commands = parser.add_subparsers(dest='command', required=True)
+
+export_parser = commands.add_parser(
+    'export', help='Export spans or edits as CSV or JSON lines.')
+export_parser.set_defaults(run=export)
+export_parser.add_argument('--from', dest='first', type=date_arg,
+                           help='First day to export, as YYYY-MM-DD.')
+export_parser.add_argument('--to', dest='last', type=date_arg,
+                           help='Last day to export, as YYYY-MM-DD.')
+export_parser.add_argument('--history', action='store_true',
+                           help='Export the edits made in the range instead '
+                                'of the spans.')
+export_parser.add_argument('--format', choices=sorted(WRITERS),
+                           default='csv', help='Output format.')
+export_parser.add_argument('--time-format', choices=sorted(TIME_FORMATS),
+                           default='iso',
+                           help='Write times as ISO 8601 local times, or as '
+                                'seconds since the epoch.')
+export_parser.add_argument('-o', '--output',
+                           help='File to write. Defaults to stdout.')
+
+import_parser = commands.add_parser(
+    'import', help='Import spans from CSV or JSON lines.')
+import_parser.set_defaults(run=import_)
+import_parser.add_argument('input', help='File to import, or - for stdin.')
+import_parser.add_argument('--format', choices=sorted(READERS),
+                           help='Input format. Defaults to jsonl for .jsonl '
+                                'files, and csv otherwise.')
+import_parser.add_argument('--start', default='start',
+                           help='Column of start times.')
+import_parser.add_argument('--end', default='end',
+                           help='Column of end times; an empty value means '
+                                'none.')
+import_parser.add_argument('--tags', action='append',
+                           help='Column of tags; may be repeated. Default: '
+                                'tags.')
+import_parser.add_argument('--chunk-size', type=int, default=10000,
+                           help='Spans to insert per transaction.')
+import_parser.add_argument('--rebuild-indexes', action='store_true',
+                           help='Drop indexes during the import, and create '
+                                'them again after.')
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    filename = os.path.normpath(os.path.expanduser(args.file))
+    args.run(args, filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Vectorized analysis of the current spans and their tags.
+
+Needs NumPy and SciPy, which are installed by the ``analytics`` extra.
+
+As in `alho.report`, the last span, which has no end yet, isn't counted.
+"""
+
+
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+from .report import day_of, day_start
+
+
+DayTotals = namedtuple('DayTotals', ['days', 'seconds'])
+
+
+class SpanFrame:
+    """The spans overlapping a time range, as arrays.
+
+    `span_ids`, `started` and `ended` have one entry per span, in order.
+    `tag_matrix` is a sparse ``(spans, tags)`` matrix of ones where a span
+    has a tag, with columns named by `tags`. Times are clipped to the
+    range by `bounds`, so a span ongoing at `time_from` counts only from
+    then.
+    """
+
+    def __init__(self, span_ids, started, ended, tag_matrix, tags,
+                 time_from, time_to):
+        self.span_ids = span_ids
+        self.started = started
+        self.ended = ended
+        self.tag_matrix = tag_matrix
+        self.tags = tags
+        self.time_from = time_from
+        self.time_to = time_to
+
+    @classmethod
+    def load(cls, db, time_from, time_to):
+        """Load the spans of `db` overlapping ``[time_from, time_to)``."""
+        spans = [span for span in db.get_span_durations(time_from, time_to)
+                 if span.ended is not None]
+        span_ids = np.array([span.span_id for span in spans], dtype=np.int64)
+        started = np.array([span.started for span in spans], dtype=np.int64)
+        ended = np.array([span.ended for span in spans], dtype=np.int64)
+        rows = np.array(db.conn.execute("""
+          select tag.span_id, tag.tag_id
+            from current_span as span
+            join current_span_tag as tag
+              on tag.span_id = span.span_id
+            where span.started between ? and ?
+              and tag.active
+        """, [spans[0].started, spans[-1].started] if spans else [0, -1])
+            .fetchall(), dtype=np.int64).reshape(-1, 2)
+        # The last span may have started at the same time as another.
+        rows = rows[np.isin(rows[:, 0], span_ids)]
+        order = np.argsort(span_ids)
+        positions = np.searchsorted(span_ids, rows[:, 0], sorter=order)
+        tag_ids, columns = np.unique(rows[:, 1], return_inverse=True)
+        tag_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64),
+             (order[positions], columns)),
+            shape=(len(spans), len(tag_ids)))
+        tags = [db.tags.get_name(int(tag_id)) for tag_id in tag_ids]
+        return cls(span_ids, started, ended, tag_matrix, tags,
+                   time_from, time_to)
+
+    def __len__(self):
+        return len(self.span_ids)
+
+    @property
+    def bounds(self):
+        """The clipped start of each span, followed by the last's end."""
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        return np.clip(np.append(self.started, self.ended[-1]),
+                       self.time_from, self.time_to)
+
+    @property
+    def durations(self):
+        """The seconds of each span within the range."""
+        return np.diff(self.bounds)
+
+    def tag_totals(self):
+        """Return a dict of the seconds per tag."""
+        return dict(zip(self.tags,
+                        (self.tag_matrix.T @ self.durations).tolist()))
+
+    def day_totals(self):
+        """Return the seconds per tag of each local day, as `DayTotals`.
+
+        `days` is an array of the days' ordinals, and `seconds` a
+        ``(days, tags)`` array.
+        """
+        first = day_of(self.time_from)
+        last = day_of(self.time_to - 1)
+        days = np.arange(first, last + 1)
+        midnights = np.array([day_start(day) for day in range(
+            first, last + 2)], dtype=np.int64)
+        bounds = self.bounds
+        if len(bounds) < 2:
+            return DayTotals(days, np.zeros((len(days), len(self.tags)),
+                                            dtype=np.int64))
+        # Cut the spans at midnights, and credit each piece to its day.
+        points = np.union1d(bounds, midnights[
+            (midnights > bounds[0]) & (midnights < bounds[-1])])
+        pieces = points[:-1]
+        spans = np.searchsorted(bounds, pieces, side='right') - 1
+        piece_days = np.searchsorted(midnights, pieces, side='right') - 1
+        day_spans = sparse.csr_matrix(
+            (np.diff(points), (piece_days, spans)),
+            shape=(len(days), len(self)))
+        return DayTotals(days, (day_spans @ self.tag_matrix).toarray())
+
+    def cooccurrence(self):
+        """Return a ``(tags, tags)`` array of the spans with both tags.
+
+        The diagonal holds the number of spans with each tag.
+        """
+        return (self.tag_matrix.T @ self.tag_matrix).toarray()
@@ -0,0 +1,94 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import Database, connect
+
+
+log = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """Runs `Database` methods on a worker thread with its own connection.
+
+    `submit` returns a `concurrent.futures.Future`. `call` passes the result
+    to a callback through `deliver`, a function that runs a callable on the
+    caller's thread, such as a `gui.util.MainThreadQueue`; by default the
+    callback runs on the worker thread.
+
+    The worker's connection only sees committed changes, and calls run one
+    at a time in the order they were made. `options` are passed on to
+    `db.connect`.
+    """
+
+    def __init__(self, filename, deliver=None, **options):
+        self.filename = filename
+        self.deliver = deliver
+        self.options = options
+        self.db = None
+        self.executor = ThreadPoolExecutor(1, initializer=self._connect)
+
+    def _connect(self):
+        self.db = Database(connect(self.filename, **self.options))
+
+    def submit(self, method, *args, **kwargs):
+        """Call the named `Database` method on the worker thread.
+
+        Methods that are generators are run to completion into a list.
+        """
+        return self.executor.submit(self._run, method, args, kwargs)
+
+    def _run(self, method, args, kwargs):
+        result = getattr(self.db, method)(*args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            result = list(result)
+        return result
+
+    def call(self, method, *args, callback, errback=None):
+        """Call the named `Database` method, then `callback` with its result.
+
+        If the method raises, `errback` is called with the exception
+        instead, or if there isn't one, the exception is logged.
+        """
+        def done(future):
+            error = future.exception()
+            if error is None:
+                self._deliver(callback, future.result())
+            elif errback is not None:
+                self._deliver(errback, error)
+            else:
+                log.error('Database.%s failed', method, exc_info=error)
+        future = self.submit(method, *args)
+        future.add_done_callback(done)
+        return future
+
+    def _deliver(self, func, arg):
+        if self.deliver is None:
+            func(arg)
+        else:
+            self.deliver(lambda: func(arg))
+
+    def close(self):
+        """Wait for pending calls, then close the worker's connection."""
+        if self.executor is None:
+            return
+        self.executor.submit(lambda: self.db.conn.close())
+        self.executor.shutdown(wait=True)
+        self.executor = None
@@ -0,0 +1,250 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compact binary serialization of `SpanEdit` and `TagEdit` streams.
+
+A changeset starts with a header of `MAGIC`, a version byte and a flags
+byte. If `FLAG_ZLIB` is set, everything after the header is a zlib stream.
+The body is a sequence of fixed-width little-endian records, each starting
+with a kind byte, and ends with an `END` record.
+
+Each edit record stores its `edit_time` as the difference from the previous
+record's (modulo 2**64), its full location id, and its span id. Tag names
+are stored once per changeset in `NAME` records, which assign consecutive
+indexes that later tag records refer to.
+
+`read_changeset` yields `SpanRow`s and `TagRow`s, which build their
+`TimeStamp`s only when asked, as decoding is dominated by per-record
+overhead.
+"""
+
+
+import struct
+import zlib
+
+from .db import SpanEdit, SpanRow, TagRow
+
+
+MAGIC = b'ALHO'
+VERSION = 1
+FLAG_ZLIB = 0x01
+
+HEADER = struct.Struct('<4sBB')
+
+END = 0
+NAME = 1
+SPAN = 2
+SPAN_DELETED = 3
+TAG_ON = 4
+TAG_OFF = 5
+
+KIND = struct.Struct('<B')
+NAME_LEN = struct.Struct('<BH')
+RECORDS = {
+    SPAN: struct.Struct('<BQiqq'),
+    SPAN_DELETED: struct.Struct('<BQiq'),
+    TAG_ON: struct.Struct('<BQiqI'),
+    TAG_OFF: struct.Struct('<BQiqI'),
+}
+
+MAX_NAME_LEN = 0xffff
+
+CHUNK_SIZE = 1 << 16
+
+
+class ChangesetWriter:
+    """Writes edits to a binary file object as a changeset.
+
+    Call `close` (or use as a context manager) to finish the changeset; the
+    file object itself is left open.
+    """
+
+    def __init__(self, fileobj, compress=True, level=6):
+        self.fileobj = fileobj
+        self.compressor = zlib.compressobj(level) if compress else None
+        self.fileobj.write(HEADER.pack(MAGIC, VERSION,
+                                       FLAG_ZLIB if compress else 0))
+        self.buffer = bytearray()
+        self.names = {}
+        self.last_time = 0
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _name_index(self, name):
+        try:
+            return self.names[name]
+        except KeyError:
+            index = self.names[name] = len(self.names)
+            encoded = name.encode('utf-8')
+            if len(encoded) > MAX_NAME_LEN:
+                raise ValueError('Tag name too long for a changeset: %d '
+                                 'bytes' % len(encoded))
+            self.buffer += NAME_LEN.pack(NAME, len(encoded))
+            self.buffer += encoded
+            return index
+
+    def write(self, edit):
+        edit_time = edit.edit_time
+        delta = (edit_time - self.last_time) & 0xffffffffffffffff
+        self.last_time = edit_time
+        loc = edit.edit_loc
+        if edit.TABLE == SpanEdit.TABLE:
+            if edit.started is None:
+                record = RECORDS[SPAN_DELETED].pack(
+                    SPAN_DELETED, delta, loc, edit.span_id)
+            else:
+                record = RECORDS[SPAN].pack(
+                    SPAN, delta, loc, edit.span_id, edit.started)
+        else:
+            index = self._name_index(edit.name)
+            kind = TAG_ON if edit.active else TAG_OFF
+            record = RECORDS[kind].pack(kind, delta, loc, edit.span_id, index)
+        self.buffer += record
+        self.count += 1
+        if len(self.buffer) >= CHUNK_SIZE:
+            self._flush()
+
+    def write_all(self, edits):
+        for edit in edits:
+            self.write(edit)
+
+    def _flush(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.fileobj.write(data)
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.buffer += KIND.pack(END)
+        self._flush()
+        if self.compressor is not None:
+            self.fileobj.write(self.compressor.flush())
+        self.buffer = None
+
+
+def write_changeset(fileobj, edits, compress=True):
+    """Write all `edits` to `fileobj` as one changeset.
+
+    Returns the number of edits written.
+    """
+    with ChangesetWriter(fileobj, compress) as writer:
+        writer.write_all(edits)
+    return writer.count
+
+
+def _read_chunks(fileobj, decompressor):
+    while True:
+        data = fileobj.read(CHUNK_SIZE)
+        if decompressor is not None:
+            try:
+                data = (decompressor.decompress(data) if data
+                        else decompressor.flush())
+            except zlib.error as error:
+                raise ValueError('Corrupt changeset: %s' % error) from None
+        if not data:
+            return
+        yield data
+
+
+def read_changeset(fileobj):
+    """Yield the edits of a changeset read from a binary file object.
+
+    Edits are yielded as `SpanRow`s and `TagRow`s. Reads `CHUNK_SIZE`
+    bytes at a time, so a changeset needn't fit in memory. Raises
+    `ValueError` if the data isn't a valid changeset.
+    """
+    header = fileobj.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError('Truncated changeset header')
+    magic, version, flags = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('Not a changeset')
+    if version != VERSION:
+        raise ValueError('Unsupported changeset version: %r' % version)
+    decompressor = zlib.decompressobj() if flags & FLAG_ZLIB else None
+
+    names = []
+    last_time = 0
+    buf = b''
+    pos = 0
+    span_size = RECORDS[SPAN].size
+    unpack_span = RECORDS[SPAN].unpack_from
+    deleted_size = RECORDS[SPAN_DELETED].size
+    unpack_deleted = RECORDS[SPAN_DELETED].unpack_from
+    tag_size = RECORDS[TAG_ON].size
+    unpack_tag = RECORDS[TAG_ON].unpack_from
+    for chunk in _read_chunks(fileobj, decompressor):
+        buf = buf[pos:] + chunk
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            kind = buf[pos]
+            if kind == SPAN:
+                if pos + span_size > end:
+                    break
+                _, delta, loc, span_id, started = unpack_span(buf, pos)
+                pos += span_size
+                last_time = (last_time + delta) & 0xffffffffffffffff
+                yield SpanRow(last_time - 0x10000000000000000
+                              if last_time >> 63 else last_time,
+                              span_id, started, loc)
+            elif kind == TAG_ON or kind == TAG_OFF:
+                if pos + tag_size > end:
+                    break
+                _, delta, loc, span_id, index = unpack_tag(buf, pos)
+                pos += tag_size
+                last_time = (last_time + delta) & 0xffffffffffffffff
+                try:
+                    name = names[index]
+                except IndexError:
+                    raise ValueError(
+                        'Unknown changeset tag name index: %r' % index
+                    ) from None
+                yield TagRow(last_time - 0x10000000000000000
+                             if last_time >> 63 else last_time,
+                             span_id, name, 1 if kind == TAG_ON else 0, loc)
+            elif kind == SPAN_DELETED:
+                if pos + deleted_size > end:
+                    break
+                _, delta, loc, span_id = unpack_deleted(buf, pos)
+                pos += deleted_size
+                last_time = (last_time + delta) & 0xffffffffffffffff
+                yield SpanRow(last_time - 0x10000000000000000
+                              if last_time >> 63 else last_time,
+                              span_id, None, loc)
+            elif kind == NAME:
+                if pos + NAME_LEN.size > end:
+                    break
+                length = NAME_LEN.unpack_from(buf, pos)[1]
+                start = pos + NAME_LEN.size
+                if start + length > end:
+                    break
+                names.append(buf[start:start + length].decode('utf-8'))
+                pos = start + length
+            elif kind == END:
+                return
+            else:
+                raise ValueError('Unknown changeset record kind: %r' % kind)
+    raise ValueError('Truncated changeset')
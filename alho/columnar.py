@@ -0,0 +1,294 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Columnar export of the edit log and current state, for analysis.
+
+`export_columns` writes a directory of fixed-width column files in the
+NumPy ``.npy`` format, one per column of each of the `TABLES`, so they can
+be memory-mapped with ``numpy.load(path, mmap_mode='r')``, or without NumPy
+by `load_column`. Alongside them are ``tags.json``, the list of tag names
+indexed by tag id, and ``manifest.json``, which holds the row counts and
+the per-location watermarks of the edits exported.
+
+Re-exporting to the same directory appends only the edits newer than the
+watermarks, so ``span_edits`` and ``tag_edits`` are grouped by export run,
+then by location, and are in `edit_time` order within those. The current
+state tables are small, and are rewritten each time. A null `started` is
+written as `NULL_TIME`.
+
+Run as ``python -m alho.columnar DIR`` to export the default database.
+"""
+
+
+import argparse
+import ast
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections import namedtuple
+
+from .db import Database, connect
+
+
+FORMAT_VERSION = 1
+NULL_TIME = -2**63
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# Room for any shape, so appending can rewrite the header in place.
+NPY_HEADER_SIZE = 128
+FETCH_SIZE = 10000
+
+Column = namedtuple('Column', ['name', 'typecode', 'descr'])
+# Incremental tables are appended to, and have `edit_time` first.
+Table = namedtuple('Table', ['columns', 'sql', 'incremental'])
+ColumnarResult = namedtuple('ColumnarResult', ['span_edits', 'tag_edits'])
+
+
+def _typecode(size):
+    """Return the `array` typecode of signed integers of `size` bytes."""
+    for code in 'bhilq':
+        if array(code).itemsize == size:
+            return code
+    raise TypeError('no {}-byte integer array type'.format(size))
+
+
+def _columns(*specs):
+    return [Column(name, _typecode(int(descr[2:])), descr)
+            for name, descr in specs]
+
+
+TABLES = {
+    'span_edits': Table(_columns(
+        ('edit_time', '<i8'), ('edit_loc', '<i4'), ('span_id', '<i8'),
+        ('started', '<i8'),
+    ), """
+      select edit_time, edit_loc, span_id, coalesce(started, {})
+        from span
+        where edit_loc = ?
+          and edit_time > ?
+        order by edit_time
+    """.format(NULL_TIME), True),
+    'tag_edits': Table(_columns(
+        ('edit_time', '<i8'), ('edit_loc', '<i4'), ('span_id', '<i8'),
+        ('tag_id', '<i4'), ('active', '|i1'),
+    ), """
+      select edit_time, edit_loc, span_id, tag_id, active
+        from span_tag
+        where edit_loc = ?
+          and edit_time > ?
+        order by edit_time
+    """, True),
+    'current_spans': Table(_columns(
+        ('span_id', '<i8'), ('started', '<i8'), ('edit_time', '<i8'),
+    ), """
+      select span_id, started, edit_time
+        from current_span
+        where started is not null
+        order by started, edit_time
+    """, False),
+    'current_span_tags': Table(_columns(
+        ('span_id', '<i8'), ('tag_id', '<i4'),
+    ), """
+      select span_id, tag_id
+        from current_span_tag
+        where active
+        order by span_id, tag_id
+    """, False),
+}
+
+
+def npy_header(descr, length):
+    """Return the `NPY_HEADER_SIZE`-byte header of a 1-d ``.npy`` file."""
+    text = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}"
+    text = text.format(descr, length).encode('latin1')
+    padding = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - len(text) - 1
+    return (NPY_MAGIC + (NPY_HEADER_SIZE - len(NPY_MAGIC) - 2).to_bytes(
+        2, 'little') + text + b' ' * padding + b'\n')
+
+
+def read_npy_header(f):
+    """Return the ``(descr, length)`` of the ``.npy`` file `f`.
+
+    Leaves `f` positioned at the start of the data.
+    """
+    magic = f.read(len(NPY_MAGIC))
+    if magic != NPY_MAGIC:
+        raise ValueError('not a version 1.0 .npy file')
+    size = int.from_bytes(f.read(2), 'little')
+    header = ast.literal_eval(f.read(size).decode('latin1'))
+    if header['fortran_order'] or len(header['shape']) != 1:
+        raise ValueError('not a 1-d .npy file')
+    return header['descr'], header['shape'][0]
+
+
+def load_column(path):
+    """Memory-map the ``.npy`` file at `path` as a read-only memoryview.
+
+    Only files written by `export_columns` are supported.
+    """
+    with open(path, 'rb') as f:
+        descr, length = read_npy_header(f)
+        offset = f.tell()
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if descr[0] == '>' or (descr[0] == '<' and sys.byteorder != 'little'):
+        raise ValueError('{} is not in native byte order'.format(path))
+    data = view[offset:]
+    return data.cast(_typecode(int(descr[2:])))[:length]
+
+
+class ColumnWriter:
+    """Appends values to a ``.npy`` column file.
+
+    The file is first cut back to `length` values, dropping any left by an
+    export that didn't finish. The header is updated by `close`.
+    """
+
+    def __init__(self, path, column, length=0):
+        self.column = column
+        self.length = length
+        self.f = open(path, 'r+b' if length else 'w+b')
+        self.itemsize = array(column.typecode).itemsize
+        self.f.truncate(NPY_HEADER_SIZE + length * self.itemsize)
+        self.f.seek(0, os.SEEK_END)
+
+    def append(self, values):
+        data = array(self.column.typecode, values)
+        if sys.byteorder != 'little':
+            data.byteswap()
+        data.tofile(self.f)
+        self.length += len(data)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(npy_header(self.column.descr, self.length))
+        self.f.close()
+
+
+def read_manifest(directory):
+    """Return the manifest of an export in `directory`, or `None`."""
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest['version'] != FORMAT_VERSION:
+        raise ValueError('unsupported export format version {}'.format(
+            manifest['version']))
+    return manifest
+
+
+def _write_json(directory, name, value):
+    path = os.path.join(directory, name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
+
+
+def _copy_rows(cursor, writers):
+    """Append the rows of `cursor` to the column `writers`.
+
+    Returns the number of rows and the last one.
+    """
+    count = 0
+    last = None
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return count, last
+        for writer, values in zip(writers, zip(*rows)):
+            writer.append(values)
+        count += len(rows)
+        last = rows[-1]
+
+
+def export_columns(db, directory, full=False):
+    """Export the history and current state of `db` to `directory`.
+
+    Appends to an earlier export of the same database there, unless `full`
+    is true. Returns a `ColumnarResult` of the edits written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = None if full else read_manifest(directory)
+    if manifest is not None and manifest['location_id'] != db.location_id:
+        raise ValueError('{} holds an export of another database'.format(
+            directory))
+    if manifest is None:
+        manifest = {'version': FORMAT_VERSION,
+                    'location_id': db.location_id,
+                    'watermarks': {name: {} for name, table in TABLES.items()
+                                   if table.incremental},
+                    'rows': {}}
+    rows = manifest['rows']
+    written = {}
+    db.conn.execute('begin')
+    try:
+        locations = db.get_edit_locations()
+        for name, table in TABLES.items():
+            length = rows.get(name, 0) if table.incremental else 0
+            writers = [ColumnWriter(
+                os.path.join(directory, '{}.{}.npy'.format(name, column.name)),
+                column, length) for column in table.columns]
+            try:
+                if table.incremental:
+                    watermarks = manifest['watermarks'][name]
+                    written[name] = 0
+                    for loc in locations:
+                        since = watermarks.get(str(loc), -2**63)
+                        count, last = _copy_rows(
+                            db.conn.execute(table.sql, [loc, since]), writers)
+                        if count:
+                            watermarks[str(loc)] = last[0]
+                        written[name] += count
+                else:
+                    _copy_rows(db.conn.execute(table.sql), writers)
+            finally:
+                for writer in writers:
+                    writer.close()
+            rows[name] = writers[0].length
+        names = [None] * (db.conn.execute(
+            'select coalesce(max(tag_id), 0) + 1 from tag').fetchone()[0])
+        for tag_id, name in db.conn.execute('select tag_id, name from tag'):
+            names[tag_id] = name
+    finally:
+        db.conn.execute('commit')
+    _write_json(directory, 'tags.json', names)
+    _write_json(directory, 'manifest.json', manifest)
+    return ColumnarResult(written['span_edits'], written['tag_edits'])
+
+
+parser = argparse.ArgumentParser(
+    description='Export the Alho history as memory-mappable columns.')
+parser.add_argument('directory', help='Directory to export to.')
+parser.add_argument('-f', '--file', default='~/.alho.db',
+                    help='SQLite DB file to export.')
+parser.add_argument('--full', action='store_true',
+                    help='Rewrite the export instead of appending to it.')
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    filename = os.path.normpath(os.path.expanduser(args.file))
+    db = Database(connect(filename, readonly=True))
+    try:
+        print(export_columns(db, args.directory, args.full))
+    finally:
+        db.conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import bisect
+import heapq
+import time
+
+
+class TagIndex:
+    """In-memory prefix index of tag names, ranked by recent use.
+
+    Names are kept in a sorted list, so the names with a given prefix are
+    a contiguous slice found by bisection. Each use of a tag adds a weight
+    that halves every `HALF_LIFE` seconds into the past, so a tag's score
+    is its frequency of use, favoring recent uses. A use on a span counts
+    until it's removed or replaced, and a name is dropped once its last
+    use is removed.
+    """
+
+    HALF_LIFE = 30 * 86400
+
+    def __init__(self, now=None):
+        self.names = []
+        self.scores = {}
+        self.counts = {}
+        self.uses = {}
+        self.ref = time.time() if now is None else now
+
+    def __len__(self):
+        return len(self.names)
+
+    def _weight(self, when):
+        return 2.0 ** ((when - self.ref) / self.HALF_LIFE)
+
+    def add(self, name, when, span_id=None):
+        """Count a use of the tag `name` at time `when`.
+
+        With a `span_id`, it replaces any use of `name` on that span.
+        """
+        if span_id is not None:
+            self.remove(name, span_id)
+            self.uses.setdefault(span_id, {})[name] = when
+        if name not in self.counts:
+            bisect.insort(self.names, name)
+            self.scores[name] = 0.0
+            self.counts[name] = 0
+        self.scores[name] += self._weight(when)
+        self.counts[name] += 1
+
+    def remove(self, name, span_id):
+        """Uncount the use of `name` on span `span_id`, if there is one."""
+        span_uses = self.uses.get(span_id)
+        if not span_uses or name not in span_uses:
+            return
+        when = span_uses.pop(name)
+        if not span_uses:
+            del self.uses[span_id]
+        self.counts[name] -= 1
+        if self.counts[name]:
+            self.scores[name] -= self._weight(when)
+        else:
+            del self.names[bisect.bisect_left(self.names, name)]
+            del self.scores[name], self.counts[name]
+
+    def set_span(self, span_id, uses):
+        """Replace the uses on span `span_id` with `uses`.
+
+        `uses` maps tag names to the times they were added to the span.
+        """
+        for name in list(self.uses.get(span_id, ())):
+            self.remove(name, span_id)
+        for name, when in uses.items():
+            self.add(name, when, span_id)
+
+    def complete(self, prefix, limit=10):
+        """Return up to `limit` names starting with `prefix`, best first.
+
+        Ties in score are broken alphabetically.
+        """
+        first = bisect.bisect_left(self.names, prefix)
+        if prefix:
+            end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            last = bisect.bisect_left(self.names, end, first)
+        else:
+            last = len(self.names)
+        scores = self.scores
+        return heapq.nsmallest(limit, self.names[first:last],
+                               key=lambda name: (-scores[name], name))
@@ -15,8 +15,26 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import hashlib
+import heapq
+import itertools
+import logging
+import queue
+import random
+import sqlite3
+import threading
 import time
+import urllib.request
 from collections import namedtuple
+from contextlib import contextmanager
+
+from .completion import TagIndex
+
+
+log = logging.getLogger(__name__)
+
+
+SCHEMA_VERSION = 2
 
 
 def create_tables(conn):
@@ -34,59 +52,414 @@ def create_tables(conn):
             started int
           )
         """)
+        create_tag_tables(conn)
+        create_indexes(conn)
+        create_current_tables(conn)
+        conn.execute('pragma user_version = {}'.format(SCHEMA_VERSION))
+
+
+def create_tag_tables(conn, span_tag_table='span_tag'):
+    """Create the `tag` name dictionary and the `span_tag` edit table.
+
+    `span_tag` refers to tags by their integer `tag_id`; `TagDictionary`
+    translates between ids and names.
+    """
+    conn.execute("""
+      create table tag (
+        tag_id integer primary key not null,
+        name text not null unique
+      )
+    """)
+    conn.execute("""
+      create table {} (
+        edit_time integer primary key not null,
+        edit_loc int not null,
+        span_id int not null,
+        tag_id int not null,
+        active int not null
+      )
+    """.format(span_tag_table))
+
+
+def create_edit_indexes(conn, table):
+    conn.execute("""
+      create index if not exists {0}_span_id_idx on {0} (span_id, edit_time)
+    """.format(table))
+    conn.execute("""
+      create index if not exists {0}_edit_time_idx on {0} (edit_time)
+    """.format(table))
+    conn.execute("""
+      create index if not exists {0}_edit_loc_idx on {0} (edit_loc, edit_time)
+    """.format(table))
+    if table == 'span_tag':
         conn.execute("""
-          create table span_tag (
-            edit_time integer primary key not null,
-            edit_loc int not null,
-            span_id int not null,
-            name text not null,
-            active int not null
-          )
+          create index if not exists span_tag_tag_id_idx on span_tag (tag_id)
         """)
+
+
+def create_indexes(conn):
+    """Create the secondary indexes of the edit tables, if missing."""
+    create_edit_indexes(conn, 'span')
+    create_edit_indexes(conn, 'span_tag')
+    conn.execute("""
+      create index if not exists span_started_idx on span (started)
+    """)
+
+
+def drop_indexes(conn):
+    """Drop the indexes made by `create_indexes`."""
+    for row in conn.execute("""
+      select name from sqlite_master
+        where type = 'index'
+          and tbl_name in ('span', 'span_tag')
+          and sql is not null
+    """).fetchall():
+        conn.execute('drop index {}'.format(row[0]))
+
+
+def create_current_tables(conn):
+    """Create the materialized current-state tables and their triggers.
+
+    `current_span` and `current_span_tag` hold only the newest edit of each
+    span and of each (span, tag) pair, and are kept up to date by insert
+    triggers on `span` and `span_tag`, so reading the current state doesn't
+    depend on the length of the edit history.
+    """
+    conn.execute("""
+      create table current_span (
+        span_id integer primary key not null,
+        edit_time int not null,
+        edit_loc int not null,
+        started int
+      )
+    """)
+    conn.execute("""
+      create table current_span_tag (
+        span_id int not null,
+        tag_id int not null,
+        edit_time int not null,
+        edit_loc int not null,
+        active int not null,
+        primary key (span_id, tag_id)
+      ) without rowid
+    """)
+    conn.execute("""
+      create index current_span_started_idx
+        on current_span (started, edit_time, edit_loc)
+    """)
+    conn.execute("""
+      create trigger span_current_trigger after insert on span
+      begin
+        insert into current_span
+          (span_id, edit_time, edit_loc, started)
+          values (new.span_id, new.edit_time, new.edit_loc, new.started)
+          on conflict (span_id) do update
+            set edit_time = excluded.edit_time,
+                edit_loc = excluded.edit_loc,
+                started = excluded.started
+            where excluded.edit_time > current_span.edit_time;
+      end
+    """)
+    conn.execute("""
+      create trigger span_tag_current_trigger after insert on span_tag
+      begin
+        insert into current_span_tag
+          (span_id, tag_id, edit_time, edit_loc, active)
+          values (new.span_id, new.tag_id, new.edit_time, new.edit_loc,
+                  new.active)
+          on conflict (span_id, tag_id) do update
+            set edit_time = excluded.edit_time,
+                edit_loc = excluded.edit_loc,
+                active = excluded.active
+            where excluded.edit_time > current_span_tag.edit_time;
+      end
+    """)
+
+
+CURRENT_SPAN_QUERY = """
+  select span_id, max(edit_time), edit_loc, started
+    from span
+    group by span_id
+"""
+
+CURRENT_SPAN_TAG_QUERY = """
+  select span_id, tag_id, max(edit_time), edit_loc, active
+    from span_tag
+    group by span_id, tag_id
+"""
+
+
+def rebuild_current_tables(conn):
+    """Recompute the current-state tables from the full edit history."""
+    with conn:
+        conn.execute('delete from current_span')
         conn.execute("""
-          create view current_span as
-            select *
-            from span as cur_span
-            where not exists(select 1
-              from span as newer_span
-              where newer_span.span_id = cur_span.span_id
-                and newer_span.edit_time > cur_span.edit_time)
-        """)
+          insert into current_span (span_id, edit_time, edit_loc, started)
+        """ + CURRENT_SPAN_QUERY)
+        conn.execute('delete from current_span_tag')
         conn.execute("""
-          create view current_span_tag as
-            select *
-            from span_tag as cur_span_tag
-            where not exists(select 1
-              from span_tag as newer_span_tag
-              where newer_span_tag.span_id = cur_span_tag.span_id
-                and newer_span_tag.name = cur_span_tag.name
-                and newer_span_tag.edit_time > cur_span_tag.edit_time)
-        """)
-        for table in 'span', 'span_tag':
-            conn.execute("""
-              create index {0}_span_id_idx on {0} (span_id, edit_time)
-            """.format(table))
+          insert into current_span_tag
+            (span_id, tag_id, edit_time, edit_loc, active)
+        """ + CURRENT_SPAN_TAG_QUERY)
+
+
+def check_current_tables(conn):
+    """Return whether the current-state tables match the edit history."""
+    for columns, table, query in [
+            ('span_id, edit_time, edit_loc, started',
+             'current_span', CURRENT_SPAN_QUERY),
+            ('span_id, tag_id, edit_time, edit_loc, active',
+             'current_span_tag', CURRENT_SPAN_TAG_QUERY)]:
+        stored = 'select {} from {}'.format(columns, table)
+        for first, second in (stored, query), (query, stored):
+            if conn.execute('select exists({} except {})'.format(
+                    first, second)).fetchone()[0]:
+                return False
+    return True
+
+
+def upgrade_tables(conn):
+    """Bring the schema of an existing database up to `SCHEMA_VERSION`.
+
+    The current-state tables are always recreated and rebuilt from history.
+    """
+    version = conn.execute('pragma user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    with conn:
+        conn.execute('begin')
+        for kind, name in conn.execute("""
+          select type, name from sqlite_master
+            where name in ('current_span', 'current_span_tag',
+                           'span_current_trigger', 'span_tag_current_trigger')
+        """).fetchall():
+            conn.execute('drop {} {}'.format(kind, name))
+        if version < 2:
+            create_tag_tables(conn, 'new_span_tag')
             conn.execute("""
-              create index {0}_edit_time_idx on {0} (edit_time)
-            """.format(table))
+              insert into tag (name)
+                select distinct name from span_tag order by name
+            """)
             conn.execute("""
-              create index {0}_edit_loc_idx on {0} (edit_loc, edit_time)
-            """.format(table))
-        conn.execute('create index span_started_idx on span (started)')
-        conn.execute('create index span_tag_name_idx on span_tag (name)')
+              insert into new_span_tag
+                  (edit_time, edit_loc, span_id, tag_id, active)
+                select edit_time, edit_loc, span_id, tag_id, active
+                  from span_tag join tag using (name)
+            """)
+            conn.execute('drop table span_tag')
+            conn.execute('alter table new_span_tag rename to span_tag')
+            create_edit_indexes(conn, 'span_tag')
+        create_current_tables(conn)
+        conn.execute('pragma user_version = {}'.format(SCHEMA_VERSION))
+        rebuild_current_tables(conn)
+
+
+PRAGMAS = {
+    'synchronous': ('off', 'normal', 'full', 'extra'),
+    'cache_size': int,
+    'mmap_size': int,
+    'temp_store': ('default', 'file', 'memory'),
+    'busy_timeout': int,
+}
+
+PRAGMA_DEFAULTS = {
+    'synchronous': 'normal',
+    'cache_size': -16000,
+    'mmap_size': 64 << 20,
+    'temp_store': 'memory',
+    'busy_timeout': 5000,
+}
+
+
+def connect(filename, readonly=False, check_same_thread=True, **pragmas):
+    """Open a connection to the database file `filename`, tuned for Alho.
+
+    Writable connections switch the file to WAL mode, so readers and the
+    writer don't block each other. `pragmas` override `PRAGMA_DEFAULTS`
+    for the names in `PRAGMAS`; ones given as `None` keep their default.
+    Raises `ValueError` for unknown pragmas or invalid values.
+    """
+    settings = dict(PRAGMA_DEFAULTS)
+    for name, value in pragmas.items():
+        if name not in PRAGMAS:
+            raise ValueError('Unknown pragma: %r' % name)
+        if value is not None:
+            settings[name] = value
+    for name, value in settings.items():
+        allowed = PRAGMAS[name]
+        if allowed is int:
+            settings[name] = int(value)
+        elif str(value).lower() in allowed:
+            settings[name] = str(value).lower()
+        else:
+            raise ValueError('Invalid {} pragma: {!r}'.format(name, value))
+    if readonly:
+        conn = sqlite3.connect(
+            'file:{}?mode=ro'.format(urllib.request.pathname2url(filename)),
+            uri=True, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(filename, check_same_thread=check_same_thread)
+        conn.execute('pragma journal_mode = wal')
+    for name, value in settings.items():
+        conn.execute('pragma {} = {}'.format(name, value))
+    return conn
+
+
+def add_pragma_arguments(parser):
+    """Add command-line options for the pragmas `connect` accepts."""
+    group = parser.add_argument_group('database tuning')
+    for name, allowed in PRAGMAS.items():
+        group.add_argument(
+            '--' + name.replace('_', '-'), type=allowed if allowed is int
+            else str.lower, choices=None if allowed is int else allowed,
+            help='SQLite {} pragma (default: {})'.format(
+                name, PRAGMA_DEFAULTS[name]))
+
+
+def pragmas_from_args(args):
+    """Return the pragmas given as options by `add_pragma_arguments`."""
+    return {name: getattr(args, name) for name in PRAGMAS}
+
+
+class ConnectionPool:
+    """Pool of up to `size` read-only `Database`s on one file.
+
+    Connections are opened as they're first needed and may be used from
+    any thread, though only by one at a time.
+    """
+
+    def __init__(self, filename, size, **pragmas):
+        self.filename = filename
+        self.pragmas = pragmas
+        self.idle = queue.LifoQueue()
+        self.available = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def database(self):
+        """Borrow a read-only `Database`, waiting if all are in use."""
+        with self.available:
+            try:
+                db = self.idle.get_nowait()
+            except queue.Empty:
+                db = Database(connect(self.filename, readonly=True,
+                                      check_same_thread=False,
+                                      **self.pragmas))
+            try:
+                yield db
+            finally:
+                self.idle.put(db)
+
+    def close(self):
+        """Close the connections not currently borrowed."""
+        while True:
+            try:
+                db = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            db.conn.close()
+
+
+class TagDictionary:
+    """Bidirectional in-memory cache of the `tag` table.
+
+    Tag ids are never reused or renumbered, so cached entries stay valid;
+    only names or ids we haven't seen yet are looked up.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.reset()
+
+    def reset(self):
+        self.ids = {}
+        self.names = {}
+
+    def _add(self, tag_id, name):
+        self.ids[name] = tag_id
+        self.names[tag_id] = name
+
+    def get_id(self, name, create=True):
+        """Return the id of the named tag.
+
+        If there is no such tag, creates one if `create` is true, or else
+        returns `None`. Creating a tag doesn't commit.
+        """
+        try:
+            return self.ids[name]
+        except KeyError:
+            pass
+        row = self.conn.execute('select tag_id from tag where name = ?',
+                                [name]).fetchone()
+        if row is not None:
+            tag_id = row[0]
+        elif create:
+            tag_id = self.conn.execute('insert into tag (name) values (?)',
+                                       [name]).lastrowid
+        else:
+            return None
+        self._add(tag_id, name)
+        return tag_id
+
+    def get_name(self, tag_id):
+        try:
+            return self.names[tag_id]
+        except KeyError:
+            pass
+        for found_id, name in self.conn.execute(
+                'select tag_id, name from tag where tag_id >= ?', [tag_id]):
+            self._add(found_id, name)
+        return self.names[tag_id]
 
 
 class Database:
 
+    MAX_PARAMS = 500
+
     def __init__(self, conn, location_id=None):
         self.conn = conn
+        self.timestamps = TimeStampAllocator(conn)
+        self.tags = TagDictionary(conn)
+        self._location_id = None
+        self._digest_cache = {}
+        self._tag_index = None
+        self._tag_index_spans = None
+        self._batch = None
+        self._listeners = []
+        self.readers = None
         if location_id is not None:
             self.location_id = location_id
 
+    @classmethod
+    def open(cls, filename, location_id=None, readers=2, **pragmas):
+        """Open the database file `filename`, creating it if needed.
+
+        The connection comes from `connect` with the given `pragmas`. A new
+        file gets the schema and, unless `location_id` is given, a random
+        location id; an existing one is upgraded. `readers` is the size of
+        the `ConnectionPool` of read-only connections set as `readers`.
+        """
+        conn = connect(filename, **pragmas)
+        if conn.execute('select count(*) from sqlite_master').fetchone()[0]:
+            upgrade_tables(conn)
+        else:
+            create_tables(conn)
+        db = cls(conn, location_id)
+        if db.location_id is None:
+            db.location_id = random.getrandbits(32) - 2**31
+        db.readers = ConnectionPool(filename, readers, **pragmas)
+        return db
+
+    def close(self):
+        if self.readers is not None:
+            self.readers.close()
+        self.conn.close()
+
     @property
     def location_id(self):
-        row = self.conn.execute('select loc_id from local_data').fetchone()
-        return row[0] if row else None
+        if self._location_id is None:
+            row = self.conn.execute('select loc_id from local_data').fetchone()
+            self._location_id = row[0] if row else None
+        return self._location_id
 
     @location_id.setter
     def location_id(self, value):
@@ -96,21 +469,22 @@ class Database:
                                   [value])
             else:
                 self.conn.execute('update local_data set loc_id = ?', [value])
+        self._location_id = value
+        self.timestamps.reset()
 
     def add_span(self):
         return self.set_span('new', 'now')
 
     def get_span_history(self, span_id, time_from=0, time_to=(2**31) - 1):
-        for row in self.conn.execute("""
+        yield from map(SpanRow.from_row, self.conn.execute("""
           select {}
             from span
             where span_id = ?
               and edit_time >= ?
               and edit_time < ?
             order by edit_time
-        """.format(SpanEdit.COLUMNS), [span_id,
-                                       time_from << 32, time_to << 32]):
-            yield SpanEdit.from_row(row)
+        """.format(SpanEdit.ROW_COLUMNS), [span_id,
+                                           time_from << 32, time_to << 32]))
 
     def get_span(self, span_id):
         cursor = self.conn.execute("""
@@ -135,59 +509,133 @@ class Database:
     def delete_span(self, span_id):
         return self.set_span(span_id, None)
 
-    def get_next_timestamp(self, table, when):
-        start = TimeStamp(when, self.location_id, 0)
-        start_int = start.as_int
-        last_int = self.conn.execute("""
-          select max(edit_time)
-            from {}
-            where edit_time >= ?
-              and edit_time < ? + 0xffff
-        """.format(table), [start_int, start_int]).fetchone()[0]
-        if last_int is None:
-            return start
+    def get_next_timestamp(self, when):
+        return self.reserve_timestamps(when, 1)
+
+    def reserve_timestamps(self, when, count):
+        """Reserve `count` consecutive edit timestamps.
+
+        Returns the first; the rest follow it by `TimeStamp.next`.
+        """
+        self._check_external_changes()
+        return self.timestamps.reserve(when, self.location_id, count)
+
+    def _check_external_changes(self):
+        if self.timestamps.check():
+            self._location_id = None
+            self._digest_cache.clear()
+
+    def _now(self):
+        if self._batch is not None:
+            return self._batch.now
+        return int(time.time())
+
+    def _write(self, edit):
+        if self._batch is not None:
+            self._batch.add(edit)
         else:
-            return TimeStamp.from_int(last_int).next
+            with self._transaction():
+                self.conn.execute(edit.INSERT, self._insert_row(edit))
+            self._index_spans([edit.span_id])
+            self._notify([edit_event(edit)])
+
+    def _insert_row(self, edit):
+        """Return the row to insert for `edit`, with its tag name interned.
+
+        Must be called within `_transaction`, as it may create tags.
+        """
+        row = edit.as_row
+        if edit.TABLE == TagEdit.TABLE:
+            row = row[:3] + (self.tags.get_id(edit.name), row[4])
+        return row
+
+    @contextmanager
+    def _transaction(self):
+        """Like ``with self.conn``, but forgets tags created on rollback."""
+        try:
+            with self.conn:
+                yield
+        except BaseException:
+            self.tags.reset()
+            raise
+
+    @contextmanager
+    def batch(self):
+        """Group edits into a single transaction.
+
+        Within the `with` block, `set_span`, `set_tag` and the methods built on
+        them queue their edits instead of writing them, all stamped with the
+        same time and consecutive counters. When the block exits normally the
+        queued edits are inserted together and committed once; if it raises,
+        they are discarded. Reads within the block don't see queued edits.
+        Nested batches join the outermost one. Listeners are notified of the
+        whole batch's changes at once, after it commits.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = batch = _Batch(int(time.time()))
+        try:
+            yield batch
+            with self._transaction():
+                for edit_type in SpanEdit, TagEdit:
+                    rows = [self._insert_row(edit) for edit in batch.edits
+                            if isinstance(edit, edit_type)]
+                    if rows:
+                        self.conn.executemany(edit_type.INSERT, rows)
+        finally:
+            self._batch = None
+        if batch.edits:
+            self._index_spans({edit.span_id for edit in batch.edits})
+            self._notify([edit_event(edit) for edit in batch.edits])
+
+    def add_listener(self, listener):
+        """Call `listener` with a list of change events after each commit.
+
+        The events are `SpanCreated`, `SpanMoved`, `SpanDeleted`, `TagAdded`
+        and `TagRemoved` for edits made through this `Database`, in the
+        order they were made, and `SpansImported` for `import_changes`.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, events):
+        for listener in self._listeners[:]:
+            listener(events)
 
     def set_span(self, span_id, started):
-        now = int(time.time())
+        now = self._now()
         if started == 'now':
             started = now
-        edited = self.get_next_timestamp('span', now)
+        edited = self.get_next_timestamp(now)
         if span_id == 'new':
             span_id = edited.as_int
         edit = SpanEdit(
             edited=edited,
             span_id=span_id,
             started=started)
-        with self.conn:
-            self.conn.execute("""
-              insert into span
-                ({})
-                values (?, ?, ?, ?)
-            """.format(SpanEdit.COLUMNS), edit.as_row)
+        self._write(edit)
         return edit
 
     def get_spans(self, time_from=-2**31, time_to=2**31-1):
-        for row in self.conn.execute("""
+        yield from map(SpanRow.from_row, self.conn.execute("""
           select {}
             from current_span
             where started between ? and ?
             order by started, edit_time
-        """.format(SpanEdit.COLUMNS), [time_from, time_to]):
-            yield SpanEdit.from_row(row)
+        """.format(SpanEdit.ROW_COLUMNS), [time_from, time_to]))
 
     def get_next_span(self, span_id):
         span = self.get_span(span_id)
         cursor = self.conn.execute("""
           select {}
             from current_span
-            where (started > ?
-                or (started = ? and edit_time > ?))
+            where (started, edit_time) > (?, ?)
             order by started, edit_time
             limit 1
-        """.format(SpanEdit.COLUMNS), [span.started, span.started,
-                                       span.edited.as_int])
+        """.format(SpanEdit.COLUMNS), [span.started, span.edited.as_int])
         row = cursor.fetchone()
         return SpanEdit.from_row(row) if row is not None else None
 
@@ -198,39 +646,602 @@ class Database:
         return self.set_tag(span_id, name, 0)
 
     def set_tag(self, span_id, name, active):
-        edited = self.get_next_timestamp('span_tag', int(time.time()))
+        edited = self.get_next_timestamp(self._now())
         edit = TagEdit(edited=edited,
                        span_id=span_id,
                        name=name,
                        active=active)
-        with self.conn:
-            self.conn.execute("""
-              insert into span_tag
-                ({})
-                values (?, ?, ?, ?, ?)
-            """.format(TagEdit.COLUMNS), edit.as_row)
+        self._write(edit)
         return edit
 
+    def get_tag_completions(self, prefix, limit=10):
+        """Return up to `limit` active tag names starting with `prefix`.
+
+        Names are ranked by how often they've been added to spans, favoring
+        recent uses. The index behind this is loaded on the first call,
+        unless `preload_tag_index` has loaded it already.
+        """
+        if self._tag_index is None:
+            self._tag_index = self.load_tag_index()
+        return self._tag_index.complete(prefix, limit)
+
+    def load_tag_index(self):
+        """Return a new `TagIndex` of the active tags on undeleted spans."""
+        index = TagIndex()
+        for span_id, tag_id, edit_time in self.conn.execute("""
+          select span_tag.span_id, span_tag.tag_id, span_tag.edit_time
+            from current_span_tag as span_tag
+              join current_span as span using (span_id)
+            where span_tag.active
+              and span.started is not null
+        """):
+            index.add(self.tags.get_name(tag_id), edit_time >> 32, span_id)
+        return index
+
+    def preload_tag_index(self, reader):
+        """Load the index for `get_tag_completions` through `reader`.
+
+        `reader` is an `AsyncDatabase` on the same file, so the index is
+        loaded without blocking this thread. Spans edited here while it
+        loads are updated in it when it arrives.
+        """
+        span_ids = self._tag_index_spans = set()
+
+        def use_index(index):
+            if self._tag_index_spans is span_ids:
+                self._tag_index_spans = None
+                self._tag_index = index
+                self._index_spans(span_ids)
+
+        def forget_spans(error):
+            log.error('Loading the tag index failed', exc_info=error)
+            if self._tag_index_spans is span_ids:
+                self._tag_index_spans = None
+        reader.call('load_tag_index', callback=use_index,
+                    errback=forget_spans)
+
+    def _index_spans(self, span_ids):
+        """Update the completion index with the committed tags of spans."""
+        if self._tag_index_spans is not None:
+            self._tag_index_spans.update(span_ids)
+        index = self._tag_index
+        if index is None:
+            return
+        span_ids = list(span_ids)
+        uses = {span_id: {} for span_id in span_ids}
+        for i in range(0, len(span_ids), self.MAX_PARAMS):
+            chunk = span_ids[i:i + self.MAX_PARAMS]
+            for span_id, tag_id, edit_time in self.conn.execute("""
+              select span_tag.span_id, span_tag.tag_id, span_tag.edit_time
+                from current_span_tag as span_tag
+                  join current_span as span using (span_id)
+                where span_tag.span_id in ({})
+                  and span_tag.active
+                  and span.started is not null
+            """.format(', '.join('?' * len(chunk))), chunk):
+                uses[span_id][self.tags.get_name(tag_id)] = edit_time >> 32
+        for span_id, span_uses in uses.items():
+            index.set_span(span_id, span_uses)
+
     def get_tags(self, span_id):
         cursor = self.conn.execute("""
-          select name
+          select tag_id
             from current_span_tag
             where span_id = ?
               and active
         """, [span_id])
-        return set(row[0] for row in cursor)
+        return set(self.tags.get_name(row[0]) for row in cursor)
+
+    def get_tags_for_spans(self, span_ids):
+        """Return a dict of each given span's set of active tags."""
+        span_ids = list(span_ids)
+        tags = {span_id: set() for span_id in span_ids}
+        for i in range(0, len(span_ids), self.MAX_PARAMS):
+            chunk = span_ids[i:i + self.MAX_PARAMS]
+            for span_id, tag_id in self.conn.execute("""
+              select span_id, tag_id
+                from current_span_tag
+                where span_id in ({})
+                  and active
+            """.format(', '.join('?' * len(chunk))), chunk):
+                tags[span_id].add(self.tags.get_name(tag_id))
+        return tags
+
+    def get_span_views(self, time_from=-2**31, time_to=2**31-1):
+        """Return a `SpanView` for each span started in the given range.
+
+        The result is the same as calling `get_spans`, `get_tags` and
+        `get_next_span` for each span, but takes only two queries.
+        """
+        cursor = self.conn.execute("""
+          with ordered as (
+            select {0},
+                lead(started) over (order by started, edit_time)
+                  as next_started
+              from current_span
+              where started between :from and coalesce(
+                (select min(started) from current_span where started > :to),
+                :to)
+          )
+          select {0}, next_started
+            from ordered
+            where started <= :to
+            order by started, edit_time
+        """.format(SpanEdit.COLUMNS), {'from': time_from, 'to': time_to})
+        views = [SpanView(SpanEdit.from_row(row[:-1]), set(), row[-1])
+                 for row in cursor]
+        by_span_id = {view.span_id: view for view in views}
+        for span_id, tag_id in self.conn.execute("""
+          select span.span_id, tag.tag_id
+            from current_span as span
+            join current_span_tag as tag
+              on tag.span_id = span.span_id
+            where span.started between ? and ?
+              and tag.active
+        """, [time_from, time_to]):
+            by_span_id[span_id].tags.add(self.tags.get_name(tag_id))
+        return views
+
+    def get_span_durations(self, time_from=-2**31, time_to=2**31-1):
+        """Yield a `SpanDuration` for each span overlapping the given range.
+
+        A span lasts until the next one starts, so this includes the span
+        that was ongoing at `time_from`. `ended` and `duration` aren't
+        clipped to the range, and are `None` for the last span. The spans
+        are read in index order, so nothing is sorted or held back however
+        long the range.
+        """
+        lower = self.conn.execute("""
+          select max(started) from current_span where started < ?
+        """, [time_from]).fetchone()[0]
+        previous = None
+        for span_id, started in self.conn.execute("""
+          select span_id, started
+            from current_span
+            where started >= ?
+            order by started, edit_time
+        """, [time_from if lower is None else lower]):
+            if previous is not None and (previous[1] >= time_from
+                                         or started > time_from):
+                yield SpanDuration(previous[0], previous[1], started,
+                                   started - previous[1])
+            if started >= time_to:
+                return
+            previous = span_id, started
+        if previous is not None:
+            yield SpanDuration(previous[0], previous[1], None, None)
+
+    def get_edit_locations(self):
+        """Return the sorted location ids that have made any edits."""
+        locations = []
+        for table in 'span', 'span_tag':
+            loc = -2**63
+            while True:
+                loc = self.conn.execute("""
+                  select min(edit_loc) from {} where edit_loc > ?
+                """.format(table), [loc]).fetchone()[0]
+                if loc is None:
+                    break
+                locations.append(loc)
+        return sorted(set(locations))
+
+    def export_changes(self, watermarks=None):
+        """Return a `ChangeStream` of all edits newer than `watermarks`.
+
+        `watermarks` maps location ids to the `edit_time` of the newest edit
+        already seen from that location. Locations not in it are exported in
+        full.
+        """
+        return ChangeStream(self, watermarks)
+
+    def import_changes(self, edits, chunk_size=10000):
+        """Insert edits from another replica, skipping ones already present.
+
+        `edits` may be any iterable of `SpanEdit`s and `TagEdit`s, such as a
+        `ChangeStream`; it's consumed `chunk_size` edits at a time, each
+        chunk in its own transaction. Returns an `ImportResult`.
+        """
+        inserted = duplicates = 0
+        edits = iter(edits)
+        while True:
+            rows = {SpanEdit: [], TagEdit: []}
+            times = {}
+            for edit in itertools.islice(edits, chunk_size):
+                row = edit.as_row
+                rows[TagEdit if edit.TABLE == TagEdit.TABLE
+                     else SpanEdit].append(edit)
+                low, high = times.get(row[1], (row[0], row[0]))
+                times[row[1]] = min(low, row[0]), max(high, row[0])
+            count = len(rows[SpanEdit]) + len(rows[TagEdit])
+            if not count:
+                break
+            self._forget_digests(times)
+            chunk_inserted = 0
+            with self._transaction():
+                for edit_type, type_edits in rows.items():
+                    if type_edits:
+                        chunk_inserted += self.conn.executemany(
+                            edit_type.INSERT_OR_IGNORE,
+                            map(self._insert_row, type_edits)).rowcount
+            if chunk_inserted:
+                span_ids = frozenset(edit.span_id
+                                     for type_edits in rows.values()
+                                     for edit in type_edits)
+                self._index_spans(span_ids)
+                self._notify([SpansImported(span_ids)])
+            inserted += chunk_inserted
+            duplicates += count
+        self.timestamps.reset()
+        return ImportResult(inserted, duplicates - inserted)
+
+    def bulk_load(self, spans, chunk_size=10000, rebuild_indexes=False):
+        """Add many new spans and their tags at once.
+
+        `spans` is an iterable of ``(started, tags)`` pairs, where `tags` is
+        an iterable of tag names. It's consumed `chunk_size` spans at a time,
+        and each chunk is inserted in one transaction, with its timestamps
+        reserved in blocks. With `rebuild_indexes`, the secondary indexes
+        of the edit tables are dropped during the load and created again
+        after, which is faster when adding more than there already is.
+        Listeners get a `SpansImported` for each chunk. Returns a
+        `BulkLoadResult`.
+        """
+        now = int(time.time())
+        spans = iter(spans)
+        span_count = tag_count = 0
+        if rebuild_indexes:
+            with self.conn:
+                drop_indexes(self.conn)
+        try:
+            while True:
+                chunk = [(started, list(dict.fromkeys(tags)))
+                         for started, tags
+                         in itertools.islice(spans, chunk_size)]
+                if not chunk:
+                    break
+                loc = self.location_id
+                span_ids = self.reserve_timestamps(
+                    now, len(chunk)).as_ints(len(chunk))
+                tags_in_chunk = sum(len(tags) for _, tags in chunk)
+                tag_times = iter(self.reserve_timestamps(
+                    now, tags_in_chunk).as_ints(tags_in_chunk)
+                    if tags_in_chunk else ())
+                with self._transaction():
+                    get_id = self.tags.get_id
+                    self.conn.executemany(SpanEdit.INSERT, [
+                        (span_id, loc, span_id, started)
+                        for span_id, (started, _) in zip(span_ids, chunk)])
+                    self.conn.executemany(TagEdit.INSERT, [
+                        (next(tag_times), loc, span_id, get_id(name), 1)
+                        for span_id, (_, tags) in zip(span_ids, chunk)
+                        for name in tags])
+                span_count += len(chunk)
+                tag_count += tags_in_chunk
+                self._index_spans(span_ids)
+                self._notify([SpansImported(frozenset(span_ids))])
+        finally:
+            if rebuild_indexes:
+                with self.conn:
+                    create_indexes(self.conn)
+        return BulkLoadResult(span_count, tag_count)
+
+    def compact(self, horizon, chunk_size=1000):
+        """Drop history older than `horizon` that no longer matters.
+
+        Runs all of `compact_steps` and returns the number of edits dropped.
+        """
+        return sum(self.compact_steps(horizon, chunk_size))
+
+    def compact_steps(self, horizon, chunk_size=1000):
+        """Generator that compacts history older than `horizon`, in steps.
+
+        Of the edits before `horizon` (a time in seconds), only the newest
+        one of each span and of each span's tag is kept, and spans deleted
+        or tags removed before `horizon` are dropped entirely. Each step is
+        one transaction touching at most about `chunk_size` edits, and
+        yields the number of edits dropped, so a caller can interleave
+        other work between steps.
+
+        Only compact before a horizon every replica has already received;
+        importing the dropped edits back from another replica afterwards
+        could resurrect deleted spans.
+        """
+        edit_horizon = horizon << 32
+        self._digest_cache.clear()
+        for table, key_columns in [('span', ['span_id']),
+                                   ('span_tag', ['span_id', 'tag_id'])]:
+            yield from self._compact_chunks(edit_horizon, chunk_size, """
+              select edit_time
+                from {0}
+                where edit_time > ?
+                  and edit_time < ?
+                order by edit_time
+                limit ?
+            """.format(table), """
+              delete from {0}
+                where edit_time in ({{0}})
+                  and exists(select 1
+                    from {0} as newer
+                    where {1}
+                      and newer.edit_time > {0}.edit_time
+                      and newer.edit_time < ?)
+            """.format(table, ' and '.join(
+                'newer.{0} = {1}.{0}'.format(column, table)
+                for column in key_columns)))
+        yield from self._compact_chunks(edit_horizon, chunk_size, """
+          select span_id
+            from current_span
+            where span_id > ?
+              and edit_time < ?
+              and started is null
+            order by span_id
+            limit ?
+        """, """
+          delete from span where span_id in ({0}) and edit_time < ?
+        """, """
+          delete from span_tag where span_id in ({0}) and edit_time < ?
+        """, current_sql=["""
+          delete from current_span_tag
+            where span_id in ({0}) and edit_time < ?
+        """, """
+          delete from current_span where span_id in ({0}) and edit_time < ?
+        """])
+        yield from self._compact_chunks(edit_horizon, chunk_size, """
+          select edit_time
+            from span_tag
+            where edit_time > ?
+              and edit_time < ?
+              and not active
+            order by edit_time
+            limit ?
+        """, """
+          delete from span_tag
+            where edit_time in ({0})
+              and not exists(select 1
+                from current_span_tag as cur
+                where cur.span_id = span_tag.span_id
+                  and cur.tag_id = span_tag.tag_id)
+        """, current_sql=["""
+          delete from current_span_tag
+            where (span_id, tag_id, edit_time) in (select span_id, tag_id,
+                                                          edit_time
+                from span_tag
+                where edit_time in ({0}))
+        """])
+
+    def _compact_chunks(self, edit_horizon, chunk_size, select_sql,
+                        *delete_sql, current_sql=()):
+        """Run `delete_sql` on successive chunks of keys from `select_sql`.
+
+        `select_sql` takes the previous chunk's last key, `edit_horizon` and
+        `chunk_size`. In the `current_sql` statements, then the `delete_sql`
+        ones, ``{0}`` is replaced by the chunk's keys, and any other
+        parameter is `edit_horizon`. Yields the number of edits deleted by
+        `delete_sql` in each chunk.
+        """
+        last = -2**63
+        while True:
+            keys = [row[0] for row in self.conn.execute(
+                select_sql, [last, edit_horizon, chunk_size])]
+            if not keys:
+                return
+            last = keys[-1]
+            placeholders = ', '.join('?' * len(keys))
+            dropped = 0
+            with self.conn:
+                for sql in list(current_sql) + list(delete_sql):
+                    params = keys + [edit_horizon] * sql.count('?')
+                    cursor = self.conn.execute(sql.format(placeholders),
+                                               params)
+                    if sql in delete_sql:
+                        dropped += cursor.rowcount
+            yield dropped
+
+    def get_location_edits(self, edit_type, loc, since=None, until=None):
+        """Yield the edits from one location, oldest first.
+
+        If `since` is given, only edits with a greater `edit_time` are
+        included; if `until` is given, only those with one no greater.
+        """
+        sql = """
+          select {}
+            from {}
+            where edit_loc = ?
+        """.format(edit_type.ROW_COLUMNS, edit_type.SOURCE)
+        params = [loc]
+        if since is not None:
+            sql += ' and edit_time > ?'
+            params.append(since)
+        if until is not None:
+            sql += ' and edit_time <= ?'
+            params.append(until)
+        yield from map(edit_type.ROW.from_row,
+                       self.conn.execute(sql + ' order by edit_time', params))
+
+    def get_merged_location_edits(self, loc, since=None, until=None):
+        """Like `get_location_edits`, but for both kinds of edit at once."""
+        return heapq.merge(
+            self.get_location_edits(SpanEdit, loc, since, until),
+            self.get_location_edits(TagEdit, loc, since, until),
+            key=lambda edit: edit.edit_time)
+
+    def get_digest(self, loc, bucket=None):
+        """Return a `Digest` of one location's edits within a `DigestBucket`.
+
+        Two replicas have the same edits from `loc` in `bucket` exactly when
+        their digests match. Digests of buckets with many edits are built
+        from those of their children, so mismatching digests can be narrowed
+        down by comparing `bucket.children`. Digests of buckets that ended
+        more than `DIGEST_CLOSED_AGE` seconds ago are cached.
+        """
+        if bucket is None:
+            bucket = DigestBucket.ROOT
+        self._check_external_changes()
+        key = loc, bucket
+        try:
+            return self._digest_cache[key]
+        except KeyError:
+            pass
+        first, last = bucket.edit_time_range
+        count = sum(self.conn.execute("""
+          select count(*)
+            from {}
+            where edit_loc = ?
+              and edit_time between ? and ?
+        """.format(table), [loc, first, last]).fetchone()[0]
+            for table in ('span', 'span_tag'))
+        digest = hashlib.sha1()
+        if count > DIGEST_LEAF_EDITS and bucket.children:
+            for child in bucket.children:
+                digest.update(self.get_digest(loc, child).hash)
+        else:
+            for edit in self.get_bucket_edits(loc, bucket):
+                digest.update(repr(edit.as_row).encode('utf-8'))
+        result = Digest(count, digest.digest())
+        if bucket.end <= time.time() - DIGEST_CLOSED_AGE:
+            self._digest_cache[key] = result
+        return result
+
+    def get_bucket_edits(self, loc, bucket):
+        """Yield one location's edits within a `DigestBucket`, oldest first."""
+        first, last = bucket.edit_time_range
+        return self.get_merged_location_edits(
+            loc, first - 1 if first > -2**63 else None, last)
+
+    def _forget_digests(self, times):
+        """Drop cached digests covering any of the given edit times.
+
+        `times` maps locations to ``(low, high)`` edit_time ranges.
+        """
+        for loc, bucket in list(self._digest_cache):
+            if loc in times:
+                first, last = bucket.edit_time_range
+                low, high = times[loc]
+                if low <= last and high >= first:
+                    del self._digest_cache[loc, bucket]
 
     def get_tag_history(self, span_id, time_from=-2**31, time_to=2**31-1):
-        for row in self.conn.execute("""
+        yield from map(TagRow.from_row, self.conn.execute("""
           select {}
-            from span_tag
+            from {}
             where span_id = ?
               and edit_time >= ?
               and edit_time < ?
             order by edit_time
-        """.format(TagEdit.COLUMNS), [span_id,
-                                      time_from << 32, time_to << 32]):
-            yield TagEdit.from_row(row)
+        """.format(TagEdit.ROW_COLUMNS, TagEdit.SOURCE), [
+                span_id, time_from << 32, time_to << 32]))
+
+
+class _Batch:
+
+    def __init__(self, now):
+        self.now = now
+        self.edits = []
+
+    def add(self, edit):
+        self.edits.append(edit)
+
+
+class TimeStampAllocator:
+    """Issues increasing edit `TimeStamp`s without querying on every write.
+
+    Both edit tables share one sequence per location, so the edit times of
+    a location are unique across them, and increase in the order the edits
+    are made, as the watermarks of `ChangeStream` need. Edit times only
+    hold the low 16 bits of the location, so locations that share them
+    share a sequence. The last timestamp issued for each sequence is
+    remembered, so only the first allocation after startup, or after
+    another connection has written to the database (detected with
+    ``PRAGMA data_version``), has to look up the latest existing edit.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._last = {}
+        self._data_version = None
+
+    def check(self):
+        """Forget what we know if another connection changed the database.
+
+        Returns whether anything was forgotten.
+        """
+        version = self.conn.execute('pragma data_version').fetchone()[0]
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        self.reset()
+        return True
+
+    def reset(self):
+        self._last.clear()
+
+    def _seed(self, when, loc):
+        """Return the last edit time of `loc`'s sequence that matters.
+
+        That's the later of `loc`'s own last edit, and the last edit from
+        `when` on by any location with the same low bits.
+        """
+        params = [loc, loc] + [TimeStamp(when, loc, 0).as_int,
+                               loc & 0xffff] * 2
+        last_int = self.conn.execute("""
+          select max(edit_time)
+            from (select max(edit_time) as edit_time
+                    from span
+                    where edit_loc = ?
+                  union all
+                  select max(edit_time)
+                    from span_tag
+                    where edit_loc = ?
+                  union all
+                  select max(edit_time)
+                    from span
+                    where edit_time >= ?
+                      and (edit_time >> 16) & 0xffff = ?
+                  union all
+                  select max(edit_time)
+                    from span_tag
+                    where edit_time >= ?
+                      and (edit_time >> 16) & 0xffff = ?)
+        """, params).fetchone()[0]
+        if last_int is None:
+            return None
+        return TimeStamp.from_int(last_int, loc)
+
+    def reserve(self, when, loc, count=1):
+        """Reserve `count` consecutive timestamps no earlier than `when`.
+
+        Returns the first of them.
+        """
+        try:
+            last = self._last[loc & 0xffff]._replace(loc=loc)
+        except KeyError:
+            last = self._seed(when, loc)
+        first = TimeStamp(when, loc, 0)
+        if last is not None and last >= first:
+            first = last.next
+        self._last[loc & 0xffff] = first.advanced(count - 1)
+        return first
+
+
+class ChangeStream:
+    """Iterable of the `SpanEdit`s and `TagEdit`s newer than some watermarks.
+
+    Edits are grouped by location, and within each location come in
+    `edit_time` order. `watermarks` starts as a copy of the given watermarks
+    and is advanced as each edit is yielded, so after a full or partial
+    iteration it holds the watermarks to pass to the next export.
+    """
+
+    def __init__(self, db, watermarks):
+        self.db = db
+        self.watermarks = dict(watermarks or {})
+
+    def __iter__(self):
+        for loc in self.db.get_edit_locations():
+            since = self.watermarks.get(loc)
+            for edit in self.db.get_merged_location_edits(loc, since):
+                self.watermarks[loc] = edit.edit_time
+                yield edit
 
 
 class TimeStamp(namedtuple('TimeStamp', ['time', 'loc', 'ctr'])):
@@ -240,10 +1251,12 @@ class TimeStamp(namedtuple('TimeStamp', ['time', 'loc', 'ctr'])):
         return self.time << 32 | (self.loc & 0xffff) << 16 | self.ctr
 
     @classmethod
-    def from_int(cls, i):
-        loc = (i >> 16) & 0xffff
-        if loc >= 0x8000:
-            loc -= 0x10000
+    def from_int(cls, i, loc=None):
+        """Decode `as_int`, optionally giving the full location id."""
+        if loc is None:
+            loc = (i >> 16) & 0xffff
+            if loc >= 0x8000:
+                loc -= 0x10000
         t = (i >> 32) & 0xffffffff
         if t >= 0x80000000:
             t -= 0x100000000
@@ -255,29 +1268,288 @@ class TimeStamp(namedtuple('TimeStamp', ['time', 'loc', 'ctr'])):
             return self._replace(time=self.time + 1, ctr=0)
         return self._replace(ctr=self.ctr + 1)
 
+    def advanced(self, count):
+        """Return the timestamp `count` steps of `next` after this one."""
+        time, ctr = divmod(self.ctr + count, 0x10000)
+        return self._replace(time=self.time + time, ctr=ctr)
+
+    def as_ints(self, count):
+        """Return the `as_int` of this and the next `count - 1` stamps."""
+        ints = []
+        time, ctr = self.time, self.ctr
+        while len(ints) < count:
+            start = time << 32 | (self.loc & 0xffff) << 16 | ctr
+            ints.extend(range(start, start + min(count - len(ints),
+                                                 0x10000 - ctr)))
+            time += 1
+            ctr = 0
+        return ints
+
 
 class SpanEdit(namedtuple('SpanEdit', ['edited', 'span_id', 'started'])):
+    TABLE = 'span'
+    SOURCE = 'span'
     COLUMNS = 'edit_time, edit_loc, span_id, started'
+    ROW_COLUMNS = 'edit_time, span_id, started, edit_loc'
+    INSERT = 'insert into span ({}) values (?, ?, ?, ?)'.format(COLUMNS)
+    INSERT_OR_IGNORE = INSERT.replace('insert', 'insert or ignore', 1)
 
     @classmethod
     def from_row(cls, row):
-        return cls(TimeStamp.from_int(row[0]), *row[2:])
+        return cls(TimeStamp.from_int(row[0], row[1]), *row[2:])
 
     @property
     def as_row(self):
         return (self.edited.as_int, self.edited.loc,
                 self.span_id, self.started)
 
+    @property
+    def edit_time(self):
+        return self.edited.as_int
+
+    @property
+    def edit_loc(self):
+        return self.edited.loc
 
-class TagEdit(namedtuple('TagEdit', ['edited', 'span_id', 'name', 'active'])):
 
+class TagEdit(namedtuple('TagEdit', ['edited', 'span_id', 'name', 'active'])):
+    TABLE = 'span_tag'
+    SOURCE = 'span_tag join tag using (tag_id)'
     COLUMNS = 'edit_time, edit_loc, span_id, name, active'
+    ROW_COLUMNS = 'edit_time, span_id, name, active, edit_loc'
+    INSERT = '''
+      insert into span_tag (edit_time, edit_loc, span_id, tag_id, active)
+        values (?, ?, ?, ?, ?)
+    '''
+    INSERT_OR_IGNORE = INSERT.replace('insert', 'insert or ignore', 1)
 
     @classmethod
     def from_row(cls, row):
-        return cls(TimeStamp.from_int(row[0]), *row[2:])
+        return cls(TimeStamp.from_int(row[0], row[1]), *row[2:])
 
     @property
     def as_row(self):
         return (self.edited.as_int, self.edited.loc,
                 self.span_id, self.name, self.active)
+
+    @property
+    def edit_time(self):
+        return self.edited.as_int
+
+    @property
+    def edit_loc(self):
+        return self.edited.loc
+
+
+class _EditRow:
+    """Base of the lazy, read-only versions of the edit namedtuples.
+
+    Rows hold the raw ``ROW_COLUMNS`` of a query in slots, and only build
+    the `TimeStamp` when `edited` is read. They aren't tuples, but compare,
+    hash, iterate, index and pickle as the namedtuple `EDIT` of the same
+    values would; `as_edit` converts one.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @property
+    def edited(self):
+        return TimeStamp.from_int(self.edit_time, self.edit_loc)
+
+    @property
+    def as_edit(self):
+        return self.EDIT._make(self._values())
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        return iter(self._values())
+
+    def __getitem__(self, index):
+        return self._values()[index]
+
+    def __contains__(self, value):
+        return value in self._values()
+
+    def count(self, value):
+        return self._values().count(value)
+
+    def index(self, value, *args):
+        return self._values().index(value, *args)
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __eq__(self, other):
+        return self._values() == _values(other)
+
+    def __ne__(self, other):
+        return self._values() != _values(other)
+
+    def __lt__(self, other):
+        return self._values() < _values(other)
+
+    def __le__(self, other):
+        return self._values() <= _values(other)
+
+    def __gt__(self, other):
+        return self._values() > _values(other)
+
+    def __ge__(self, other):
+        return self._values() >= _values(other)
+
+    def __repr__(self):
+        return repr(self.as_edit)
+
+    def __reduce__(self):
+        return self.EDIT, self._values()
+
+    def _replace(self, **kwargs):
+        return self.as_edit._replace(**kwargs)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self._values()))
+
+
+def _values(edit):
+    """Return the values of `edit` as a tuple, if it's an `_EditRow`."""
+    if isinstance(edit, _EditRow):
+        return edit._values()
+    return edit
+
+
+class SpanRow(_EditRow):
+    """A `SpanEdit` read from the database by a bulk scan."""
+
+    __slots__ = ('edit_time', 'span_id', 'started', 'edit_loc')
+    EDIT = SpanEdit
+    TABLE = SpanEdit.TABLE
+    _fields = SpanEdit._fields
+
+    def __init__(self, edit_time, span_id, started, edit_loc):
+        self.edit_time = edit_time
+        self.span_id = span_id
+        self.started = started
+        self.edit_loc = edit_loc
+
+    @property
+    def as_row(self):
+        return self.edit_time, self.edit_loc, self.span_id, self.started
+
+    def _values(self):
+        return self.edited, self.span_id, self.started
+
+
+class TagRow(_EditRow):
+    """A `TagEdit` read from the database by a bulk scan."""
+
+    __slots__ = ('edit_time', 'span_id', 'name', 'active', 'edit_loc')
+    EDIT = TagEdit
+    TABLE = TagEdit.TABLE
+    _fields = TagEdit._fields
+
+    def __init__(self, edit_time, span_id, name, active, edit_loc):
+        self.edit_time = edit_time
+        self.span_id = span_id
+        self.name = name
+        self.active = active
+        self.edit_loc = edit_loc
+
+    @property
+    def as_row(self):
+        return (self.edit_time, self.edit_loc, self.span_id, self.name,
+                self.active)
+
+    def _values(self):
+        return self.edited, self.span_id, self.name, self.active
+
+
+SpanEdit.ROW = SpanRow
+TagEdit.ROW = TagRow
+
+
+def edit_event(edit):
+    """Return the change event for an edit made through a `Database`."""
+    if edit.TABLE == TagEdit.TABLE:
+        event_type = TagAdded if edit.active else TagRemoved
+        return event_type(edit.span_id, edit.name)
+    if edit.started is None:
+        return SpanDeleted(edit.span_id)
+    if edit.span_id == edit.edited.as_int:
+        return SpanCreated(edit.span_id, edit.started)
+    return SpanMoved(edit.span_id, edit.started)
+
+
+SpanCreated = namedtuple('SpanCreated', ['span_id', 'started'])
+SpanMoved = namedtuple('SpanMoved', ['span_id', 'started'])
+SpanDeleted = namedtuple('SpanDeleted', ['span_id'])
+TagAdded = namedtuple('TagAdded', ['span_id', 'name'])
+TagRemoved = namedtuple('TagRemoved', ['span_id', 'name'])
+SpansImported = namedtuple('SpansImported', ['span_ids'])
+
+
+DIGEST_FANOUT_BITS = 4
+DIGEST_LEAF_BITS = 12
+DIGEST_LEAF_EDITS = 64
+DIGEST_CLOSED_AGE = 3600
+
+
+class DigestBucket(namedtuple('DigestBucket', ['bits', 'start'])):
+    """Edit times from `start` up to `start + 2 ** bits` seconds.
+
+    Buckets form a tree: the root covers every possible time, and each
+    bucket bigger than ``2 ** DIGEST_LEAF_BITS`` seconds is split into
+    ``2 ** DIGEST_FANOUT_BITS`` equal children.
+    """
+
+    @property
+    def end(self):
+        return self.start + (1 << self.bits)
+
+    @property
+    def edit_time_range(self):
+        """Inclusive `edit_time` bounds of this bucket."""
+        return self.start << 32, (self.end << 32) - 1
+
+    @property
+    def children(self):
+        if self.bits <= DIGEST_LEAF_BITS:
+            return []
+        bits = self.bits - DIGEST_FANOUT_BITS
+        return [DigestBucket(bits, self.start + (i << bits))
+                for i in range(1 << DIGEST_FANOUT_BITS)]
+
+
+DigestBucket.ROOT = DigestBucket(32, -2**31)
+
+Digest = namedtuple('Digest', ['count', 'hash'])
+
+ImportResult = namedtuple('ImportResult', ['inserted', 'duplicates'])
+
+BulkLoadResult = namedtuple('BulkLoadResult', ['spans', 'tags'])
+
+SpanDuration = namedtuple('SpanDuration',
+                          ['span_id', 'started', 'ended', 'duration'])
+
+
+class SpanView(namedtuple('SpanView', ['edit', 'tags', 'next_started'])):
+    """A span's current state, active tags, and the start of the next span."""
+
+    @property
+    def span_id(self):
+        return self.edit.span_id
+
+    @property
+    def started(self):
+        return self.edit.started
+
+    @property
+    def elapsed(self):
+        if self.next_started is None:
+            return None
+        return self.next_started - self.edit.started
@@ -0,0 +1,123 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Streaming export of spans and edits as CSV or JSON lines.
+
+Records are produced by generators reading straight from SQLite cursors,
+and written as they come, so memory use doesn't grow with the export.
+"""
+
+
+import csv
+import datetime
+import itertools
+import json
+
+from .db import SpanEdit
+
+
+SPAN_FIELDS = ['span_id', 'start', 'end', 'duration', 'tags']
+EDIT_FIELDS = ['edit_time', 'edit_loc', 'ctr', 'span_id', 'start', 'tag',
+               'active']
+
+
+def iso_time(t):
+    """Format the time `t` in ISO 8601, in local time with its offset."""
+    if t is None:
+        return None
+    return datetime.datetime.fromtimestamp(
+        t, datetime.timezone.utc).astimezone().isoformat()
+
+
+def epoch_time(t):
+    return t
+
+
+TIME_FORMATS = {'iso': iso_time, 'epoch': epoch_time}
+
+
+def span_records(db, time_from=-2**31, time_to=2**31-1,
+                 format_time=iso_time):
+    """Yield a record per span overlapping ``[time_from, time_to)``.
+
+    Records are tuples of `SPAN_FIELDS`, with the tag names sorted. As in
+    `Database.get_span_durations`, times aren't clipped to the range, and
+    the last span has no end or duration.
+    """
+    spans = db.get_span_durations(time_from, time_to)
+    while True:
+        chunk = list(itertools.islice(spans, db.MAX_PARAMS))
+        if not chunk:
+            return
+        tags = db.get_tags_for_spans(span.span_id for span in chunk)
+        for span in chunk:
+            yield (span.span_id, format_time(span.started),
+                   format_time(span.ended), span.duration,
+                   sorted(tags[span.span_id]))
+
+
+def edit_records(db, time_from=-2**31, time_to=2**31-1,
+                 format_time=iso_time):
+    """Yield a record per edit made in ``[time_from, time_to)``.
+
+    Records are tuples of `EDIT_FIELDS`. Span edits have no `tag` or
+    `active`, and tag edits no `start`. Edits are grouped by location, and
+    within each location come in order.
+    """
+    since = (time_from << 32) - 1 if time_from > -2**31 else None
+    until = (time_to << 32) - 1 if time_to < 2**31 - 1 else None
+    for loc in db.get_edit_locations():
+        for edit in db.get_merged_location_edits(loc, since, until):
+            edited = edit.edited
+            if edit.TABLE == SpanEdit.TABLE:
+                yield (format_time(edited.time), loc, edited.ctr,
+                       edit.span_id, format_time(edit.started), None, None)
+            else:
+                yield (format_time(edited.time), loc, edited.ctr,
+                       edit.span_id, None, edit.name, edit.active)
+
+
+def write_csv(records, fields, out):
+    """Write `records` to the text file `out` as CSV, returning the count.
+
+    Lists are written as their items separated by spaces.
+    """
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    count = 0
+    for record in records:
+        writer.writerow([' '.join(value) if isinstance(value, list)
+                         else value for value in record])
+        count += 1
+    return count
+
+
+def write_jsonl(records, fields, out):
+    """Write `records` to `out` as JSON objects, one per line.
+
+    Returns the count.
+    """
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    count = 0
+    for record in records:
+        out.write(encode(dict(zip(fields, record))))
+        out.write('\n')
+        count += 1
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
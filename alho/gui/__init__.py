@@ -15,39 +15,48 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import re
+import logging
 import time
 import tkinter as tk
 from datetime import timedelta
 from tkinter.ttk import Button, Frame, Label
 
-from .util import change_state, SavableEntry, DateChooser
+from ..db import SpanCreated, SpanMoved, SpanView, TagAdded, TagRemoved
+from ..tags import tag_str_to_set
+from .util import change_state, CompletionList, SavableEntry, DateChooser
 
 
-TAG_STR_SPLIT_REGEX = re.compile(r'[\s;,]+')
-TAG_NAME_REGEX = re.compile(r'^[-\w.&?!]+$')
+log = logging.getLogger(__name__)
 
 
-def tag_str_to_set(tag_str):
-    tag_set = set()
-    for name in TAG_STR_SPLIT_REGEX.split(tag_str.lower()):
-        if name:
-            if TAG_NAME_REGEX.match(name):
-                tag_set.add(name)
-            else:
-                raise ValueError('Invalid tag name: %r' % name)
-    return tag_set
+TAG_WORD_REGEX = r'[-\w.&?!]*$'
+TAG_COMPLETIONS = 8
 
 
 def tag_set_to_str(tag_set):
     return ', '.join(sorted(tag_set))
 
 
+def add_tag_completion(savable, db):
+    """Offer completions of tag names from `db` in a `SavableEntry`."""
+    def complete(prefix):
+        try:
+            present = tag_str_to_set(savable.edited_value)
+        except ValueError:
+            present = set()
+        names = db.get_tag_completions(prefix.lower(),
+                                       TAG_COMPLETIONS + len(present))
+        return [name for name in names if name not in present][
+            :TAG_COMPLETIONS]
+    return CompletionList(savable, complete, TAG_WORD_REGEX)
+
+
 class SpanTagEntry(SavableEntry):
 
     def __init__(self, span):
         super().__init__(span.widget)
         self.span = span
+        self.completions = add_tag_completion(self, span.db)
 
     def normalize(self, value):
         return tag_set_to_str(tag_str_to_set(value))
@@ -55,15 +64,17 @@ class SpanTagEntry(SavableEntry):
     def save(self):
         old_tags = tag_str_to_set(self.external_value)
         new_tags = tag_str_to_set(self.edited_value)
-        for tag in old_tags - new_tags:
-            self.span.db.remove_tag(self.span.span_id, tag)
-        for tag in new_tags - old_tags:
-            self.span.db.add_tag(self.span.span_id, tag)
+        with self.span.db.batch():
+            for tag in old_tags - new_tags:
+                self.span.db.remove_tag(self.span.span_id, tag)
+            for tag in new_tags - old_tags:
+                self.span.db.add_tag(self.span.span_id, tag)
         super().save()
 
-    def refresh(self):
-        self.external_value = tag_set_to_str(
-            self.span.db.get_tags(self.span.span_id))
+    def refresh(self, tags=None):
+        if tags is None:
+            tags = self.span.db.get_tags(self.span.span_id)
+        self.external_value = tag_set_to_str(tags)
 
 
 TIME_FMT = '%Y-%m-%d %H:%M:%S'
@@ -95,17 +106,19 @@ class SpanStartEntry(SavableEntry):
             self.span.db.set_span(self.span.span_id, new_int)
         super().save()
 
-    def refresh(self):
-        self.external_value = time_int_to_str(
-            self.span.db.get_span(self.span.span_id).started)
+    def refresh(self, started=None):
+        if started is None:
+            started = self.span.db.get_span(self.span.span_id).started
+        self.external_value = time_int_to_str(started)
 
 
 class SpanWidget:
 
-    def __init__(self, master, db, span_id):
+    def __init__(self, master, db, span_id, view=None):
         self.widget = Frame(master)
         self.db = db
         self.span_id = span_id
+        self.view = None
 
         self.start_entry = SpanStartEntry(self)
         self.start_entry.widget.pack(side=tk.LEFT)
@@ -116,17 +129,25 @@ class SpanWidget:
         self.tag_entry = SpanTagEntry(self)
         self.tag_entry.widget.pack(side=tk.LEFT, fill=tk.X)
 
-        self.refresh()
+        self.refresh(view)
 
-    def refresh(self):
-        self.start_entry.refresh()
-        self.tag_entry.refresh()
+    def load_view(self):
         next_span = self.db.get_next_span(self.span_id)
-        if next_span is None:
+        return SpanView(self.db.get_span(self.span_id),
+                        self.db.get_tags(self.span_id),
+                        next_span.started if next_span is not None else None)
+
+    def refresh(self, view=None):
+        """Show the given `SpanView`, or this span's view from the DB."""
+        if view is None:
+            view = self.load_view()
+        self.view = view
+        self.start_entry.refresh(view.started)
+        self.tag_entry.refresh(view.tags)
+        if view.elapsed is None:
             self.elapsed_label['text'] = 'ongoing'
         else:
-            secs = next_span.started - self.db.get_span(self.span_id).started
-            self.elapsed_label['text'] = str(timedelta(seconds=secs))
+            self.elapsed_label['text'] = str(timedelta(seconds=view.elapsed))
 
 
 class SwitchTagEntry(SavableEntry):
@@ -136,6 +157,7 @@ class SwitchTagEntry(SavableEntry):
         self.span_list = span_list
         self.entry.bind('<Key-Return>', self.on_key_return)
         self.entry.bind('<Key-Escape>', self.on_key_escape)
+        self.completions = add_tag_completion(self, span_list.db)
 
     def normalize(self, value):
         return tag_set_to_str(tag_str_to_set(value))
@@ -157,11 +179,19 @@ class SwitchTagEntry(SavableEntry):
 
 
 class SpanListWidget:
+    """List of the spans on a chosen day.
 
-    def __init__(self, master, db):
+    If `reader` is given, an `AsyncDatabase` on the same file, the day's
+    spans are loaded through it, and the list keeps showing what it had
+    until they arrive. Writes always go through `db`.
+    """
+
+    def __init__(self, master, db, reader=None):
         self.widget = Frame(master)
         self.db = db
+        self.reader = reader
         self.spans = []
+        self._refresh_count = 0
 
         self.date_chooser = DateChooser(self.widget)
         self.date_chooser.on_day_set = lambda d: self.refresh()
@@ -193,6 +223,7 @@ class SpanListWidget:
         self.switch_box.pack()
 
         self.refresh()
+        self.db.add_listener(self.on_changes)
 
     @property
     def editing(self):
@@ -223,17 +254,17 @@ class SpanListWidget:
 
     def on_save_button(self, *args):
         something_invalid = False
-        for span in self.spans[:]:
-            if not span.start_entry.proposed_value:
-                self.db.delete_span(span.span_id)
-            else:
-                for entry in (span.start_entry, span.tag_entry):
-                    if entry.proposed_valid:
-                        entry.save()
-                    else:
-                        something_invalid = True
+        with self.db.batch():
+            for span in self.spans[:]:
+                if not span.start_entry.proposed_value:
+                    self.db.delete_span(span.span_id)
+                else:
+                    for entry in (span.start_entry, span.tag_entry):
+                        if entry.proposed_valid:
+                            entry.save()
+                        else:
+                            something_invalid = True
         self.editing = something_invalid
-        self.refresh()
 
     def on_revert_button(self, *args):
         self.refresh()
@@ -242,37 +273,114 @@ class SpanListWidget:
         self.editing = False
 
     def add_span(self, tags=()):
-        span_id = self.db.add_span().span_id
-        for tag_name in tags:
-            self.db.add_tag(span_id, tag_name)
+        with self.db.batch():
+            span_id = self.db.add_span().span_id
+            for tag_name in tags:
+                self.db.add_tag(span_id, tag_name)
+        for span in self.spans:
+            if span.span_id == span_id:
+                return span
         span = SpanWidget(self.span_box, self.db, span_id)
         self.spans.append(span)
         span.widget.pack()
         change_state(self.edit_button, disabled=self.editing)
         span.start_entry.editable = span.tag_entry.editable = self.editing
-        self.refresh()
         return span
 
-    def refresh(self):
-        start_time = time.mktime(self.date_chooser.day.timetuple())
+    @property
+    def start_time(self):
+        return time.mktime(self.date_chooser.day.timetuple())
+
+    def on_changes(self, events):
+        """Update the spans affected by changes to the database.
+
+        Tag changes only refresh the tags of the spans they're on. Other
+        changes that could affect this day reload its spans, but only the
+        rows whose views changed are refreshed. A span moved to before the
+        day only matters if it was the span after the day, which is checked
+        against the last row's view.
+        """
+        shown = {span.span_id: span for span in self.spans}
+        start_time = self.start_time
+        tagged = set()
+        reload = moved_before = False
+        for event in events:
+            if isinstance(event, (TagAdded, TagRemoved)):
+                if event.span_id in shown:
+                    tagged.add(event.span_id)
+            elif (isinstance(event, (SpanCreated, SpanMoved))
+                  and event.span_id not in shown
+                  and event.started < start_time):
+                moved_before |= isinstance(event, SpanMoved)
+            else:
+                reload = True
+        if moved_before and not reload and self.spans:
+            last = self.spans[-1]
+            next_span = self.db.get_next_span(last.span_id)
+            reload = (last.view.next_started !=
+                      (next_span.started if next_span is not None else None))
+        if reload:
+            self.refresh(changed_only=True)
+        elif tagged:
+            tags = self.db.get_tags_for_spans(tagged)
+            for span_id in tagged:
+                span = shown[span_id]
+                span.refresh(span.view._replace(tags=tags[span_id]))
+
+    def refresh(self, changed_only=False):
+        """Reload the chosen day's spans.
+
+        If `changed_only` is true, spans whose views haven't changed aren't
+        refreshed, and the rows are only repacked if their order changed.
+        """
+        start_time = self.start_time
         if start_time <= time.time() < start_time + 86400:
             self.switch_box.pack()
         else:
             self.switch_box.pack_forget()
-        span_edits = self.db.get_spans(start_time, start_time + 86400)
-        for span in self.spans:
-            span.widget.pack_forget()
+        if self.reader is None:
+            self.show_views(
+                self.db.get_span_views(start_time, start_time + 86400),
+                changed_only)
+            return
+        self._refresh_count += 1
+        count = self._refresh_count
+
+        def show_views(views):
+            if count == self._refresh_count:
+                self.show_views(views, changed_only)
+
+        def load_views(error):
+            log.error('Loading spans in the background failed',
+                      exc_info=error)
+            if count == self._refresh_count:
+                self.show_views(
+                    self.db.get_span_views(start_time, start_time + 86400),
+                    changed_only)
+        self.reader.call('get_span_views', start_time, start_time + 86400,
+                         callback=show_views, errback=load_views)
+
+    def show_views(self, views, changed_only=False):
+        """Show the given `SpanView`s, reusing existing `SpanWidget`s."""
+        repack = not (changed_only and [span.span_id for span in self.spans]
+                      == [view.span_id for view in views])
+        if repack:
+            for span in self.spans:
+                span.widget.pack_forget()
         old_spans = {span.span_id: span for span in self.spans}
         self.spans = []
-        for edit in span_edits:
+        for view in views:
             try:
-                span = old_spans.pop(edit.span_id)
+                span = old_spans.pop(view.span_id)
             except KeyError:
-                span = SpanWidget(self.span_box, self.db, edit.span_id)
+                span = SpanWidget(self.span_box, self.db, view.span_id, view)
+            else:
+                if not changed_only or span.view != view:
+                    span.refresh(view)
             self.spans.append(span)
-            span.widget.pack()
-            change_state(self.edit_button, disabled=self.editing)
+            if repack:
+                span.widget.pack()
             span.start_entry.editable = span.tag_entry.editable = self.editing
-            span.refresh()
+        change_state(self.edit_button, disabled=self.editing or not self.spans)
         for span in old_spans.values():
             span.widget.destroy()
@@ -17,13 +17,14 @@
 
 import argparse
 import os.path
-import sqlite3
-import random
+import sys
 import tkinter as tk
 
-from ..db import Database, create_tables
+from ..asyncdb import AsyncDatabase
+from ..db import Database, add_pragma_arguments, pragmas_from_args
+from ..instrument import Profiler
 from . import SpanListWidget
-from .util import SavableEntry
+from .util import MainThreadQueue, SavableEntry
 
 
 parser = argparse.ArgumentParser(description='Track your time with Alho.')
@@ -31,22 +32,32 @@ parser.add_argument('-f', '--file', default='~/.alho.db',
                     help="SQLite DB file to use. Created if doesn't exist.")
 parser.add_argument('-i', '--interactive', action='store_true',
                     help='Run interactive Python interpreter after startup.')
+parser.add_argument('--profile', action='store_true',
+                    help='Print a summary of database calls on exit.')
+add_pragma_arguments(parser)
 args = parser.parse_args()
 
 filename = os.path.normpath(os.path.expanduser(args.file))
-already_existed = os.path.exists(filename)
-conn = sqlite3.connect(filename)
-db = Database(conn)
-if not already_existed:
-    create_tables(conn)
-    db.location_id = random.getrandbits(32) - 2**31
+pragmas = pragmas_from_args(args)
+db = Database.open(filename, **pragmas)
 
 win = tk.Tk()
 SavableEntry.set_theme_defaults(win)
-span_list = SpanListWidget(win, db)
+reader = AsyncDatabase(filename, MainThreadQueue(win), readonly=True,
+                       **pragmas)
+if args.profile:
+    profiler = Profiler()
+    profiler.attach(db)
+    reader.executor.submit(lambda: profiler.attach(reader.db, 'reader'))
+db.preload_tag_index(reader)
+span_list = SpanListWidget(win, db, reader)
 span_list.widget.pack()
-if args.interactive:
-    import code
-    code.interact(local=vars())
-else:
-    win.mainloop()
+try:
+    if args.interactive:
+        import code
+        code.interact(local=vars())
+    else:
+        win.mainloop()
+finally:
+    if args.profile:
+        print(profiler.summary(), file=sys.stderr)
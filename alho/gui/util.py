@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import queue
+import re
 import time
 import tkinter as tk
 from datetime import date, timedelta
@@ -140,6 +142,144 @@ class SavableEntry:
         })
 
 
+class CompletionList:
+    """Dropdown of completions for the word being typed in a `SavableEntry`.
+
+    `complete` is called with the word before the cursor, as matched by
+    `word_regex`, and returns the completions to offer for it. While the
+    dropdown is shown, Up and Down choose a completion, and Tab or a click
+    replaces the word with it.
+    """
+
+    def __init__(self, savable, complete, word_regex=r'\w*$', height=8):
+        self.savable = savable
+        self.entry = savable.entry
+        self.complete = complete
+        self.word_regex = re.compile(word_regex)
+        self.height = height
+        self.popup = None
+        self.listbox = None
+        self.entry.bind('<KeyRelease>', self.on_key_release, add='+')
+        self.entry.bind('<Key-Down>', self.on_key_down, add='+')
+        self.entry.bind('<Key-Up>', self.on_key_up, add='+')
+        self.entry.bind('<Key-Tab>', self.on_key_tab, add='+')
+        self.entry.bind('<Key-Escape>', self.hide, add='+')
+        self.entry.bind('<Key-Return>', self.hide, add='+')
+        self.entry.bind('<FocusOut>', self.hide, add='+')
+
+    @property
+    def shown(self):
+        return self.popup is not None
+
+    def current_word(self):
+        """Return the word before the cursor, and the index it starts at."""
+        before = self.entry.get()[:self.entry.index(tk.INSERT)]
+        match = self.word_regex.search(before)
+        return match.group(), match.start()
+
+    def update(self):
+        if not self.savable.editable:
+            self.hide()
+            return
+        word = self.current_word()[0]
+        completions = self.complete(word) if word else []
+        if not completions:
+            self.hide()
+            return
+        if self.popup is None:
+            self.popup = tk.Toplevel(self.entry)
+            self.popup.overrideredirect(True)
+            self.listbox = tk.Listbox(self.popup, exportselection=False)
+            self.listbox.bind('<ButtonRelease-1>', self.on_click)
+            self.listbox.pack(fill=tk.BOTH, expand=True)
+        self.popup.geometry('+{}+{}'.format(
+            self.entry.winfo_rootx(),
+            self.entry.winfo_rooty() + self.entry.winfo_height()))
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *completions)
+        self.listbox['height'] = min(len(completions), self.height)
+        self.select(0)
+
+    def hide(self, *args):
+        if self.popup is not None:
+            self.popup.destroy()
+            self.popup = self.listbox = None
+
+    def select(self, index):
+        self.listbox.selection_clear(0, tk.END)
+        index %= self.listbox.size()
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+
+    def selected(self):
+        selection = self.listbox.curselection()
+        return self.listbox.get(selection[0] if selection else 0)
+
+    def accept(self, completion=None):
+        """Replace the word before the cursor with a completion."""
+        if completion is None:
+            completion = self.selected()
+        start = self.current_word()[1]
+        self.entry.delete(start, tk.INSERT)
+        self.entry.insert(start, completion)
+        self.hide()
+
+    def on_key_release(self, event):
+        if event.keysym not in ('Up', 'Down', 'Tab', 'Escape', 'Return'):
+            self.update()
+
+    def on_key_down(self, *args):
+        if self.shown:
+            self.select(self.listbox.curselection()[0] + 1)
+            return 'break'
+
+    def on_key_up(self, *args):
+        if self.shown:
+            self.select(self.listbox.curselection()[0] - 1)
+            return 'break'
+
+    def on_key_tab(self, *args):
+        if self.shown:
+            self.accept()
+            return 'break'
+
+    def on_click(self, *args):
+        self.accept()
+
+
+class MainThreadQueue:
+    """Runs callables put on it from any thread in the Tk main loop.
+
+    Tk may only be used from the thread running its main loop, so other
+    threads hand over work through a queue, polled every `POLL_MS`.
+    """
+
+    POLL_MS = 20
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.queue = queue.SimpleQueue()
+        self.poll()
+
+    def __call__(self, func):
+        self.queue.put(func)
+
+    def poll(self):
+        """Run everything queued so far.
+
+        If a callable raises, the rest are left for the next poll.
+        """
+        try:
+            while True:
+                try:
+                    func = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                func()
+        finally:
+            self.widget.after(self.POLL_MS, self.poll)
+
+
 class DateChooserEntry(SavableEntry):
 
     def __init__(self, chooser):
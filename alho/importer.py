@@ -0,0 +1,129 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Streaming import of time logs from CSV or JSON lines.
+
+Readers yield ``(start, end, tags)`` records from the named columns of
+their input, which suits the output of `alho.export` as well as the CSV
+exports of other trackers. `spans_from_records` turns them into the
+``(started, tags)`` pairs `Database.bulk_load` takes. Invalid input
+raises `ValueError`, naming the line it's on.
+"""
+
+
+import csv
+import datetime
+import json
+
+from .tags import tag_str_to_set
+
+
+def parse_time(value):
+    """Parse seconds since the epoch, or an ISO 8601 date and time.
+
+    Times without an offset are taken as local. Empty values are `None`.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None else int(value)
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    try:
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise ValueError('invalid time {!r}'.format(value)) from None
+
+
+def split_tags(value):
+    """Return the sorted tag names in a value, a list or a string.
+
+    Each string is parsed by `tag_str_to_set`, as the GUI parses what's
+    typed, so names are lowercased, can be separated by whitespace, commas
+    or semicolons, and raise `ValueError` if invalid.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return sorted(set().union(*map(tag_str_to_set, value)))
+
+
+def _records(rows, start, end, tags):
+    """Yield the records of ``(line_number, row)`` pairs."""
+    for line, row in rows:
+        try:
+            started = parse_time(row[start])
+            if started is None:
+                raise ValueError('no start time')
+            yield (started,
+                   parse_time(row.get(end)) if end else None,
+                   [name for column in tags
+                    for name in split_tags(row[column])])
+        except KeyError as e:
+            raise ValueError('line {}: no {!r} column'.format(
+                line, e.args[0])) from None
+        except ValueError as e:
+            raise ValueError('line {}: {}'.format(line, e)) from None
+
+
+def read_csv(f, start='start', end='end', tags=('tags',)):
+    """Yield the ``(start, end, tags)`` records of the CSV file `f`.
+
+    `start`, `end` and `tags` name columns; `end` may be `None`, and the
+    names from all the `tags` columns are combined.
+    """
+    reader = csv.DictReader(f)
+    return _records(((reader.line_num, row) for row in reader),
+                    start, end, tags)
+
+
+def _jsonl_rows(f):
+    for line_num, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                raise ValueError('line {}: {}'.format(line_num, e)) from None
+
+
+def read_jsonl(f, start='start', end='end', tags=('tags',)):
+    """Like `read_csv`, but for a file of JSON objects, one per line."""
+    return _records(_jsonl_rows(f), start, end, tags)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def spans_from_records(records):
+    """Yield ``(started, tags)`` pairs for a sequence of records.
+
+    A span lasts until the next one starts, so where a record ends before
+    the next starts, or is the last and has an end, an untagged span is
+    added at its end.
+    """
+    end = None
+    for started, ended, tags in records:
+        if end is not None and started > end:
+            yield end, []
+        yield started, tags
+        end = ended
+    if end is not None:
+        yield end, []
@@ -0,0 +1,193 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Per-method profiling of `Database` objects.
+
+A `Profiler` replaces the public methods of the databases attached to it
+with timing wrappers, and records each SQL statement their connections
+execute (through ``set_trace_callback``) in a ring buffer. Detached
+databases, and ones never attached, run their methods directly, so there's
+no overhead when profiling is off.
+"""
+
+
+import functools
+import re
+import threading
+import time
+import types
+from collections import Counter, deque
+
+from .db import Database
+
+
+class MethodStats:
+    """Totals for one profiled method."""
+
+    __slots__ = ('calls', 'seconds', 'rows', 'statements')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = 0
+
+
+def count_rows(result):
+    """Return how many rows a `Database` method's result amounts to."""
+    if result is None:
+        return 0
+    if isinstance(result, (list, set, frozenset, dict)):
+        return len(result)
+    return 1
+
+
+def profiled_methods(cls=Database):
+    """Return the names of the public methods of `cls`."""
+    return sorted(name for name, value in vars(cls).items()
+                  if not name.startswith('_') and callable(value)
+                  and not isinstance(value, (classmethod, staticmethod)))
+
+
+class Profiler:
+    """Collects call counts, times, rows and SQL of `Database` methods.
+
+    Times include nested calls to other profiled methods. Rows of methods
+    that return generators are counted, and their time accumulated, as the
+    generators are consumed. Statements are attributed to the innermost
+    profiled method running on the same thread, and the last
+    `buffer_size` of them are kept in `statements` as ``(method, sql)``.
+    """
+
+    def __init__(self, buffer_size=10000):
+        self.stats = {}
+        self.statements = deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.attached = {}
+
+    def attach(self, db, label=None, methods=None):
+        """Start profiling `db`, on the thread that owns its connection.
+
+        Stats are keyed by method name, prefixed with ``label.`` if given.
+        """
+        prefix = label + '.' if label else ''
+        if methods is None:
+            methods = profiled_methods(type(db))
+        for name in methods:
+            setattr(db, name, self._wrap(prefix + name, getattr(db, name)))
+        db.conn.set_trace_callback(self._trace)
+        self.attached[id(db)] = db, methods
+
+    def detach(self, db):
+        """Stop profiling `db`, on the thread that owns its connection."""
+        db, methods = self.attached.pop(id(db))
+        for name in methods:
+            delattr(db, name)
+        db.conn.set_trace_callback(None)
+
+    def _stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            stack = self.local.stack = []
+            return stack
+
+    def _get_stats(self, key):
+        try:
+            return self.stats[key]
+        except KeyError:
+            return self.stats.setdefault(key, MethodStats())
+
+    def _record(self, key, seconds, rows, calls=0):
+        with self.lock:
+            stats = self._get_stats(key)
+            stats.calls += calls
+            stats.seconds += seconds
+            stats.rows += rows
+
+    def _wrap(self, key, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            stack.append(key)
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                stack.pop()
+                elapsed = time.perf_counter() - start
+            if isinstance(result, types.GeneratorType):
+                self._record(key, elapsed, 0, calls=1)
+                return self._wrap_generator(key, result)
+            self._record(key, elapsed, count_rows(result), calls=1)
+            return result
+        return wrapper
+
+    def _wrap_generator(self, key, generator):
+        stack = self._stack()
+        while True:
+            stack.append(key)
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                stack.pop()
+                elapsed = time.perf_counter() - start
+                self._record(key, elapsed, 0)
+            self._record(key, 0, 1)
+            yield item
+
+    def _trace(self, sql):
+        stack = self._stack()
+        method = stack[-1] if stack else None
+        with self.lock:
+            self.statements.append((method, sql))
+            if method is not None:
+                self._get_stats(method).statements += 1
+
+    def summary(self, statements=10):
+        """Return a text table of the stats, slowest methods first.
+
+        It's followed by the `statements` most frequent SQL statements in
+        the ring buffer.
+        """
+        with self.lock:
+            stats = sorted(self.stats.items(),
+                           key=lambda item: -item[1].seconds)
+            recent = list(self.statements)
+        width = max([len(key) for key, _ in stats] + [6])
+        lines = ['{:<{}} {:>8} {:>11} {:>9} {:>9} {:>7}'.format(
+            'method', width, 'calls', 'total ms', 'mean ms', 'rows',
+            'stmts')]
+        for key, stat in stats:
+            lines.append(
+                '{:<{}} {:>8} {:>11.2f} {:>9.3f} {:>9} {:>7}'.format(
+                    key, width, stat.calls, stat.seconds * 1000,
+                    stat.seconds * 1000 / max(stat.calls, 1), stat.rows,
+                    stat.statements))
+        counts = Counter(re.sub(r'\s+', ' ', sql).strip()
+                         for _, sql in recent)
+        if counts and statements:
+            lines.append('')
+            lines.append('most frequent of the last {} statements:'.format(
+                len(recent)))
+            for sql, count in counts.most_common(statements):
+                lines.append('{:>8}  {}'.format(count, sql))
+        return '\n'.join(lines)
@@ -0,0 +1,217 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Query-plan checks for the SQL that `Database` methods run.
+
+`capture` records the statements a call makes, with their parameters,
+`explain` runs ``EXPLAIN QUERY PLAN`` on one, and `audit` does both for a
+set of calls, reporting full table scans and temporary B-tree sorts that
+aren't in `EXPECTED`.
+
+Run as ``python -m alho.queryplan FILE`` to audit the read-only hot
+methods against a database file.
+"""
+
+
+import argparse
+import re
+import sys
+from collections import namedtuple
+
+from .db import Database, DigestBucket, connect
+
+
+PlanIssue = namedtuple('PlanIssue', ['method', 'sql', 'detail'])
+Statement = namedtuple('Statement', ['sql', 'params'])
+
+# Plan steps that are fine where they appear.
+EXPECTED = {
+    # The final sort of the window function's output, which has at most the
+    # rows of the range asked for.
+    'get_span_views': ['USE TEMP B-TREE FOR ORDER BY'],
+    # Sorts the deleted spans before the horizon, which each step removes.
+    'compact': ['USE TEMP B-TREE FOR ORDER BY'],
+    # Reads the index from its end, and stops at the first row.
+    'get_last_span': [
+        'SCAN current_span USING COVERING INDEX current_span_started_idx'],
+}
+
+# Tables small enough that scanning them is the best plan.
+SMALL_TABLES = {'local_data', 'report_watermark'}
+
+_SCAN_RE = re.compile(r'^SCAN (\w+)( USING (COVERING )?INDEX)?')
+_STATEMENT_RE = re.compile(r'^\s*(select|with|insert|update|delete)\b', re.I)
+
+
+def explain(conn, sql, params=()):
+    """Return the detail column of each step of the query plan of `sql`."""
+    return [row[3] for row in conn.execute('explain query plan ' + sql,
+                                           params)]
+
+
+def table_names(conn):
+    return {row[0] for row in conn.execute(
+        "select name from sqlite_master where type = 'table'")}
+
+
+def plan_issues(plan, tables):
+    """Return the steps of `plan` that scan one of `tables` or sort.
+
+    Scans through an index are reported too, since the plan doesn't show
+    whether they stop early; the bounded ones belong in `EXPECTED`.
+    """
+    issues = []
+    for detail in plan:
+        match = _SCAN_RE.match(detail)
+        if (match and match.group(1) in tables
+                and match.group(1) not in SMALL_TABLES):
+            issues.append(detail)
+        elif detail.startswith('USE TEMP B-TREE'):
+            issues.append(detail)
+    return issues
+
+
+class _Recorder:
+    """Stands in for a connection, recording the statements run on it."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.conn.__exit__(*exc_info)
+
+    def execute(self, sql, params=()):
+        self.statements.append(Statement(sql, params))
+        return self.conn.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            self.statements.append(Statement(sql, seq_of_params[0]))
+        return self.conn.executemany(sql, seq_of_params)
+
+
+def capture(db, func):
+    """Call `func()`, returning the `Statement`s it ran on `db.conn`.
+
+    Statements keep their ``?`` placeholders, as SQLite plans them, with
+    the parameters of their first run. Only queries and data changes are
+    kept, each once, in the order first run.
+    """
+    conn = db.conn
+    recorder = _Recorder(conn)
+    users = [obj for obj in (db, db.timestamps, db.tags) if obj.conn is conn]
+    for obj in users:
+        obj.conn = recorder
+    try:
+        result = func()
+        if hasattr(result, '__next__'):
+            for _ in result:
+                pass
+    finally:
+        for obj in users:
+            obj.conn = conn
+    first = {}
+    for statement in recorder.statements:
+        first.setdefault(statement.sql, statement)
+    return [statement for statement in first.values()
+            if _STATEMENT_RE.match(statement.sql)]
+
+
+def audit(db, calls, expected=EXPECTED):
+    """Return a `PlanIssue` for each unexpected step of each call's plans.
+
+    `calls` maps method names to functions that call them on `db`.
+    """
+    tables = table_names(db.conn)
+    issues = []
+    for method, func in calls.items():
+        for sql, params in capture(db, func):
+            for detail in plan_issues(explain(db.conn, sql, params), tables):
+                if detail not in expected.get(method, ()):
+                    issues.append(PlanIssue(method, sql, detail))
+    return issues
+
+
+def hot_calls(db, span_id, time_from, time_to):
+    """Return `audit` calls of the read-only hot methods of `db`.
+
+    They look up `span_id`, and the spans started between `time_from` and
+    `time_to`.
+    """
+    locations = db.get_edit_locations()
+    watermarks = {loc: 2**63 - 1 for loc in locations}
+    if locations:
+        watermarks[locations[0]] = 0
+    return {
+        'get_span': lambda: db.get_span(span_id),
+        'get_spans': lambda: db.get_spans(time_from, time_to),
+        'get_last_span': lambda: db.get_last_span(),
+        'get_next_span': lambda: db.get_next_span(span_id),
+        'get_span_history': lambda: db.get_span_history(span_id),
+        'get_tag_history': lambda: db.get_tag_history(span_id),
+        'get_tags': lambda: db.get_tags(span_id),
+        'get_tags_for_spans': lambda: db.get_tags_for_spans([span_id]),
+        'get_span_views': lambda: db.get_span_views(time_from, time_to),
+        'get_span_durations':
+            lambda: db.get_span_durations(time_from, time_to),
+        'load_tag_index': lambda: db.load_tag_index(),
+        'get_edit_locations': lambda: db.get_edit_locations(),
+        'export_changes': lambda: list(db.export_changes(watermarks)),
+        'get_digest': lambda: [db.get_digest(loc, DigestBucket.ROOT)
+                               for loc in locations[:1]],
+    }
+
+
+parser = argparse.ArgumentParser(
+    description='Check the query plans of the hot Database methods.')
+parser.add_argument('file', help='SQLite DB file to check.')
+parser.add_argument('-v', '--verbose', action='store_true',
+                    help='Print every plan, not just the issues.')
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    db = Database(connect(args.file, readonly=True))
+    last = db.get_last_span()
+    if last is None:
+        print('no spans to check', file=sys.stderr)
+        return 1
+    calls = hot_calls(db, last.span_id, last.started - 86400, last.started)
+    if args.verbose:
+        for method, func in calls.items():
+            for sql, params in capture(db, func):
+                print('{}: {}'.format(method, ' '.join(sql.split())))
+                for detail in explain(db.conn, sql, params):
+                    print('    ' + detail)
+    issues = audit(db, calls)
+    for issue in issues:
+        print('{}: {}\n    {}'.format(
+            issue.method, ' '.join(issue.sql.split()), issue.detail))
+    db.conn.close()
+    return 1 if issues else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Time-per-tag reports, backed by daily rollup tables.
+
+`report_day_tag` holds the seconds spent on each tag on each local day,
+keyed by the day's proleptic Gregorian ordinal. It's a cache derived from
+the edit history: `Report.update` reads only the edits newer than the
+per-location watermarks in `report_watermark` (as `Database.export_changes`
+does) and recomputes just the days those edits could have changed.
+
+The last span, which has no end yet, isn't counted until another span
+starts after it.
+"""
+
+
+import datetime
+import time
+from collections import namedtuple
+
+from .db import SpanEdit
+
+
+PeriodTotals = namedtuple('PeriodTotals', ['start', 'seconds'])
+
+
+def create_report_tables(conn):
+    with conn:
+        conn.execute("""
+          create table if not exists report_day_tag (
+            day int not null,
+            tag_id int not null,
+            seconds int not null,
+            primary key (day, tag_id)
+          ) without rowid
+        """)
+        conn.execute("""
+          create table if not exists report_watermark (
+            loc integer primary key not null,
+            edit_time int not null
+          )
+        """)
+
+
+def day_of(t):
+    """Return the ordinal of the local day containing time `t`."""
+    return datetime.date.fromtimestamp(t).toordinal()
+
+
+def day_start(day):
+    """Return the time local day number `day` starts."""
+    return int(time.mktime(datetime.date.fromordinal(day).timetuple()))
+
+
+def week_start(day):
+    """Return the ordinal of the Monday starting `day`'s week."""
+    return day - (day - 1) % 7
+
+
+def month_start(day):
+    return datetime.date.fromordinal(day).replace(day=1).toordinal()
+
+
+PERIODS = {
+    'day': lambda day: day,
+    'week': week_start,
+    'month': month_start,
+}
+
+
+class Report:
+    """Seconds spent per tag, summed over ranges of local days.
+
+    The query methods bring the rollup tables up to date first, so after
+    the first build they only cost as much as the edits made since.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.conn = db.conn
+        create_report_tables(self.conn)
+
+    def _get_watermarks(self):
+        return dict(self.conn.execute(
+            'select loc, edit_time from report_watermark'))
+
+    def _set_watermarks(self, watermarks):
+        self.conn.executemany("""
+          insert or replace into report_watermark (loc, edit_time)
+            values (?, ?)
+        """, watermarks.items())
+
+    def update(self):
+        """Bring the rollup tables up to date with the edit history.
+
+        Returns the number of days recomputed.
+        """
+        watermarks = self._get_watermarks()
+        if not watermarks:
+            return self.rebuild()
+        changes = self.db.export_changes(watermarks)
+        moved = set()
+        tagged = set()
+        for edit in changes:
+            if edit.TABLE == SpanEdit.TABLE:
+                moved.add(edit.span_id)
+            else:
+                tagged.add(edit.span_id)
+        if not moved and not tagged:
+            return 0
+        points = set()
+        for span_id in moved:
+            points.update(edit.started
+                          for edit in self.db.get_span_history(span_id)
+                          if edit.started is not None)
+        for span_id in tagged - moved:
+            span = self.db.get_span(span_id)
+            if span is not None:
+                points.add(span.started)
+        ranges = []
+        for point in points:
+            first, last = self.conn.execute("""
+              select
+                (select max(started) from current_span where started < :p),
+                (select min(started) from current_span where started > :p)
+            """, {'p': point}).fetchone()
+            ranges.append((day_of(point if first is None else first),
+                           day_of(point if last is None else last)))
+        return self._recompute(ranges, changes.watermarks)
+
+    def rebuild(self):
+        """Recompute the rollup tables from scratch.
+
+        Returns the number of days recomputed.
+        """
+        watermarks = {}
+        for table in 'span', 'span_tag':
+            for loc, edit_time in self.conn.execute("""
+              select edit_loc, max(edit_time) from {} group by edit_loc
+            """.format(table)):
+                watermarks[loc] = max(edit_time,
+                                      watermarks.get(loc, edit_time))
+        first, last = self.conn.execute("""
+          select min(started), max(started) from current_span
+        """).fetchone()
+        with self.conn:
+            self.conn.execute('delete from report_day_tag')
+            self.conn.execute('delete from report_watermark')
+        ranges = [] if first is None else [(day_of(first), day_of(last))]
+        return self._recompute(ranges, watermarks)
+
+    def _recompute(self, ranges, watermarks):
+        """Recompute the days in the given inclusive ranges of ordinals."""
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        rows = []
+        for first, last in merged:
+            rows.extend(self._compute_days(first, last))
+        with self.conn:
+            for first, last in merged:
+                self.conn.execute("""
+                  delete from report_day_tag where day between ? and ?
+                """, [first, last])
+            self.conn.executemany("""
+              insert into report_day_tag (day, tag_id, seconds)
+                values (?, ?, ?)
+            """, rows)
+            self._set_watermarks(watermarks)
+        return sum(last - first + 1 for first, last in merged)
+
+    def _compute_days(self, first, last):
+        """Return ``(day, tag_id, seconds)`` rows for the given days."""
+        time_from = day_start(first)
+        time_to = day_start(last + 1)
+        durations = [span for span in self.db.get_span_durations(
+            time_from, time_to) if span.ended is not None]
+        tags = self.db.get_tags_for_spans(span.span_id for span in durations)
+        seconds = {}
+        for span in durations:
+            names = tags[span.span_id]
+            if not names:
+                continue
+            tag_ids = [self.db.tags.get_id(name) for name in names]
+            started = max(span.started, time_from)
+            ended = min(span.ended, time_to)
+            day = day_of(started)
+            while started < ended:
+                next_start = day_start(day + 1)
+                part = min(ended, next_start) - started
+                for tag_id in tag_ids:
+                    key = day, tag_id
+                    seconds[key] = seconds.get(key, 0) + part
+                started = next_start
+                day += 1
+        return [key + (value,) for key, value in seconds.items()]
+
+    def get_totals(self, first, last):
+        """Return a dict of the seconds per tag from `first` to `last`.
+
+        `first` and `last` are `datetime.date`s, and both are included.
+        """
+        self.update()
+        return {self.db.tags.get_name(tag_id): seconds
+                for tag_id, seconds in self.conn.execute("""
+                  select tag_id, sum(seconds)
+                    from report_day_tag
+                    where day between ? and ?
+                    group by tag_id
+                """, [first.toordinal(), last.toordinal()])}
+
+    def get_period_totals(self, first, last, period='day'):
+        """Return a `PeriodTotals` for each period from `first` to `last`.
+
+        `period` is ``'day'``, ``'week'`` (starting on Monday) or
+        ``'month'``. Each `PeriodTotals` has the `datetime.date` its period
+        starts, and a dict of seconds per tag over the part of the period
+        within the range. Periods without any tagged time are left out.
+        """
+        period_start = PERIODS[period]
+        self.update()
+        totals = []
+        for day, tag_id, seconds in self.conn.execute("""
+          select day, tag_id, seconds
+            from report_day_tag
+            where day between ? and ?
+            order by day
+        """, [first.toordinal(), last.toordinal()]):
+            start = datetime.date.fromordinal(period_start(day))
+            if not totals or totals[-1].start != start:
+                totals.append(PeriodTotals(start, {}))
+            name = self.db.tags.get_name(tag_id)
+            by_tag = totals[-1].seconds
+            by_tag[name] = by_tag.get(name, 0) + seconds
+        return totals
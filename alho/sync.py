@@ -0,0 +1,448 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Sync server hosting one authoritative database, and its client.
+
+Clients talk to the server over TCP or a Unix socket. Each request is one
+line of JSON, possibly followed by a binary changeset of the length given in
+the request; responses have the same form. Requests:
+
+``{"op": "push", "length": n}`` followed by a changeset
+    Import the edits. Responds with ``{"inserted": i, "duplicates": d}``.
+
+``{"op": "pull", "watermarks": {loc: edit_time, ...}}``
+    Responds with ``{"length": n, "watermarks": {...}}`` followed by a
+    changeset of every edit newer than the watermarks, which are updated to
+    include those edits.
+
+``{"op": "locations"}``
+    Responds with ``{"locations": [loc, ...]}``, every location with edits.
+
+``{"op": "digest", "loc": loc, "buckets": [[bits, start], ...]}``
+    Responds with ``{"digests": [[count, hex_hash], ...]}``, the
+    `Database.get_digest` of each `DigestBucket`.
+
+``{"op": "range", "loc": loc, "buckets": [[bits, start], ...]}``
+    Responds with ``{"length": n}`` followed by a changeset of the
+    location's edits within the buckets.
+
+Failed requests get ``{"error": message}``. Requests with payloads longer
+than the server's `max_payload` are refused, and the connection closed.
+All writes go through a single
+writer task and thread; reads are spread over a pool of reader threads,
+using the writer `Database`'s pool of read-only connections.
+"""
+
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import logging
+import os.path
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from .changeset import read_changeset, write_changeset
+from .db import (DIGEST_LEAF_EDITS, Database, Digest, DigestBucket,
+                 ImportResult, add_pragma_arguments, pragmas_from_args)
+
+
+log = logging.getLogger(__name__)
+
+MAX_PAYLOAD = 1 << 28
+
+
+def encode_watermarks(watermarks):
+    return {str(loc): edit_time for loc, edit_time in watermarks.items()}
+
+
+def decode_watermarks(watermarks):
+    return {int(loc): edit_time for loc, edit_time in watermarks.items()}
+
+
+async def read_message(reader, max_length=None):
+    """Read a request or response, returning ``(header, payload)``.
+
+    Returns ``(None, None)`` at end of stream. Raises `ValueError` if the
+    payload's length is invalid or over `max_length`, before reading it.
+    """
+    line = await reader.readline()
+    if not line:
+        return None, None
+    header = json.loads(line.decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError('Message header is not an object')
+    length = header.get('length') or 0
+    if not isinstance(length, int) or length < 0:
+        raise ValueError('Invalid payload length: %r' % (length,))
+    if max_length is not None and length > max_length:
+        raise ValueError('Payload of %d bytes is over the limit of %d'
+                         % (length, max_length))
+    payload = await reader.readexactly(length) if length else b''
+    return header, payload
+
+
+def decode_buckets(buckets):
+    return [DigestBucket(bits, start) for bits, start in buckets]
+
+
+def write_message(writer, header, payload=b''):
+    if payload:
+        header = dict(header, length=len(payload))
+    writer.write(json.dumps(header).encode('utf-8') + b'\n')
+    if payload:
+        writer.write(payload)
+
+
+class SyncServer:
+
+    def __init__(self, filename, readers=4, max_payload=MAX_PAYLOAD,
+                 **pragmas):
+        self.filename = filename
+        self.pragmas = pragmas
+        self.readers = readers
+        self.max_payload = max_payload
+        self.clients = {}
+        self.db = None
+        self.writer_executor = ThreadPoolExecutor(1)
+        self.reader_executor = ThreadPoolExecutor(readers)
+        self.write_queue = asyncio.Queue()
+        self.writer_task = None
+        self.server = None
+
+    def _connect(self):
+        self.db = Database.open(self.filename, readers=self.readers,
+                                **self.pragmas)
+
+    @classmethod
+    def create_database(cls, filename, **pragmas):
+        Database.open(filename, readers=1, **pragmas).close()
+
+    async def start(self, host=None, port=None, path=None):
+        """Start listening on a Unix socket at `path`, or else on TCP."""
+        await asyncio.get_event_loop().run_in_executor(
+            self.writer_executor, self._connect)
+        self.writer_task = asyncio.ensure_future(self._run_writer())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        """Stop listening, disconnect clients, and close the database.
+
+        Requests in progress are finished first.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in self.clients:
+            writer.close()
+        if self.clients:
+            await asyncio.wait(list(self.clients.values()))
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+        self.reader_executor.shutdown()
+        if self.db is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                self.writer_executor, self.db.close)
+        self.writer_executor.shutdown()
+
+    async def _run_writer(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            payload, future = await self.write_queue.get()
+            try:
+                result = await loop.run_in_executor(
+                    self.writer_executor, self._import, payload)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+    def _import(self, payload):
+        return self.db.import_changes(
+            read_changeset(io.BytesIO(payload)))
+
+    @staticmethod
+    def _export(db, watermarks):
+        changes = db.export_changes(watermarks)
+        out = io.BytesIO()
+        write_changeset(out, changes)
+        return out.getvalue(), changes.watermarks
+
+    async def push(self, payload):
+        future = asyncio.get_event_loop().create_future()
+        await self.write_queue.put((payload, future))
+        return await future
+
+    async def read(self, func, *args):
+        """Call `func` with a read-only `Database` and `args`."""
+        return await asyncio.get_event_loop().run_in_executor(
+            self.reader_executor, self._read, func, args)
+
+    def _read(self, func, args):
+        with self.db.readers.database() as db:
+            return func(db, *args)
+
+    async def op_push(self, header, payload):
+        result = await self.push(payload)
+        return result._asdict(), b''
+
+    async def op_pull(self, header, payload):
+        data, watermarks = await self.read(
+            self._export, decode_watermarks(header.get('watermarks', {})))
+        return {'watermarks': encode_watermarks(watermarks)}, data
+
+    async def op_locations(self, header, payload):
+        locations = await self.read(Database.get_edit_locations)
+        return {'locations': locations}, b''
+
+    async def op_digest(self, header, payload):
+        buckets = decode_buckets(header['buckets'])
+        digests = await self.read(
+            lambda db: [db.get_digest(header['loc'], bucket)
+                        for bucket in buckets])
+        return {'digests': [[d.count, d.hash.hex()] for d in digests]}, b''
+
+    async def op_range(self, header, payload):
+        buckets = decode_buckets(header['buckets'])
+
+        def export(db):
+            out = io.BytesIO()
+            write_changeset(out, itertools.chain.from_iterable(
+                db.get_bucket_edits(header['loc'], bucket)
+                for bucket in buckets))
+            return out.getvalue()
+
+        return {}, await self.read(export)
+
+    async def handle(self, reader, writer):
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    header, payload = await read_message(reader,
+                                                         self.max_payload)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    write_message(writer, {'error': str(e)})
+                    break
+                if header is None:
+                    break
+                op = getattr(self, 'op_%s' % header.get('op'), None)
+                if op is None:
+                    write_message(writer, {
+                        'error': 'Unknown op: %r' % header.get('op')})
+                else:
+                    try:
+                        response, data = await op(header, payload)
+                    except (KeyError, TypeError, ValueError,
+                            sqlite3.Error) as e:
+                        write_message(writer, {'error': repr(e)})
+                    except Exception as e:
+                        log.exception('Sync request %r failed',
+                                      header.get('op'))
+                        write_message(writer, {'error': repr(e)})
+                    else:
+                        write_message(writer, response, data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.clients[writer]
+            writer.close()
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncClient:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host=None, port=None, path=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def request(self, header, payload=b''):
+        write_message(self.writer, header, payload)
+        await self.writer.drain()
+        response, data = await read_message(self.reader)
+        if response is None:
+            raise SyncError('Connection closed')
+        if 'error' in response:
+            raise SyncError(response['error'])
+        return response, data
+
+    async def push(self, edits):
+        """Send edits to the server, returning its `ImportResult` counts."""
+        out = io.BytesIO()
+        write_changeset(out, edits)
+        response, _ = await self.request({'op': 'push'}, out.getvalue())
+        return ImportResult(response['inserted'], response['duplicates'])
+
+    async def pull(self, watermarks):
+        """Return the server's edits newer than `watermarks`.
+
+        Returns ``(edits, new_watermarks)``.
+        """
+        response, data = await self.request({
+            'op': 'pull',
+            'watermarks': encode_watermarks(watermarks),
+        })
+        edits = list(read_changeset(io.BytesIO(data))) if data else []
+        return edits, decode_watermarks(response['watermarks'])
+
+    async def locations(self):
+        response, _ = await self.request({'op': 'locations'})
+        return response['locations']
+
+    async def digests(self, loc, buckets):
+        response, _ = await self.request({
+            'op': 'digest',
+            'loc': loc,
+            'buckets': [list(bucket) for bucket in buckets],
+        })
+        return [Digest(count, bytes.fromhex(digest))
+                for count, digest in response['digests']]
+
+    async def range(self, loc, buckets):
+        """Return the server's edits from `loc` within the buckets."""
+        _, data = await self.request({
+            'op': 'range',
+            'loc': loc,
+            'buckets': [list(bucket) for bucket in buckets],
+        })
+        return list(read_changeset(io.BytesIO(data))) if data else []
+
+
+async def sync_database(db, client, pulled=None, pushed=None):
+    """Exchange edits between a local `Database` and a sync server.
+
+    `pulled` holds the watermarks of edits already received from the server,
+    and `pushed` those of edits already sent to it. Returns their new values.
+    """
+    edits, pulled = await client.pull(pulled or {})
+    db.import_changes(edits)
+    pushed = dict(pushed or {})
+    for loc, edit_time in pulled.items():
+        pushed[loc] = max(pushed.get(loc, edit_time), edit_time)
+    changes = db.export_changes(pushed)
+    await client.push(changes)
+    return pulled, changes.watermarks
+
+
+async def find_differing_buckets(db, client, loc):
+    """Return the smallest `DigestBucket`s where `db` and the server differ.
+
+    Compares digests top-down, one request per level of the bucket tree,
+    only descending into buckets whose digests don't match.
+    """
+    differing = []
+    buckets = [DigestBucket.ROOT]
+    while buckets:
+        remote_digests = await client.digests(loc, buckets)
+        next_buckets = []
+        for bucket, remote in zip(buckets, remote_digests):
+            local = db.get_digest(loc, bucket)
+            if local == remote:
+                continue
+            if (bucket.children and
+                    max(local.count, remote.count) > DIGEST_LEAF_EDITS):
+                next_buckets.extend(bucket.children)
+            else:
+                differing.append(bucket)
+        buckets = next_buckets
+    return differing
+
+
+async def reconcile(db, client):
+    """Exchange just the edits that `db` or the server is missing.
+
+    Unlike `sync_database`, doesn't rely on watermarks, so it also repairs
+    replicas that have diverged, e.g. after restoring a backup. Returns the
+    `ImportResult`s of the local and remote imports.
+    """
+    pulled = pushed = ImportResult(0, 0)
+    locations = set(db.get_edit_locations()) | set(await client.locations())
+    for loc in sorted(locations):
+        buckets = await find_differing_buckets(db, client, loc)
+        if buckets:
+            result = db.import_changes(await client.range(loc, buckets))
+            pulled = ImportResult(*map(sum, zip(pulled, result)))
+            result = await client.push(itertools.chain.from_iterable(
+                db.get_bucket_edits(loc, bucket) for bucket in buckets))
+            pushed = ImportResult(*map(sum, zip(pushed, result)))
+    return pulled, pushed
+
+
+parser = argparse.ArgumentParser(description='Run an Alho sync server.')
+parser.add_argument('-f', '--file', default='~/.alho-sync.db',
+                    help="SQLite DB file to serve. Created if doesn't exist.")
+parser.add_argument('--host', default='localhost',
+                    help='Host or address to listen on.')
+parser.add_argument('-p', '--port', type=int, default=7531,
+                    help='TCP port to listen on.')
+parser.add_argument('-u', '--unix', metavar='PATH',
+                    help='Listen on a Unix socket at PATH instead of TCP.')
+parser.add_argument('-r', '--readers', type=int, default=4,
+                    help='Number of reader connections.')
+add_pragma_arguments(parser)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    filename = os.path.normpath(os.path.expanduser(args.file))
+    pragmas = pragmas_from_args(args)
+    SyncServer.create_database(filename, **pragmas)
+
+    async def serve():
+        server = SyncServer(filename, args.readers, **pragmas)
+        listener = await server.start(args.host, args.port, args.unix)
+        try:
+            await listener.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Parsing of the tag lists people type or import."""
+
+
+import re
+
+
+TAG_STR_SPLIT_REGEX = re.compile(r'[\s;,]+')
+TAG_NAME_REGEX = re.compile(r'^[-\w.&?!]+$')
+
+
+def tag_str_to_set(tag_str):
+    """Return the set of tag names in a string.
+
+    Names are separated by whitespace, commas or semicolons, and are
+    lowercased. Raises `ValueError` for an invalid name.
+    """
+    tag_set = set()
+    for name in TAG_STR_SPLIT_REGEX.split(tag_str.lower()):
+        if name:
+            if TAG_NAME_REGEX.match(name):
+                tag_set.add(name)
+            else:
+                raise ValueError('Invalid tag name: %r' % name)
+    return tag_set
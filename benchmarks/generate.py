@@ -0,0 +1,151 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Seeded generator of synthetic multi-year, multi-device histories.
+
+Each day gets a run of spans during waking hours, each created from one of
+the locations, with tags drawn from a skewed vocabulary. Later edits, also
+from random locations, move spans, churn their tags and delete some. The
+same parameters always produce the same edits.
+
+Run as ``python -m benchmarks.generate FILE`` to write a database file.
+"""
+
+
+import argparse
+import random
+from collections import namedtuple
+
+from alho.db import SpanEdit, TagEdit, TimeStamp
+
+
+DAY = 86400
+
+HistoryParams = namedtuple('HistoryParams', [
+    'years', 'locations', 'spans_per_day', 'tags', 'tags_per_span',
+    'retag_rate', 'move_rate', 'delete_rate', 'seed'])
+
+DEFAULT_PARAMS = HistoryParams(
+    years=3, locations=24, spans_per_day=12, tags=300, tags_per_span=2,
+    retag_rate=0.3, move_rate=0.1, delete_rate=0.03, seed=0)
+
+START = 1262304000  # 2010-01-01 00:00 UTC
+
+
+class _Clock:
+    """Issues increasing edit timestamps for each location."""
+
+    def __init__(self):
+        self.last = {}
+
+    def stamp(self, when, loc):
+        last = self.last.get(loc)
+        edited = TimeStamp(when, loc, 0)
+        if last is not None and last >= edited:
+            edited = last.next
+        self.last[loc] = edited
+        return edited
+
+
+def generate_edits(params=DEFAULT_PARAMS):
+    """Yield the edits of a synthetic history, in time order per day."""
+    rng = random.Random(params.seed)
+    locations = [rng.getrandbits(32) - 2**31
+                 for _ in range(params.locations)]
+    # Tag popularity follows a Zipf-like curve over the vocabulary.
+    tag_names = ['tag{:04d}'.format(i) for i in range(params.tags)]
+    tag_weights = [1 / (i + 1) for i in range(params.tags)]
+    clock = _Clock()
+
+    def pick_tags(count):
+        return set(rng.choices(tag_names, tag_weights, k=count))
+
+    for day in range(int(params.years * 365)):
+        day_start = START + day * DAY
+        edits = []
+        started = day_start + 7 * 3600 + rng.randrange(3 * 3600)
+        day_spans = []
+        for _ in range(max(1, int(rng.gauss(params.spans_per_day, 3)))):
+            loc = rng.choice(locations)
+            edited = clock.stamp(started, loc)
+            span_id = edited.as_int
+            edits.append(SpanEdit(edited, span_id, started))
+            tags = pick_tags(rng.randint(1, 2 * params.tags_per_span - 1))
+            for name in tags:
+                edits.append(TagEdit(clock.stamp(started, loc), span_id,
+                                     name, 1))
+            day_spans.append((span_id, started, tags))
+            started += rng.randrange(5 * 60, 3 * 3600)
+        later = started + 600
+        for span_id, span_started, tags in day_spans:
+            if rng.random() < params.retag_rate:
+                loc = rng.choice(locations)
+                removed = rng.sample(sorted(tags), rng.randint(0, len(tags)))
+                for name in removed:
+                    edits.append(TagEdit(clock.stamp(later, loc), span_id,
+                                         name, 0))
+                for name in pick_tags(rng.randint(1, 2)) - tags:
+                    edits.append(TagEdit(clock.stamp(later, loc), span_id,
+                                         name, 1))
+            if rng.random() < params.move_rate:
+                loc = rng.choice(locations)
+                edits.append(SpanEdit(
+                    clock.stamp(later, loc), span_id,
+                    span_started + rng.randrange(-600, 600)))
+            if rng.random() < params.delete_rate:
+                loc = rng.choice(locations)
+                edits.append(SpanEdit(clock.stamp(later, loc), span_id, None))
+        yield from edits
+
+
+def generate_history(db, params=DEFAULT_PARAMS):
+    """Import a synthetic history into `db`, returning an `ImportResult`."""
+    return db.import_changes(generate_edits(params))
+
+
+def add_params_arguments(parser):
+    """Add command-line options for the fields of `HistoryParams`."""
+    group = parser.add_argument_group('history')
+    for field, default in DEFAULT_PARAMS._asdict().items():
+        group.add_argument('--' + field.replace('_', '-'),
+                           type=type(default), default=default,
+                           help='(default: {})'.format(default))
+
+
+parser = argparse.ArgumentParser(
+    description='Write a synthetic Alho history to a database file.')
+parser.add_argument('file', help='SQLite DB file to create or add to.')
+add_params_arguments(parser)
+
+
+def params_from_args(args):
+    return HistoryParams(**{field: getattr(args, field)
+                            for field in HistoryParams._fields})
+
+
+def main(argv=None):
+    from alho.db import Database
+    args = parser.parse_args(argv)
+    db = Database.open(args.file)
+    try:
+        print(generate_history(db, params_from_args(args)))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
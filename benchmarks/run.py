@@ -0,0 +1,303 @@
+# Alho personal time-tracking system
+# Copyright (C) 2015  Daniel Getz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Time the hot `Database` methods on a synthetic history.
+
+Run as ``python -m benchmarks.run``. Results are written as JSON, with the
+git commit, parameters and per-benchmark timings, so runs on different
+commits can be compared.
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tkinter as tk
+from datetime import date
+
+from alho.db import Database
+
+from .generate import (DAY, START, add_params_arguments, generate_history,
+                       params_from_args)
+
+
+BENCHMARKS = {}
+WRITE_BENCHMARKS = set()
+
+
+def benchmark(func):
+    """Register `func(db, rng)` as a benchmark.
+
+    It's called repeatedly, and each call is timed.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def write_benchmark(func):
+    """Register `func(db, rng)` as a benchmark that changes the database.
+
+    Write benchmarks run after the others, each on its own copy of the
+    database, so they neither skew the other timings nor change the file.
+    """
+    WRITE_BENCHMARKS.add(func.__name__)
+    return benchmark(func)
+
+
+def random_day(db, rng):
+    return START + rng.randrange(int(db.bench_params.years * 365)) * DAY
+
+
+def random_span_id(db, rng):
+    return rng.choice(db.bench_span_ids)
+
+
+@benchmark
+def get_spans_day(db, rng):
+    day = random_day(db, rng)
+    return list(db.get_spans(day, day + DAY))
+
+
+@benchmark
+def get_spans_month(db, rng):
+    day = random_day(db, rng)
+    return list(db.get_spans(day, day + 30 * DAY))
+
+
+@benchmark
+def get_tags(db, rng):
+    return db.get_tags(random_span_id(db, rng))
+
+
+@benchmark
+def get_next_span(db, rng):
+    return db.get_next_span(random_span_id(db, rng))
+
+
+@benchmark
+def get_last_span(db, rng):
+    return db.get_last_span()
+
+
+@benchmark
+def get_span_history(db, rng):
+    return list(db.get_span_history(random_span_id(db, rng)))
+
+
+@benchmark
+def get_tag_history(db, rng):
+    return list(db.get_tag_history(random_span_id(db, rng)))
+
+
+@benchmark
+def export_all(db, rng):
+    """A full scan of the history, as a first sync does."""
+    return sum(1 for _ in db.export_changes())
+
+
+@benchmark
+def get_span_views_day(db, rng):
+    day = random_day(db, rng)
+    return db.get_span_views(day, day + DAY)
+
+
+@benchmark
+def span_list_refresh(db, rng):
+    """`SpanListWidget.refresh` for a random day, in a withdrawn window.
+
+    Skipped if Tk can't open a display.
+    """
+    span_list = getattr(db, 'bench_span_list', None)
+    if span_list is None:
+        from alho.gui import SpanListWidget
+        win = tk.Tk()
+        win.withdraw()
+        span_list = db.bench_span_list = SpanListWidget(win, db)
+        span_list.widget.pack()
+    span_list.date_chooser.day = date.fromtimestamp(random_day(db, rng))
+    span_list.widget.update_idletasks()
+
+
+@benchmark
+def tag_totals_year(db, rng):
+    """A year of tag totals through `analytics.SpanFrame`.
+
+    Skipped if NumPy or SciPy isn't installed.
+    """
+    from alho.analytics import SpanFrame
+    day = random_day(db, rng)
+    return SpanFrame.load(db, day, day + 365 * DAY).tag_totals()
+
+
+@benchmark
+def span_queries_day(db, rng):
+    """The per-span queries of a day's refresh without `get_span_views`."""
+    day = random_day(db, rng)
+    views = []
+    for edit in db.get_spans(day, day + DAY):
+        db.get_span(edit.span_id)
+        db.get_tags(edit.span_id)
+        views.append(db.get_next_span(edit.span_id))
+    return views
+
+
+@write_benchmark
+def set_span(db, rng):
+    return db.set_span(random_span_id(db, rng), random_day(db, rng))
+
+
+@write_benchmark
+def set_tag(db, rng):
+    return db.add_tag(random_span_id(db, rng),
+                      'tag{:04d}'.format(rng.randrange(50)))
+
+
+@write_benchmark
+def bulk_load(db, rng):
+    """`Database.bulk_load` of 1000 spans with two tags each."""
+    day = random_day(db, rng)
+    return db.bulk_load(
+        (day + i * 60, ['tag{:04d}'.format(rng.randrange(50)) for _ in 'ab'])
+        for i in range(1000))
+
+
+def time_benchmark(func, db, repeat, seed):
+    rng = random.Random(seed)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            func(db, rng)
+        except (tk.TclError, ImportError) as e:
+            return {'skipped': str(e)}
+        times.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'max': max(times),
+    }
+
+
+def time_on_copy(func, db, repeat, seed):
+    """Like `time_benchmark`, but on a temporary copy of `db`."""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'copy.db')
+        conn = sqlite3.connect(filename)
+        try:
+            db.conn.backup(conn)
+        finally:
+            conn.close()
+        copy = Database.open(filename)
+        try:
+            copy.bench_params = db.bench_params
+            copy.bench_span_ids = db.bench_span_ids
+            return time_benchmark(func, copy, repeat, seed)
+        finally:
+            copy.close()
+
+
+def ordered(names):
+    """Return benchmark `names` sorted, with the write benchmarks last."""
+    return sorted(names, key=lambda name: (name in WRITE_BENCHMARKS, name))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(filename, params, names, repeat, seed=0):
+    db = Database.open(filename)
+    try:
+        start = time.perf_counter()
+        if not db.conn.execute(
+                'select exists(select 1 from span)').fetchone()[0]:
+            generate_history(db, params)
+        generate_time = time.perf_counter() - start
+        db.bench_params = params
+        db.bench_span_ids = [row[0] for row in db.conn.execute(
+            'select span_id from current_span where started is not null')]
+        results = {}
+        for name in ordered(names):
+            if name in WRITE_BENCHMARKS:
+                timer = time_on_copy
+            else:
+                timer = time_benchmark
+            results[name] = timer(BENCHMARKS[name], db, repeat, seed)
+        span_list = getattr(db, 'bench_span_list', None)
+        if span_list is not None:
+            span_list.widget.winfo_toplevel().destroy()
+        edits = sum(db.conn.execute(
+            'select count(*) from {}'.format(table)).fetchone()[0]
+            for table in ('span', 'span_tag'))
+    finally:
+        db.close()
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'params': params._asdict(),
+        'edits': edits,
+        'generate_seconds': generate_time,
+        'results': results,
+    }
+
+
+parser = argparse.ArgumentParser(
+    description='Benchmark Alho on a synthetic history.')
+parser.add_argument('file', nargs='?',
+                    help='DB file to use, generated if empty. Defaults to a '
+                         'temporary file. Write benchmarks run on copies, '
+                         'so an existing file is left unchanged.')
+parser.add_argument('-n', '--repeat', type=int, default=200,
+                    help='Calls to time per benchmark.')
+parser.add_argument('-b', '--benchmark', action='append',
+                    choices=sorted(BENCHMARKS),
+                    help='Benchmark to run; may be repeated. Default: all.')
+parser.add_argument('-o', '--output', help='Write JSON results here.')
+add_params_arguments(parser)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    names = args.benchmark or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = args.file or os.path.join(tmp, 'bench.db')
+        report = run(filename, params_from_args(args), names, args.repeat)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,10 +24,16 @@ class PyTest(TestCommand):
 setup(
     name='alho-py',
     version='0.1',
-    packages=find_packages(exclude=['tests', 'env']),
+    packages=find_packages(exclude=['tests', 'benchmarks', 'env']),
     test_suite='tests',
     install_requires=[
     ],
+    entry_points={
+        'console_scripts': ['alho = alho.__main__:main'],
+    },
+    extras_require={
+        'analytics': ['numpy', 'scipy'],
+    },
     tests_require=[
         'pytest>=2.6.1',
         'hypothesis>=1.5.0',
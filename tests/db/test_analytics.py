@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from alho.analytics import SpanFrame  # noqa: E402
+from alho.report import Report, day_start  # noqa: E402
+
+DAY = datetime.date(2015, 6, 1)
+T0 = day_start(DAY.toordinal())
+T1 = day_start(DAY.toordinal() + 1)
+HOUR = 3600
+
+
+def add(db, span_id, started, *tags):
+    db.set_span(span_id, started)
+    for name in tags:
+        db.add_tag(span_id, name)
+
+
+@pytest.fixture
+def frame(db, fake_times):
+    add(db, 1, T0 - HOUR, 'sleep')
+    add(db, 2, T0 + 9 * HOUR, 'work')
+    add(db, 3, T0 + 12 * HOUR, 'lunch')
+    add(db, 4, T0 + 13 * HOUR, 'work', 'meeting')
+    add(db, 5, T0 + 22 * HOUR, 'sleep')
+    add(db, 6, T1 + 7 * HOUR)
+    return SpanFrame.load(db, T0, T1 + 12 * HOUR)
+
+
+def test_load(frame):
+    assert frame.span_ids.tolist() == [1, 2, 3, 4, 5]
+    assert frame.ended.tolist() == frame.started[1:].tolist() + [
+        T1 + 7 * HOUR]
+    assert frame.durations.tolist() == [
+        9 * HOUR, 3 * HOUR, HOUR, 9 * HOUR, 9 * HOUR]
+    assert sorted(frame.tags) == ['lunch', 'meeting', 'sleep', 'work']
+    assert frame.tag_matrix.shape == (5, 4)
+
+
+def test_tag_totals(frame):
+    assert frame.tag_totals() == {
+        'sleep': 18 * HOUR, 'work': 12 * HOUR, 'lunch': HOUR,
+        'meeting': 9 * HOUR}
+
+
+def test_day_totals_match_report(db, frame):
+    totals = frame.day_totals()
+    assert totals.days.tolist() == [DAY.toordinal(), DAY.toordinal() + 1]
+    report = Report(db)
+    for day, seconds in zip(totals.days, totals.seconds):
+        date = datetime.date.fromordinal(int(day))
+        expected = report.get_totals(date, date)
+        assert {tag: value for tag, value in zip(frame.tags, seconds.tolist())
+                if value} == expected
+
+
+def test_cooccurrence(frame):
+    counts = frame.cooccurrence()
+    index = {tag: i for i, tag in enumerate(frame.tags)}
+    assert counts[index['work'], index['meeting']] == 1
+    assert counts[index['work'], index['work']] == 2
+    assert counts[index['sleep'], index['work']] == 0
+
+
+def test_empty(db):
+    frame = SpanFrame.load(db, T0, T1)
+    assert len(frame) == 0
+    assert frame.tag_totals() == {}
+    assert frame.day_totals().seconds.shape == (1, 0)
+    assert frame.cooccurrence().shape == (0, 0)
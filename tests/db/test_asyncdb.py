@@ -0,0 +1,91 @@
+import queue
+import sqlite3
+
+import pytest
+
+from alho.asyncdb import AsyncDatabase
+from alho.db import Database, create_tables
+
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = str(tmp_path / 'alho.db')
+    conn = sqlite3.connect(filename)
+    create_tables(conn)
+    conn.close()
+    return filename
+
+
+@pytest.fixture
+def file_db(filename):
+    db = Database(sqlite3.connect(filename), 12345)
+    yield db
+    db.conn.close()
+
+
+@pytest.fixture
+def reader(filename):
+    reader = AsyncDatabase(filename)
+    yield reader
+    reader.close()
+
+
+def test_submit(file_db, reader, fake_times):
+    s1 = file_db.set_span(1, 5)
+    file_db.add_tag(1, 'a')
+    assert reader.submit('get_span', 1).result() == s1
+    assert reader.submit('get_tags', 1).result() == {'a'}
+    assert reader.submit('get_span_durations').result() == [
+        (1, 5, None, None)]
+
+
+def test_call_delivers(file_db, filename, fake_times):
+    s1 = file_db.set_span(1, 5)
+    delivered = queue.SimpleQueue()
+    reader = AsyncDatabase(filename, delivered.put)
+    try:
+        results = []
+        reader.call('get_span', 1, callback=results.append).result()
+        assert results == []
+        delivered.get(timeout=5)()
+        assert results == [s1]
+    finally:
+        reader.close()
+
+
+def test_call_errback(reader):
+    errors = []
+    future = reader.call('no_such_method', callback=None,
+                         errback=errors.append)
+    with pytest.raises(AttributeError):
+        future.result()
+    reader.close()
+    assert len(errors) == 1
+    assert isinstance(errors[0], AttributeError)
+
+
+def test_call_logs_without_errback(reader, caplog):
+    future = reader.call('no_such_method', callback=None)
+    with pytest.raises(AttributeError):
+        future.result()
+    reader.close()
+    assert 'Database.no_such_method failed' in caplog.text
+
+
+def test_preload_tag_index(file_db, filename, fake_times):
+    file_db.set_span(1, 5)
+    file_db.add_tag(1, 'walk')
+    file_db.add_tag(1, 'work')
+    delivered = queue.SimpleQueue()
+    reader = AsyncDatabase(filename, delivered.put)
+    try:
+        file_db.preload_tag_index(reader)
+        reader.submit('get_tags', 1).result()
+        file_db.remove_tag(1, 'work')
+        file_db.add_tag(1, 'wander')
+        assert file_db._tag_index is None
+        delivered.get(timeout=5)()
+        assert file_db._tag_index is not None
+        assert sorted(file_db.get_tag_completions('w')) == ['walk', 'wander']
+    finally:
+        reader.close()
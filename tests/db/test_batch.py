@@ -0,0 +1,57 @@
+import pytest
+
+
+def test_batch_single_commit(db, fake_times):
+    commits = []
+    db.conn.set_trace_callback(
+        lambda sql: commits.append(sql) if sql == 'COMMIT' else None)
+    with db.batch():
+        span = db.add_span()
+        db.add_tag(span.span_id, 'a')
+        db.add_tag(span.span_id, 'b')
+        assert commits == []
+    db.conn.set_trace_callback(None)
+    assert commits == ['COMMIT']
+    assert db.get_span(span.span_id) == span
+    assert db.get_tags(span.span_id) == {'a', 'b'}
+
+
+def test_batch_consecutive_timestamps(db, fake_times):
+    with db.batch():
+        edits = [db.add_span() for i in range(3)]
+        tag_edits = [db.add_tag(edits[0].span_id, name) for name in 'xyz']
+    for group in edits, tag_edits:
+        stamps = [edit.edited for edit in group]
+        assert len({stamp.time for stamp in stamps}) == 1
+        assert [stamp.ctr for stamp in stamps] == list(
+            range(stamps[0].ctr, stamps[0].ctr + 3))
+    assert list(db.get_spans()) == edits
+    assert list(db.get_tag_history(edits[0].span_id)) == tag_edits
+
+
+def test_batch_after_existing_edits(db, fake_time):
+    before = db.add_span()
+    with db.batch():
+        during = db.add_span()
+    assert during.edited > before.edited
+    after = db.add_span()
+    assert after.edited > during.edited
+    assert list(db.get_spans()) == [before, during, after]
+
+
+def test_batch_nested(db, fake_times):
+    with db.batch():
+        span = db.add_span()
+        with db.batch():
+            db.add_tag(span.span_id, 'q')
+        assert db.get_span(span.span_id) is None
+    assert db.get_tags(span.span_id) == {'q'}
+
+
+def test_batch_discarded_on_error(db, fake_times):
+    with pytest.raises(ZeroDivisionError):
+        with db.batch():
+            span = db.add_span()
+            1 / 0
+    assert db.get_span(span.span_id) is None
+    assert list(db.get_spans()) == []
@@ -0,0 +1,133 @@
+import io
+
+import pytest
+
+from alho.__main__ import main
+from alho.db import (Database, SpansImported, check_current_tables,
+                     edit_event)
+from alho.export import SPAN_FIELDS, epoch_time, span_records, write_csv
+from alho.importer import (parse_time, read_csv, read_jsonl, split_tags,
+                           spans_from_records)
+
+
+def index_names(db):
+    return {row[0] for row in db.conn.execute(
+        "select name from sqlite_master where type = 'index'")}
+
+
+@pytest.mark.parametrize('rebuild_indexes', [False, True])
+def test_bulk_load(db, fake_times, rebuild_indexes):
+    db.add_tag(db.set_span('new', 50).span_id, 'old')
+    indexes = index_names(db)
+    events = []
+    db.add_listener(events.extend)
+    result = db.bulk_load([(100, ['a', 'b']), (200, []), (300, ['a', 'a'])],
+                          chunk_size=2, rebuild_indexes=rebuild_indexes)
+    assert result == (3, 3)
+    assert index_names(db) == indexes
+    assert check_current_tables(db.conn)
+    spans = list(db.get_spans())
+    assert [span.started for span in spans] == [50, 100, 200, 300]
+    assert all(type(edit_event(span)).__name__ == 'SpanCreated'
+               for span in spans)
+    assert [db.get_tags(span.span_id) for span in spans] == [
+        {'old'}, {'a', 'b'}, set(), {'a'}]
+    assert [type(event) for event in events] == [SpansImported] * 2
+    assert events[0].span_ids == {spans[1].span_id, spans[2].span_id}
+    assert db.get_tag_completions('') == ['a', 'b', 'old']
+    assert db.set_span('new', 400).edited > spans[-1].edited
+
+
+def test_bulk_load_counter_rollover(db, fake_times):
+    assert db.bulk_load((started, ['x']) for started in range(0x10010)) == (
+        0x10010, 0x10010)
+    assert check_current_tables(db.conn)
+    assert db.conn.execute(
+        'select count(distinct span_id) from current_span').fetchone()[0] == (
+            0x10010)
+
+
+def test_parse_time():
+    assert parse_time('1234') == 1234
+    assert parse_time(' 1234.5 ') == 1234
+    assert parse_time('1970-01-01T00:20:34+00:00') == 1234
+    assert parse_time('') is None
+    assert parse_time(None) is None
+    with pytest.raises(ValueError):
+        parse_time('yesterday')
+
+
+def test_split_tags():
+    assert split_tags('a b,c, d') == ['a', 'b', 'c', 'd']
+    assert split_tags(['a', '']) == ['a']
+    assert split_tags(None) == []
+
+
+def test_split_tags_as_gui():
+    assert split_tags('Work; Email;work') == ['email', 'work']
+    assert split_tags(['Alho', 'a;B']) == ['a', 'alho', 'b']
+    with pytest.raises(ValueError):
+        split_tags('[stuff]')
+
+
+def test_readers():
+    text = 'Start,Stop,Project,Tags\n100,150,alho,a b\n200,,x,\n'
+    assert list(read_csv(io.StringIO(text), 'Start', 'Stop',
+                         ['Project', 'Tags'])) == [
+        (100, 150, ['alho', 'a', 'b']), (200, None, ['x'])]
+    text = '{"start": 100, "tags": ["a"]}\n\n{"start": 200, "tags": "b c"}\n'
+    assert list(read_jsonl(io.StringIO(text))) == [
+        (100, None, ['a']), (200, None, ['b', 'c'])]
+
+
+def test_readers_reject_missing_start():
+    text = 'start,end,tags\n100,150,a\n,300,b\n'
+    with pytest.raises(ValueError, match='line 3: no start time'):
+        list(read_csv(io.StringIO(text)))
+    text = '{"start": 100, "tags": []}\n\n{"start": "", "tags": "b"}\n'
+    with pytest.raises(ValueError, match='line 3: no start time'):
+        list(read_jsonl(io.StringIO(text)))
+
+
+def test_readers_report_missing_columns():
+    text = 'start,tags\n100,a\n'
+    with pytest.raises(ValueError, match="line 2: no 'Start' column"):
+        list(read_csv(io.StringIO(text), start='Start'))
+    with pytest.raises(ValueError, match="line 2: no 'Tags' column"):
+        list(read_csv(io.StringIO(text), tags=['Tags']))
+    with pytest.raises(ValueError, match='line 1: '):
+        list(read_jsonl(io.StringIO('{"start": 1')))
+
+
+def test_import_missing_start(db, tmpdir):
+    csv_path = str(tmpdir.join('spans.csv'))
+    with open(csv_path, 'w', newline='') as f:
+        f.write('start,end,tags\n100,150,a\n,300,b\n')
+    filename = str(tmpdir.join('copy.db'))
+    with pytest.raises(SystemExit, match='line 3: no start time'):
+        main(['-f', filename, 'import', csv_path])
+
+
+def test_spans_from_records():
+    assert list(spans_from_records([
+        (100, 200, ['a']), (200, 250, ['b']), (300, None, ['c']),
+        (400, 500, []),
+    ])) == [(100, ['a']), (200, ['b']), (250, []), (300, ['c']),
+            (400, []), (500, [])]
+
+
+def test_round_trip(db, fake_times, tmpdir):
+    for started, tags in (100, ['a']), (200, []), (300, ['b', 'c']):
+        db.bulk_load([(started, tags)])
+    csv_path = str(tmpdir.join('spans.csv'))
+    with open(csv_path, 'w', newline='') as f:
+        write_csv(span_records(db, format_time=epoch_time), SPAN_FIELDS, f)
+    filename = str(tmpdir.join('copy.db'))
+    main(['-f', filename, 'import', '--rebuild-indexes', csv_path])
+    copy = Database.open(filename)
+    try:
+        assert [(span.started, copy.get_tags(span.span_id))
+                for span in copy.get_spans()] == [
+            (100, {'a'}), (200, set()), (300, {'b', 'c'})]
+    finally:
+        copy.close()
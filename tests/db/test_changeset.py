@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+from alho.changeset import read_changeset, write_changeset
+from alho.db import SpanEdit, TagEdit, TimeStamp
+
+
+def sample_edits():
+    return [
+        SpanEdit(TimeStamp(1000, 12345, 0), 1, 990),
+        TagEdit(TimeStamp(1000, 12345, 1), 1, 'work', 1),
+        TagEdit(TimeStamp(1001, -2**31, 0), 1, 'café', 1),
+        SpanEdit(TimeStamp(-2**31, 2**31 - 1, 0xffff), 2**62, -5),
+        SpanEdit(TimeStamp(2**31 - 1, 7, 3), 1, None),
+        TagEdit(TimeStamp(1002, 12345, 0), 1, 'work', 0),
+    ]
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_round_trip(compress):
+    edits = sample_edits()
+    out = io.BytesIO()
+    assert write_changeset(out, edits, compress) == len(edits)
+    assert list(read_changeset(io.BytesIO(out.getvalue()))) == edits
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_round_trip_large(compress):
+    edits = []
+    for i in range(20000):
+        stamp = TimeStamp(1000000 + i // 3, 42, i % 3)
+        if i % 4:
+            edits.append(TagEdit(stamp, i // 4, 'tag%d' % (i % 37), i % 2))
+        else:
+            edits.append(SpanEdit(stamp, i // 4, 1000000 + i))
+    out = io.BytesIO()
+    write_changeset(out, edits, compress)
+    assert list(read_changeset(io.BytesIO(out.getvalue()))) == edits
+    if compress:
+        assert len(out.getvalue()) < len(edits) * 4
+
+
+def test_round_trip_db(db, fake_times):
+    span = db.add_span()
+    db.add_tag(span.span_id, 'a')
+    db.delete_span(span.span_id)
+    out = io.BytesIO()
+    write_changeset(out, db.export_changes())
+    edits = list(read_changeset(io.BytesIO(out.getvalue())))
+    assert edits == list(db.export_changes())
+
+
+def test_empty():
+    out = io.BytesIO()
+    assert write_changeset(out, []) == 0
+    assert list(read_changeset(io.BytesIO(out.getvalue()))) == []
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'ALH',
+    b'NOPE\x01\x00\x00',
+    b'ALHO\x63\x00\x00',
+    b'ALHO\x01\x00',
+    b'ALHO\x01\x00\x02\x00\x00',
+    b'ALHO\x01\x00\x77',
+    b'ALHO\x01\x01not zlib at all',
+    b'ALHO\x01\x00\x04' + bytes(25) + b'\x00',
+    b'ALHO\x01\x00\x01\x02\x00\xff\xfe\x00',
+])
+def test_invalid(data):
+    with pytest.raises(ValueError):
+        list(read_changeset(io.BytesIO(data)))
+
+
+def test_name_too_long():
+    out = io.BytesIO()
+    with pytest.raises(ValueError):
+        write_changeset(out, [TagEdit(TimeStamp(1, 1, 0), 1, 'x' * 65536, 1)])
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from alho.columnar import (NULL_TIME, NPY_HEADER_SIZE, export_columns,
+                           load_column)
+
+
+def column(directory, name):
+    return list(load_column(os.path.join(directory, name + '.npy')))
+
+
+def test_export(db, fake_times, tmpdir):
+    s1 = db.set_span('new', 100)
+    s2 = db.set_span('new', 200)
+    db.add_tag(s1.span_id, 'a')
+    db.add_tag(s1.span_id, 'b')
+    db.remove_tag(s1.span_id, 'a')
+    db.delete_span(s2.span_id)
+    out = str(tmpdir)
+    assert export_columns(db, out) == (3, 3)
+    assert column(out, 'span_edits.span_id') == [
+        s1.span_id, s2.span_id, s2.span_id]
+    assert column(out, 'span_edits.started') == [100, 200, NULL_TIME]
+    assert column(out, 'span_edits.edit_loc') == [12345] * 3
+    assert column(out, 'tag_edits.active') == [1, 1, 0]
+    assert column(out, 'current_spans.span_id') == [s1.span_id]
+    with open(os.path.join(out, 'tags.json')) as f:
+        names = json.load(f)
+    assert [names[tag_id]
+            for tag_id in column(out, 'current_span_tags.tag_id')] == ['b']
+    assert [names[tag_id] for tag_id in column(out, 'tag_edits.tag_id')] == [
+        'a', 'b', 'a']
+
+
+def test_append(db, fake_times, tmpdir):
+    out = str(tmpdir)
+    s1 = db.set_span('new', 100)
+    assert export_columns(db, out) == (1, 0)
+    assert export_columns(db, out) == (0, 0)
+    db.set_span(s1.span_id, 150)
+    db.add_tag(s1.span_id, 'a')
+    assert export_columns(db, out) == (1, 1)
+    assert column(out, 'span_edits.started') == [100, 150]
+    assert column(out, 'current_spans.started') == [150]
+    assert export_columns(db, out, full=True) == (2, 1)
+    assert column(out, 'span_edits.started') == [100, 150]
+
+
+def test_unfinished_export_is_cut_back(db, fake_times, tmpdir):
+    out = str(tmpdir)
+    db.set_span('new', 100)
+    export_columns(db, out)
+    path = os.path.join(out, 'span_edits.started.npy')
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 16)
+    db.set_span('new', 200)
+    export_columns(db, out)
+    assert os.path.getsize(path) == NPY_HEADER_SIZE + 2 * 8
+    assert column(out, 'span_edits.started') == [100, 200]
+
+
+def test_other_database_rejected(db, fake_times, tmpdir):
+    db.set_span('new', 100)
+    export_columns(db, str(tmpdir))
+    db.location_id = 54321
+    with pytest.raises(ValueError):
+        export_columns(db, str(tmpdir))
+
+
+def test_numpy_load(db, fake_times, tmpdir):
+    np = pytest.importorskip('numpy')
+    db.set_span('new', 100)
+    db.set_span('new', 200)
+    export_columns(db, str(tmpdir))
+    started = np.load(os.path.join(str(tmpdir), 'span_edits.started.npy'),
+                      mmap_mode='r')
+    assert started.dtype == np.int64
+    assert started.tolist() == [100, 200]
@@ -0,0 +1,75 @@
+from alho.db import check_current_tables
+
+
+def table_size(db, table):
+    return db.conn.execute(
+        'select count(*) from {}'.format(table)).fetchone()[0]
+
+
+def make_history(db, fake_time):
+    kept = db.set_span(1, 100)
+    db.set_span(1, 110)
+    db.add_tag(1, 'a')
+    db.add_tag(1, 'b')
+    db.remove_tag(1, 'a')
+    db.remove_tag(1, 'b')
+    db.add_tag(1, 'b')
+    db.set_span(2, 200)
+    db.add_tag(2, 'c')
+    db.delete_span(2)
+    fake_time.value += 100
+    late = db.set_span(1, 120)
+    db.add_tag(1, 'a')
+    return kept, late
+
+
+def test_compact(db, fake_time):
+    kept, late = make_history(db, fake_time)
+    before = {span_id: (db.get_span(span_id), db.get_tags(span_id))
+              for span_id in (1, 2)}
+    dropped = db.compact(int(fake_time.value) - 50, chunk_size=2)
+    assert dropped == 7
+    assert check_current_tables(db.conn)
+    assert db.get_span(1) == before[1][0] == late
+    assert db.get_tags(1) == before[1][1] == {'a', 'b'}
+    assert db.get_span(2) is None
+    assert db.get_tags(2) == set()
+    assert [edit.started for edit in db.get_span_history(1)] == [110, 120]
+    assert [(edit.name, edit.active)
+            for edit in db.get_tag_history(1)] == [
+                ('a', 0), ('b', 1), ('a', 1)]
+    assert table_size(db, 'span') == 2
+    assert table_size(db, 'span_tag') == 3
+
+
+def test_compact_keeps_recent(db, fake_time):
+    make_history(db, fake_time)
+    assert db.compact(int(fake_time.value) - 500) == 0
+    assert table_size(db, 'span') == 5
+    assert table_size(db, 'span_tag') == 7
+    assert check_current_tables(db.conn)
+
+
+def test_compact_again(db, fake_time):
+    make_history(db, fake_time)
+    horizon = int(fake_time.value) + 1
+    steps = list(db.compact_steps(horizon, chunk_size=1))
+    assert len(steps) > 5
+    assert sum(steps) == 9
+    assert db.compact(horizon) == 0
+    assert check_current_tables(db.conn)
+    assert db.get_tags(1) == {'a', 'b'}
+    assert db.get_span(1).started == 120
+    assert table_size(db, 'span') == 1
+    assert table_size(db, 'span_tag') == 2
+
+
+def test_compact_removed_tags(db, fake_time):
+    db.set_span(1, 100)
+    db.add_tag(1, 'x')
+    db.remove_tag(1, 'x')
+    db.add_tag(1, 'y')
+    assert db.compact(int(fake_time.value) + 1) == 2
+    assert [edit.name for edit in db.get_tag_history(1)] == ['y']
+    assert table_size(db, 'current_span_tag') == 1
+    assert check_current_tables(db.conn)
@@ -0,0 +1,133 @@
+from alho.completion import TagIndex
+
+
+def test_prefix_matches():
+    index = TagIndex(now=0)
+    for name in ['work', 'walk', 'write', 'sleep', 'wo', 'x']:
+        index.add(name, 0)
+    assert index.complete('w') == ['walk', 'wo', 'work', 'write']
+    assert index.complete('wo') == ['wo', 'work']
+    assert index.complete('wr') == ['write']
+    assert index.complete('z') == []
+    assert index.complete('', limit=2) == ['sleep', 'walk']
+
+
+def test_ranked_by_recent_frequency():
+    index = TagIndex(now=0)
+    index.add('work', 0)
+    index.add('walk', 0)
+    index.add('walk', 0)
+    assert index.complete('w') == ['walk', 'work']
+    index.add('work', TagIndex.HALF_LIFE * 2)
+    assert index.complete('w') == ['work', 'walk']
+    index.add('write', -TagIndex.HALF_LIFE * 10)
+    assert index.complete('w') == ['work', 'walk', 'write']
+    assert len(index) == 3
+
+
+def test_remove_use_on_span():
+    index = TagIndex(now=0)
+    index.add('work', 0, span_id=1)
+    index.add('work', 0, span_id=1)
+    index.add('walk', 0, span_id=1)
+    index.add('walk', 0, span_id=2)
+    assert index.complete('w') == ['walk', 'work']
+    index.remove('walk', 2)
+    index.remove('walk', 2)
+    assert index.complete('w') == ['walk', 'work']
+    index.remove('work', 1)
+    assert index.complete('w') == ['walk']
+    index.remove('walk', 1)
+    assert index.complete('') == []
+    assert len(index) == 0
+
+
+def test_set_span_uses():
+    index = TagIndex(now=0)
+    index.add('work', 0, span_id=1)
+    index.add('walk', 0, span_id=1)
+    index.add('walk', 0, span_id=2)
+    index.set_span(1, {'wander': 0, 'walk': 0})
+    assert index.complete('w') == ['walk', 'wander']
+    index.set_span(2, {})
+    index.set_span(1, {})
+    assert len(index) == 0
+    assert index.uses == {}
+
+
+def test_db_completions(db, fake_times):
+    db.set_span(1, 5)
+    db.set_span(2, 10)
+    db.add_tag(1, 'work')
+    db.add_tag(2, 'work')
+    db.add_tag(2, 'walk')
+    db.add_tag(1, 'sleep')
+    db.remove_tag(1, 'sleep')
+    assert db.get_tag_completions('w') == ['work', 'walk']
+    assert db.get_tag_completions('s') == []
+    with db.batch():
+        db.add_tag(1, 'walk')
+        db.add_tag(1, 'wander')
+    assert db.get_tag_completions('wa') == ['walk', 'wander']
+    assert db.get_tag_completions('w', limit=1) == ['walk']
+
+
+def test_db_completions_after_remove(db, fake_times):
+    db.set_span(1, 5)
+    db.add_tag(1, 'sleep')
+    db.add_tag(1, 'snack')
+    assert sorted(db.get_tag_completions('s')) == ['sleep', 'snack']
+    db.remove_tag(1, 'sleep')
+    assert db.get_tag_completions('s') == ['snack']
+    with db.batch():
+        db.add_tag(1, 'sleep')
+        db.remove_tag(1, 'snack')
+    assert db.get_tag_completions('s') == ['sleep']
+    db.add_tag(1, 'sleep')
+    assert db._tag_index.counts == db.load_tag_index().counts
+
+
+def test_db_completions_after_rollback(db, fake_times):
+    db.set_span(1, 5)
+    db.add_tag(1, 'sleep')
+    assert db.get_tag_completions('s') == ['sleep']
+    try:
+        with db.batch():
+            db.remove_tag(1, 'sleep')
+            db.add_tag(1, 'snack')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert db.get_tag_completions('s') == ['sleep']
+
+
+def test_db_completions_skip_deleted_spans(db, fake_times):
+    db.set_span(1, 5)
+    db.set_span(2, 10)
+    db.add_tag(1, 'sleep')
+    db.add_tag(2, 'snack')
+    db.delete_span(2)
+    assert db.get_tag_completions('s') == ['sleep']
+    db.delete_span(1)
+    assert db.get_tag_completions('s') == []
+    db.set_span(2, 10)
+    assert db.get_tag_completions('s') == ['snack']
+    assert db.load_tag_index().complete('s') == ['snack']
+
+
+def test_db_completions_after_import(db, fake_times):
+    import sqlite3
+    from alho.db import Database, create_tables
+    db.set_span(1, 5)
+    db.add_tag(1, 'sleep')
+    index = db._tag_index = db.load_tag_index()
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    other = Database(conn, 999)
+    other.set_span(2, 10)
+    other.add_tag(2, 'snack')
+    assert db.import_changes(other.export_changes()).inserted == 2
+    assert db.import_changes(other.export_changes()).inserted == 0
+    db.bulk_load([(20, ['sauna'])])
+    assert db._tag_index is index
+    assert sorted(db.get_tag_completions('s')) == ['sauna', 'sleep', 'snack']
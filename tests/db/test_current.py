@@ -0,0 +1,189 @@
+import sqlite3
+
+from alho.db import (Database, check_current_tables, create_tables,
+                     rebuild_current_tables, upgrade_tables)
+
+
+def create_old_db(location):
+    """Create a database using the original view-based schema."""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('create table local_data (loc_id int not null)')
+    conn.execute("""
+      create table span (
+        edit_time integer primary key not null,
+        edit_loc int not null,
+        span_id int not null,
+        started int
+      )
+    """)
+    conn.execute("""
+      create table span_tag (
+        edit_time integer primary key not null,
+        edit_loc int not null,
+        span_id int not null,
+        name text not null,
+        active int not null
+      )
+    """)
+    conn.execute("""
+      create view current_span as
+        select *
+        from span as cur_span
+        where not exists(select 1
+          from span as newer_span
+          where newer_span.span_id = cur_span.span_id
+            and newer_span.edit_time > cur_span.edit_time)
+    """)
+    conn.execute("""
+      create view current_span_tag as
+        select *
+        from span_tag as cur_span_tag
+        where not exists(select 1
+          from span_tag as newer_span_tag
+          where newer_span_tag.span_id = cur_span_tag.span_id
+            and newer_span_tag.name = cur_span_tag.name
+            and newer_span_tag.edit_time > cur_span_tag.edit_time)
+    """)
+    return Database(conn, location)
+
+
+def create_v1_db(location):
+    """Create a database with the name-keyed current tables of version 1."""
+    db = create_old_db(location)
+    db.conn.execute('drop view current_span')
+    db.conn.execute('drop view current_span_tag')
+    db.conn.execute("""
+      create table current_span (
+        span_id integer primary key not null,
+        edit_time int not null,
+        edit_loc int not null,
+        started int
+      )
+    """)
+    db.conn.execute("""
+      create table current_span_tag (
+        span_id int not null,
+        name text not null,
+        edit_time int not null,
+        edit_loc int not null,
+        active int not null,
+        primary key (span_id, name)
+      ) without rowid
+    """)
+    db.conn.execute("""
+      create trigger span_current_trigger after insert on span
+      begin
+        insert or replace into current_span
+          values (new.span_id, new.edit_time, new.edit_loc, new.started);
+      end
+    """)
+    db.conn.execute("""
+      create trigger span_tag_current_trigger after insert on span_tag
+      begin
+        insert or replace into current_span_tag
+          values (new.span_id, new.name, new.edit_time, new.edit_loc,
+                  new.active);
+      end
+    """)
+    db.conn.execute('pragma user_version = 1')
+    return db
+
+
+def fill(db):
+    s1 = db.set_span(1, 5)
+    s2 = db.set_span(2, 10)
+    db.set_span(s1.span_id, 20)
+    db.delete_span(s2.span_id)
+    db.add_tag(s1.span_id, 'a')
+    db.add_tag(s1.span_id, 'b')
+    db.remove_tag(s1.span_id, 'a')
+    return s1
+
+
+def fill_old(db):
+    """Like `fill`, but for a database with the original schema."""
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    new_db = Database(conn, db.location_id)
+    s1 = fill(new_db)
+    with db.conn:
+        for edit in new_db.get_merged_location_edits(db.location_id):
+            db.conn.execute('insert into {} values ({})'.format(
+                edit.TABLE, ', '.join('?' * len(edit.as_row))), edit.as_row)
+    return s1
+
+
+def test_current_tables_consistent(db, fake_times):
+    fill(db)
+    assert check_current_tables(db.conn)
+
+
+def test_check_detects_mismatch(db, fake_times):
+    s1 = fill(db)
+    db.conn.execute('update current_span set started = 7 where span_id = ?',
+                    [s1.span_id])
+    assert not check_current_tables(db.conn)
+    rebuild_current_tables(db.conn)
+    assert check_current_tables(db.conn)
+    assert db.get_span(s1.span_id).started == 20
+
+
+def test_rebuild_from_history(db, fake_times):
+    s1 = fill(db)
+    db.conn.execute('delete from current_span')
+    db.conn.execute('delete from current_span_tag')
+    rebuild_current_tables(db.conn)
+    assert [edit.span_id for edit in db.get_spans()] == [s1.span_id]
+    assert db.get_tags(s1.span_id) == {'b'}
+
+
+def test_out_of_order_edit_ignored(db, fake_times):
+    s1 = db.set_span(1, 5)
+    older = s1._replace(edited=s1.edited._replace(time=s1.edited.time - 10),
+                        started=99)
+    with db.conn:
+        db.conn.execute('insert into span values (?, ?, ?, ?)', older.as_row)
+    assert list(db.get_spans()) == [s1]
+    assert check_current_tables(db.conn)
+
+
+def test_newer_edit_inserted_or_ignored(db, fake_times):
+    s1 = db.set_span(1, 5)
+    newer = s1._replace(edited=s1.edited._replace(time=s1.edited.time + 10),
+                        started=99)
+    with db.conn:
+        db.conn.execute('insert or ignore into span values (?, ?, ?, ?)',
+                        newer.as_row)
+    assert list(db.get_spans()) == [newer]
+    assert check_current_tables(db.conn)
+
+
+def test_upgrade_from_views(fake_times):
+    db = create_old_db(54321)
+    s1 = fill_old(db)
+    upgrade_tables(db.conn)
+    assert db.conn.execute('pragma user_version').fetchone()[0] >= 2
+    assert check_current_tables(db.conn)
+    assert list(db.get_spans()) == [db.get_span(s1.span_id)]
+    assert db.get_tags(s1.span_id) == {'b'}
+    db.add_tag(s1.span_id, 'c')
+    assert db.get_tags(s1.span_id) == {'b', 'c'}
+
+
+def test_upgrade_from_version_1(fake_times):
+    db = create_v1_db(54321)
+    s1 = fill_old(db)
+    upgrade_tables(db.conn)
+    assert db.conn.execute('pragma user_version').fetchone()[0] >= 2
+    assert check_current_tables(db.conn)
+    assert db.get_tags(s1.span_id) == {'b'}
+    db.add_tag(s1.span_id, 'c')
+    assert db.get_tags(s1.span_id) == {'b', 'c'}
+
+
+def test_span_tag_indexes(db):
+    assert {row[0] for row in db.conn.execute("""
+      select name from sqlite_master
+        where type = 'index' and tbl_name = 'span_tag'
+    """)} >= {'span_tag_span_id_idx', 'span_tag_edit_time_idx',
+              'span_tag_edit_loc_idx', 'span_tag_tag_id_idx'}
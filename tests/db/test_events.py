@@ -0,0 +1,63 @@
+import pytest
+
+from alho.db import (SpanCreated, SpanDeleted, SpanMoved, SpansImported,
+                     TagAdded, TagRemoved)
+
+
+@pytest.fixture
+def events(db):
+    events = []
+    db.add_listener(events.append)
+    return events
+
+
+def test_span_events(db, events, fake_times):
+    s1 = db.add_span()
+    db.set_span(s1.span_id, 50)
+    db.delete_span(s1.span_id)
+    assert events == [[SpanCreated(s1.span_id, s1.started)],
+                      [SpanMoved(s1.span_id, 50)],
+                      [SpanDeleted(s1.span_id)]]
+
+
+def test_tag_events(db, events, fake_times):
+    db.add_tag(1, 'a')
+    db.remove_tag(1, 'a')
+    assert events == [[TagAdded(1, 'a')], [TagRemoved(1, 'a')]]
+
+
+def test_batch_notifies_once(db, events, fake_times):
+    with db.batch():
+        s1 = db.add_span()
+        db.add_tag(s1.span_id, 'a')
+        assert events == []
+    assert events == [[SpanCreated(s1.span_id, s1.started),
+                       TagAdded(s1.span_id, 'a')]]
+
+
+def test_failed_batch_not_notified(db, events, fake_times):
+    with pytest.raises(RuntimeError):
+        with db.batch():
+            db.add_span()
+            raise RuntimeError
+    assert events == []
+
+
+def test_import_events(db, events, fake_times):
+    import sqlite3
+    from alho.db import Database, create_tables
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    other = Database(conn, 999)
+    other.set_span(1, 5)
+    other.add_tag(2, 'a')
+    db.import_changes(other.export_changes())
+    assert events == [[SpansImported(frozenset({1, 2}))]]
+    db.import_changes(other.export_changes())
+    assert len(events) == 1
+
+
+def test_remove_listener(db, events, fake_times):
+    db.remove_listener(events.append)
+    db.add_span()
+    assert events == []
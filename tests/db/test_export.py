@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+
+import pytest
+
+from alho.__main__ import main
+from alho.db import Database
+from alho.export import (EDIT_FIELDS, SPAN_FIELDS, edit_records, epoch_time,
+                         span_records, write_csv, write_jsonl)
+
+
+def add(db, started, *tags):
+    span = db.set_span('new', started)
+    for name in tags:
+        db.add_tag(span.span_id, name)
+    return span
+
+
+@pytest.fixture
+def spans(db, fake_times):
+    return [add(db, 100, 'b', 'a'), add(db, 200), add(db, 350, 'c')]
+
+
+def test_span_records(db, spans):
+    assert list(span_records(db, format_time=epoch_time)) == [
+        (spans[0].span_id, 100, 200, 100, ['a', 'b']),
+        (spans[1].span_id, 200, 350, 150, []),
+        (spans[2].span_id, 350, None, None, ['c']),
+    ]
+    assert [record[0] for record in span_records(db, 150, 300)] == [
+        spans[0].span_id, spans[1].span_id]
+
+
+def test_edit_records(db, spans, fake_times):
+    records = list(edit_records(db, format_time=epoch_time))
+    assert sorted(record[3:] for record in records if record[5] is None) == [
+        (span.span_id, span.started, None, None) for span in spans]
+    assert sorted(record[5:] for record in records if record[5]) == [
+        ('a', 1), ('b', 1), ('c', 1)]
+    edited = spans[1].edited.time
+    assert all(record[0] >= edited for record in
+               edit_records(db, edited, format_time=epoch_time))
+
+
+def test_write_csv(db, spans):
+    out = io.StringIO()
+    assert write_csv(span_records(db, format_time=epoch_time), SPAN_FIELDS,
+                     out) == 3
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert rows[0] == SPAN_FIELDS
+    assert rows[1][1:] == ['100', '200', '100', 'a b']
+    assert rows[3][2:] == ['', '', 'c']
+
+
+def test_write_jsonl(db, spans):
+    out = io.StringIO()
+    assert write_jsonl(edit_records(db), EDIT_FIELDS, out) == 6
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines[1]['tag'] in ('a', 'b')
+    assert lines[0]['start'].startswith('1970-01-01')
+
+
+def test_export_command(tmpdir, fake_times):
+    filename = str(tmpdir.join('alho.db'))
+    db = Database.open(filename, location_id=1)
+    span = add(db, 100, 'a')
+    db.close()
+    output = str(tmpdir.join('out.jsonl'))
+    main(['-f', filename, 'export', '--format', 'jsonl', '--time-format',
+          'epoch', '-o', output])
+    with open(output) as f:
+        assert [json.loads(line) for line in f] == [{
+            'span_id': span.span_id, 'start': 100, 'end': None,
+            'duration': None, 'tags': ['a']}]
@@ -0,0 +1,52 @@
+import pytest
+
+from alho.db import Database
+from alho.instrument import Profiler
+
+
+@pytest.fixture
+def profiler(db):
+    profiler = Profiler(buffer_size=5)
+    profiler.attach(db)
+    return profiler
+
+
+def test_counts_calls_and_rows(db, profiler, fake_times):
+    db.set_span(1, 5)
+    db.set_span(2, 10)
+    db.add_tag(1, 'a')
+    assert db.get_tags(1) == {'a'}
+    assert len(list(db.get_spans())) == 2
+    stats = profiler.stats
+    assert stats['set_span'].calls == 2
+    assert stats['set_tag'].calls == 1
+    assert stats['get_tags'].rows == 1
+    assert stats['get_spans'].calls == 1
+    assert stats['get_spans'].rows == 2
+    assert stats['get_spans'].statements == 1
+    assert stats['get_next_timestamp'].calls == 3
+    assert all(stat.seconds >= 0 for stat in stats.values())
+
+
+def test_statements_ring_buffer(db, profiler, fake_times):
+    for span_id in range(10):
+        db.set_span(span_id, span_id)
+    assert len(profiler.statements) == 5
+    assert {method for method, sql in profiler.statements} == {'set_span'}
+    assert any('insert into span' in sql for _, sql in profiler.statements)
+    summary = profiler.summary()
+    assert 'set_span' in summary.splitlines()[1]
+    assert 'insert into span' in summary
+
+
+def test_detach(db, profiler, fake_times):
+    profiler.detach(db)
+    assert 'set_span' not in vars(db)
+    db.set_span(1, 5)
+    assert profiler.stats == {}
+    assert len(profiler.statements) == 0
+
+
+def test_not_attached_unwrapped(db):
+    assert vars(db).keys().isdisjoint(
+        name for name in vars(Database) if not name.startswith('_'))
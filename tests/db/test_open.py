@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+from alho.db import SCHEMA_VERSION, Database, connect
+
+
+def pragma(conn, name):
+    return conn.execute('pragma {}'.format(name)).fetchone()[0]
+
+
+def test_open_creates(tmp_path):
+    filename = str(tmp_path / 'new.db')
+    db = Database.open(filename)
+    try:
+        assert pragma(db.conn, 'user_version') == SCHEMA_VERSION
+        assert pragma(db.conn, 'journal_mode') == 'wal'
+        assert db.location_id is not None
+        location_id = db.location_id
+    finally:
+        db.close()
+    db = Database.open(filename)
+    try:
+        assert db.location_id == location_id
+    finally:
+        db.close()
+
+
+def test_open_upgrades(tmp_path):
+    filename = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(filename)
+    conn.execute('create table local_data (loc_id int not null)')
+    conn.execute("""
+      create table span (
+        edit_time integer primary key not null,
+        edit_loc int not null,
+        span_id int not null,
+        started int
+      )
+    """)
+    conn.execute("""
+      create table span_tag (
+        edit_time integer primary key not null,
+        edit_loc int not null,
+        span_id int not null,
+        name text not null,
+        active int not null
+      )
+    """)
+    conn.execute('insert into local_data values (77)')
+    conn.commit()
+    conn.close()
+    db = Database.open(filename)
+    try:
+        assert pragma(db.conn, 'user_version') == SCHEMA_VERSION
+        assert db.location_id == 77
+    finally:
+        db.close()
+
+
+def test_pragmas(tmp_path):
+    conn = connect(str(tmp_path / 'a.db'), synchronous='FULL',
+                   cache_size=-1000, temp_store=None, busy_timeout=123)
+    assert pragma(conn, 'synchronous') == 2
+    assert pragma(conn, 'cache_size') == -1000
+    assert pragma(conn, 'temp_store') == 2
+    assert pragma(conn, 'busy_timeout') == 123
+    conn.close()
+
+
+@pytest.mark.parametrize('pragmas', [
+    {'journal_mode': 'delete'},
+    {'synchronous': 'sometimes'},
+    {'cache_size': '1; drop table span'},
+])
+def test_invalid_pragmas(tmp_path, pragmas):
+    with pytest.raises(ValueError):
+        connect(str(tmp_path / 'a.db'), **pragmas)
+
+
+def test_readers(tmp_path, fake_times):
+    import threading
+    db = Database.open(str(tmp_path / 'a.db'), readers=1)
+    try:
+        db.set_span(1, 5)
+        with db.readers.database() as reader:
+            assert reader.get_span(1) == db.get_span(1)
+            with pytest.raises(sqlite3.OperationalError):
+                reader.conn.execute('delete from span')
+            first = reader
+        results = []
+
+        def read():
+            with db.readers.database() as reader:
+                results.append(reader.get_span(1))
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        assert results == [db.get_span(1)]
+        with db.readers.database() as reader:
+            assert reader is first
+    finally:
+        db.close()
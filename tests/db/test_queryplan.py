@@ -0,0 +1,114 @@
+import sqlite3
+
+import pytest
+
+from alho.db import Database, create_tables
+from alho.queryplan import audit, capture, explain, hot_calls, plan_issues
+from benchmarks.generate import DAY, DEFAULT_PARAMS, START, generate_history
+
+
+@pytest.fixture(scope='module')
+def history():
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    db = Database(conn, 1)
+    generate_history(db, DEFAULT_PARAMS._replace(years=0.1, locations=4))
+    conn.execute('analyze')
+    span_id = conn.execute("""
+      select span_id from current_span where started is not null limit 1
+    """).fetchone()[0]
+    return db, span_id
+
+
+@pytest.fixture(scope='module')
+def calls(history):
+    db, span_id = history
+    return hot_calls(db, span_id, START + 3 * DAY, START + 4 * DAY)
+
+
+def plans(db, func):
+    return [explain(db.conn, sql, params)
+            for sql, params in capture(db, func)]
+
+
+@pytest.mark.parametrize('method, index', [
+    ('get_span', 'span_span_id_idx'),
+    ('get_spans', 'current_span_started_idx'),
+    ('get_last_span', 'current_span_started_idx'),
+    ('get_next_span', 'current_span_started_idx'),
+    ('get_span_history', 'span_span_id_idx'),
+    ('get_tag_history', 'span_tag_span_id_idx'),
+    ('get_tags', 'PRIMARY KEY (span_id=?)'),
+    ('get_tags_for_spans', 'PRIMARY KEY (span_id=?)'),
+    ('get_span_views', 'current_span_started_idx'),
+    ('get_span_durations', 'current_span_started_idx'),
+    ('get_edit_locations', 'span_tag_edit_loc_idx'),
+    ('export_changes', 'span_tag_edit_loc_idx'),
+    ('get_digest', 'span_tag_edit_loc_idx'),
+])
+def test_uses_index(history, calls, method, index):
+    db, _ = history
+    details = [detail for plan in plans(db, calls[method])
+               for detail in plan]
+    assert any(index in detail for detail in details), details
+
+
+def test_capture_keeps_placeholders(history):
+    db, span_id = history
+    statements = capture(db, lambda: db.get_span(span_id))
+    assert len(statements) == 1
+    assert '?' in statements[0].sql
+    assert str(span_id) not in statements[0].sql
+    assert list(statements[0].params) == [span_id]
+
+
+def test_next_span_is_one_search(history, calls):
+    db, _ = history
+    assert plans(db, calls['get_next_span'])[-1] == [
+        'SEARCH current_span USING COVERING INDEX current_span_started_idx'
+        ' ((started,edit_time)>(?,?))']
+
+
+def test_hot_calls_have_no_issues(history, calls):
+    db, _ = history
+    assert audit(db, calls) == []
+
+
+def test_writes_have_no_issues(history):
+    db, span_id = history
+    assert audit(db, {
+        'set_span': lambda: db.set_span(span_id, START),
+        'set_tag': lambda: db.add_tag(span_id, 'tag0001'),
+        'compact': lambda: db.compact(START + 2 * DAY, chunk_size=50),
+    }) == []
+
+
+def test_plan_issues():
+    tables = {'span', 'local_data'}
+    assert plan_issues([
+        'SCAN span',
+        'SCAN span USING COVERING INDEX span_edit_time_idx',
+        'SCAN local_data',
+        'SCAN ordered',
+        'SEARCH span USING INDEX span_span_id_idx (span_id=?)',
+        'USE TEMP B-TREE FOR ORDER BY',
+    ], tables) == ['SCAN span',
+                   'SCAN span USING COVERING INDEX span_edit_time_idx',
+                   'USE TEMP B-TREE FOR ORDER BY']
+
+
+def test_audit_reports_unexpected_steps(db):
+    db.set_span(1, 5)
+    issues = audit(db, {'scan': lambda: db.conn.execute(
+        'select * from span order by started + 1').fetchall()})
+    assert [issue.method for issue in issues] == ['scan', 'scan']
+    assert issues[0].detail == 'SCAN span'
+    assert 'TEMP B-TREE' in issues[1].detail
+
+
+def test_audit_reports_index_scans(db):
+    db.set_span(1, 5)
+    issues = audit(db, {'scan': lambda: db.conn.execute(
+        'select started from span order by started').fetchall()})
+    assert [issue.detail for issue in issues] == [
+        'SCAN span USING COVERING INDEX span_started_idx']
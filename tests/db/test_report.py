@@ -0,0 +1,121 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from alho.db import Database, create_tables
+from alho.report import Report, day_start
+
+DAY = datetime.date(2015, 6, 1)
+T0 = day_start(DAY.toordinal())
+HOUR = 3600
+
+
+@pytest.fixture
+def report(db):
+    return Report(db)
+
+
+def add(db, span_id, started, *tags):
+    db.set_span(span_id, started)
+    for name in tags:
+        db.add_tag(span_id, name)
+
+
+def test_totals(db, report, fake_times):
+    add(db, 1, T0 + 9 * HOUR, 'work')
+    add(db, 2, T0 + 12 * HOUR, 'lunch')
+    add(db, 3, T0 + 13 * HOUR, 'work', 'meeting')
+    add(db, 4, T0 + 14 * HOUR)
+    assert report.get_totals(DAY, DAY) == {
+        'work': 4 * HOUR, 'lunch': HOUR, 'meeting': HOUR}
+
+
+def test_last_span_not_counted(db, report, fake_times):
+    add(db, 1, T0 + 9 * HOUR, 'work')
+    assert report.get_totals(DAY, DAY) == {}
+    add(db, 2, T0 + 10 * HOUR)
+    assert report.get_totals(DAY, DAY) == {'work': HOUR}
+
+
+def test_split_across_days(db, report, fake_times):
+    add(db, 1, T0 + 22 * HOUR, 'sleep')
+    add(db, 2, T0 + 31 * HOUR)
+    next_day = DAY + datetime.timedelta(days=1)
+    assert report.get_totals(DAY, DAY) == {'sleep': 2 * HOUR}
+    assert report.get_totals(next_day, next_day) == {'sleep': 7 * HOUR}
+    assert report.get_totals(DAY, next_day) == {'sleep': 9 * HOUR}
+
+
+def test_incremental_updates(db, report, fake_times):
+    add(db, 1, T0 + 9 * HOUR, 'work')
+    add(db, 2, T0 + 12 * HOUR, 'lunch')
+    add(db, 3, T0 + 13 * HOUR)
+    assert report.get_totals(DAY, DAY) == {'work': 3 * HOUR, 'lunch': HOUR}
+    assert report.update() == 0
+    db.set_span(2, T0 + 11 * HOUR)
+    db.add_tag(3, 'work')
+    add(db, 4, T0 + 15 * HOUR)
+    assert report.update() == 1
+    assert report.get_totals(DAY, DAY) == {
+        'work': 4 * HOUR, 'lunch': 2 * HOUR}
+    db.remove_tag(2, 'lunch')
+    db.delete_span(3)
+    assert report.get_totals(DAY, DAY) == {'work': 2 * HOUR}
+    rebuilt = Report(db)
+    rebuilt.rebuild()
+    assert rebuilt.get_totals(DAY, DAY) == {'work': 2 * HOUR}
+
+
+def test_tag_edit_in_same_second(db, report, fake_time):
+    add(db, 1, T0 + 9 * HOUR, 'work')
+    add(db, 2, T0 + 10 * HOUR)
+    assert report.get_totals(DAY, DAY) == {'work': HOUR}
+    db.add_tag(1, 'meeting')
+    assert report.update() == 1
+    assert report.get_totals(DAY, DAY) == {'work': HOUR, 'meeting': HOUR}
+
+
+def test_moved_to_other_day(db, report, fake_times):
+    add(db, 1, T0 + 9 * HOUR, 'work')
+    add(db, 2, T0 + 10 * HOUR)
+    add(db, 3, T0 + 40 * HOUR, 'other')
+    add(db, 4, T0 + 41 * HOUR)
+    assert report.get_totals(DAY, DAY) == {'work': HOUR}
+    db.set_span(1, T0 + 39 * HOUR)
+    db.delete_span(2)
+    next_day = DAY + datetime.timedelta(days=1)
+    assert report.get_totals(DAY, DAY) == {}
+    assert report.get_totals(next_day, next_day) == {
+        'work': HOUR, 'other': HOUR}
+
+
+def test_imported_edits_counted(db, report, fake_times):
+    add(db, 1, T0 + 9 * HOUR, 'work')
+    add(db, 2, T0 + 10 * HOUR)
+    assert report.get_totals(DAY, DAY) == {'work': HOUR}
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    remote = Database(conn, 999)
+    remote.import_changes(db.export_changes())
+    remote.add_tag(1, 'remote')
+    db.import_changes(remote.get_merged_location_edits(999))
+    assert report.get_totals(DAY, DAY) == {'work': HOUR, 'remote': HOUR}
+
+
+def test_period_totals(db, report, fake_times):
+    monday = datetime.date(2015, 6, 29)
+    for i in range(5):
+        start = day_start((monday + datetime.timedelta(days=i)).toordinal())
+        add(db, 2 * i + 1, start + 9 * HOUR, 'work')
+        add(db, 2 * i + 2, start + 17 * HOUR)
+    last = monday + datetime.timedelta(days=6)
+    days = report.get_period_totals(monday, last)
+    assert [total.start for total in days] == [
+        monday + datetime.timedelta(days=i) for i in range(5)]
+    assert all(total.seconds == {'work': 8 * HOUR} for total in days)
+    weeks = report.get_period_totals(monday, last, 'week')
+    assert weeks == [(monday, {'work': 40 * HOUR})]
+    months = report.get_period_totals(monday, last, 'month')
+    assert months == [(datetime.date(2015, 6, 1), {'work': 16 * HOUR}),
+                      (datetime.date(2015, 7, 1), {'work': 24 * HOUR})]
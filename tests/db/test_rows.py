@@ -0,0 +1,91 @@
+import copy
+import pickle
+import sqlite3
+
+import pytest
+
+from alho.db import SpanEdit, SpanRow, TagEdit, TagRow, TimeStamp
+
+
+def test_span_row_matches_edit():
+    edit = SpanEdit(TimeStamp(100, -3, 2), 42, 95)
+    row = SpanRow.from_row((edit.edited.as_int, 42, 95, -3))
+    assert row == edit and edit == row
+    assert not row != edit
+    assert hash(row) == hash(edit)
+    assert repr(row) == repr(edit)
+    assert row.edited == edit.edited
+    assert row.edit_time == edit.edit_time == edit.edited.as_int
+    assert row.edit_loc == edit.edit_loc == -3
+    assert row.as_row == edit.as_row
+    assert tuple(row) == edit
+    assert row[0] == edit.edited and row[1:] == (42, 95)
+    assert len(row) == 3
+    edited, span_id, started = row
+    assert (span_id, started) == (42, 95)
+    assert row._asdict() == edit._asdict()
+    assert row._replace(started=None) == edit._replace(started=None)
+    assert type(row._replace(started=None)) is SpanEdit
+
+
+def test_tag_row_matches_edit():
+    edit = TagEdit(TimeStamp(100, 7, 0), 42, 'work', 1)
+    row = TagRow.from_row((edit.edited.as_int, 42, 'work', 1, 7))
+    assert row == edit
+    assert {row} == {edit}
+    assert row.name == 'work' and row.active == 1
+    assert row.as_row == edit.as_row
+    assert 'work' in row
+
+
+def test_row_sequence_methods_match_edit():
+    edit = SpanEdit(TimeStamp(100, -3, 2), 42, -3)
+    row = SpanRow.from_row((edit.edited.as_int, 42, -3, -3))
+    assert row.count(-3) == edit.count(-3) == 1
+    assert row.count(42) == edit.count(42) == 1
+    assert row.index(-3) == edit.index(-3) == 2
+    with pytest.raises(ValueError):
+        row.index(edit.edit_time)
+    assert -3 in row and edit.edit_time not in row
+    assert tuple(row) + () == edit + ()
+    assert '%s %s %s' % tuple(row) == '%s %s %s' % edit
+    assert '{!r}'.format(row) == '{!r}'.format(edit)
+    assert row.as_edit == edit and type(row.as_edit) is SpanEdit
+
+
+def test_rows_are_not_tuples():
+    """Rows don't expose their raw columns where a tuple is expected."""
+    row = SpanRow.from_row((100 << 32, 1, 5, 0))
+    assert not isinstance(row, tuple)
+    with pytest.raises(TypeError):
+        row + ()
+    with pytest.raises(TypeError):
+        '%s %s %s' % row
+    conn = sqlite3.connect(':memory:')
+    for values in row, row.as_edit:
+        with pytest.raises(sqlite3.Error):
+            conn.execute('select ?, ?, ?', values)
+    assert (conn.execute('select ?, ?, ?, ?', row.as_row).fetchone() ==
+            row.as_edit.as_row)
+
+
+def test_rows_copy_as_edits():
+    row = SpanRow.from_row((100 << 32, 1, 5, 0))
+    for copied in (pickle.loads(pickle.dumps(row)), copy.copy(row)):
+        assert type(copied) is SpanEdit
+        assert copied == row
+
+
+def test_scans_return_rows(db, fake_times):
+    s1 = db.set_span('new', 5)
+    db.add_tag(s1.span_id, 'a')
+    spans = list(db.get_spans())
+    assert spans == [s1]
+    assert type(spans[0]) is SpanRow
+    assert list(db.get_span_history(s1.span_id)) == [s1]
+    tags = list(db.get_tag_history(s1.span_id))
+    assert [type(edit) for edit in tags] == [TagRow]
+    assert tags[0].name == 'a'
+    exported = list(db.export_changes())
+    assert [type(edit) for edit in exported] == [SpanRow, TagRow]
+    assert exported[0] == s1
@@ -317,3 +317,86 @@ def test_get_next_span(db, fake_times):
     db.set_span(4, 102)
     assert db.get_next_span(3).span_id == 4
     assert db.get_next_span(4) is None
+
+
+def test_get_tags_for_spans(db, fake_times):
+    s1 = db.set_span(1, 5)
+    s2 = db.set_span(2, 10)
+    db.add_tag(s1.span_id, 'a')
+    db.add_tag(s1.span_id, 'b')
+    db.add_tag(s2.span_id, 'c')
+    db.remove_tag(s1.span_id, 'a')
+    assert db.get_tags_for_spans([s1.span_id, s2.span_id, 3]) == {
+        s1.span_id: {'b'}, s2.span_id: {'c'}, 3: set()}
+    assert db.get_tags_for_spans([]) == {}
+
+
+def test_get_tags_for_many_spans(db, fake_times):
+    span_ids = list(range(1, db.MAX_PARAMS * 2 + 2))
+    with db.batch():
+        for span_id in span_ids:
+            db.add_tag(span_id, 'x{}'.format(span_id % 3))
+    tags = db.get_tags_for_spans(span_ids)
+    assert tags == {span_id: {'x{}'.format(span_id % 3)}
+                    for span_id in span_ids}
+
+
+def test_get_span_views(db, fake_times):
+    s1 = db.set_span(1, 5)
+    s2 = db.set_span(2, 10)
+    s3 = db.set_span(3, 7)
+    s4 = db.set_span(4, 20)
+    db.delete_span(s3.span_id)
+    db.add_tag(s1.span_id, 'a')
+    db.add_tag(s2.span_id, 'b')
+    db.add_tag(s2.span_id, 'c')
+    views = db.get_span_views(0, 15)
+    assert [view.edit for view in views] == list(db.get_spans(0, 15))
+    for view in views:
+        assert view.tags == db.get_tags(view.span_id)
+        assert view.next_started == db.get_next_span(view.span_id).started
+    assert [view.elapsed for view in views] == [5, 10]
+    assert db.get_span_views(15, 30)[0].edit == s4
+    assert db.get_span_views(15, 30)[0].elapsed is None
+
+
+def test_get_span_durations(db, fake_times):
+    db.set_span(1, 5)
+    db.set_span(2, 10)
+    db.set_span(3, 7)
+    db.set_span(4, 20)
+    db.delete_span(3)
+    assert list(db.get_span_durations()) == [(1, 5, 10, 5), (2, 10, 20, 10),
+                                             (4, 20, None, None)]
+    assert list(db.get_span_durations(5, 10)) == [(1, 5, 10, 5)]
+    assert list(db.get_span_durations(6, 12)) == [(1, 5, 10, 5),
+                                                  (2, 10, 20, 10)]
+    assert list(db.get_span_durations(10, 11)) == [(2, 10, 20, 10)]
+    assert list(db.get_span_durations(25, 30)) == [(4, 20, None, None)]
+    assert list(db.get_span_durations(0, 5)) == []
+
+
+def test_get_span_durations_ranges(db, fake_times):
+    for span_id, started in [(1, 100), (2, 200), (3, 200), (4, 350)]:
+        db.set_span(span_id, started)
+    spans = list(db.get_spans())
+    ends = [span.started for span in spans[1:]] + [None]
+    for time_from, time_to in [(-2**31, 2**31 - 1), (0, 100), (100, 200),
+                               (150, 151), (200, 201), (200, 400),
+                               (350, 351), (400, 500)]:
+        assert list(db.get_span_durations(time_from, time_to)) == [
+            (span.span_id, span.started, ended,
+             None if ended is None else ended - span.started)
+            for span, ended in zip(spans, ends)
+            if span.started < time_to
+            and (span.started >= time_from or ended is None
+                 or ended > time_from)]
+
+
+def test_get_span_durations_same_start(db, fake_times):
+    db.set_span(1, 5)
+    db.set_span(2, 5)
+    db.set_span(3, 8)
+    assert list(db.get_span_durations(5, 6)) == [(1, 5, 5, 0), (2, 5, 8, 3)]
+    assert list(db.get_span_durations(6, 7)) == [(2, 5, 8, 3)]
+    assert list(db.get_span_durations(0, 5)) == []
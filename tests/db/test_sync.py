@@ -0,0 +1,334 @@
+import sqlite3
+
+from alho.db import Database, create_tables
+
+
+def create_db(location):
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn)
+    return Database(conn, location)
+
+
+def make_edits(db):
+    span = db.add_span()
+    db.add_tag(span.span_id, 'a')
+    db.set_span(span.span_id, 1000)
+    db.remove_tag(span.span_id, 'a')
+    return span
+
+
+def test_export_everything(db, fake_times):
+    make_edits(db)
+    changes = db.export_changes()
+    edits = list(changes)
+    expected = sorted(list(db.get_span_history(edits[0].span_id)) +
+                      list(db.get_tag_history(edits[0].span_id)),
+                      key=lambda edit: edit.edited.as_int)
+    assert edits == expected
+    assert changes.watermarks == {db.location_id: edits[-1].edited.as_int}
+
+
+def test_export_since_watermarks(db, fake_times):
+    span = make_edits(db)
+    changes = db.export_changes()
+    assert changes.watermarks == {}
+    list(changes)
+    watermarks = changes.watermarks
+    changes = db.export_changes(watermarks)
+    assert list(changes) == []
+    assert changes.watermarks == watermarks
+    new_edit = db.add_tag(span.span_id, 'b')
+    changes = db.export_changes(watermarks)
+    assert list(changes) == [new_edit]
+    assert changes.watermarks == {db.location_id: new_edit.edited.as_int}
+
+
+def test_export_tag_edit_after_span_edits(db, fake_time):
+    span = db.add_span()
+    db.set_span(span.span_id, 1000)
+    db.add_tag(span.span_id, 'a')
+    changes = db.export_changes()
+    list(changes)
+    new_edit = db.add_tag(span.span_id, 'b')
+    assert list(db.export_changes(changes.watermarks)) == [new_edit]
+
+
+def test_export_multiple_locations(db, fake_times):
+    other_loc = -2**31
+    make_edits(db)
+    db.location_id = other_loc
+    span = make_edits(db)
+    assert db.get_edit_locations() == [other_loc, 12345]
+    changes = db.export_changes({12345: 2**63 - 1})
+    edits = list(changes)
+    assert len(edits) == 4
+    assert all(edit.edited.loc == other_loc for edit in edits)
+    assert changes.watermarks[other_loc] == edits[-1].edited.as_int
+    assert changes.watermarks[12345] == 2**63 - 1
+    assert db.get_span(span.span_id).edited.loc == other_loc
+
+
+def test_import_changes(db, fake_times):
+    from alho.db import check_current_tables
+    span = make_edits(db)
+    db.add_span()
+    other = create_db(999)
+    other_span = make_edits(other)
+    result = other.import_changes(db.export_changes(), chunk_size=3)
+    assert result == (5, 0)
+    assert check_current_tables(other.conn)
+    assert other.get_span(span.span_id) == db.get_span(span.span_id)
+    assert (list(other.get_span_history(span.span_id)) ==
+            list(db.get_span_history(span.span_id)))
+    assert [edit.span_id for edit in other.get_spans()] == [
+        edit.span_id for edit in sorted(
+            list(db.get_spans()) + [other.get_span(other_span.span_id)],
+            key=lambda edit: (edit.started, edit.edited.as_int))]
+
+
+def test_import_changes_again(db, fake_times):
+    make_edits(db)
+    other = create_db(999)
+    assert other.import_changes(db.export_changes()) == (4, 0)
+    assert other.import_changes(db.export_changes()) == (0, 4)
+    assert other.import_changes([]) == (0, 0)
+
+
+def test_import_out_of_order(db, fake_times):
+    span = make_edits(db)
+    other = create_db(999)
+    edits = list(db.export_changes())
+    other.import_changes(reversed(edits), chunk_size=1)
+    assert other.get_span(span.span_id).started == 1000
+    assert list(other.get_spans()) == list(db.get_spans())
+    assert other.get_tags(span.span_id) == set()
+
+
+def test_import_own_edits(db, fake_time):
+    span = make_edits(db)
+    edits = list(db.export_changes())
+    restored = create_db(12345)
+    restored.add_span()
+    restored.import_changes(edits)
+    new_edit = restored.add_tag(span.span_id, 'x')
+    assert new_edit.edited > edits[-1].edited
+
+
+def run_with_server(tmp_path, client_func, **options):
+    import asyncio
+    from alho.sync import SyncClient, SyncServer
+    filename = str(tmp_path / 'server.db')
+    SyncServer.create_database(filename)
+    path = str(tmp_path / 'sync.sock')
+
+    async def run():
+        server = SyncServer(filename, readers=2, **options)
+        await server.start(path=path)
+        try:
+            return await client_func(lambda: SyncClient.connect(path=path))
+        finally:
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_sync_server_push_pull(tmp_path, db, fake_times):
+    make_edits(db)
+    edits = list(db.export_changes())
+
+    async def client_func(connect):
+        client = await connect()
+        try:
+            assert await client.push(edits) == (4, 0)
+            assert await client.push(edits) == (0, 4)
+            pulled, watermarks = await client.pull({})
+            assert pulled == edits
+            assert await client.pull(watermarks) == ([], watermarks)
+        finally:
+            await client.close()
+
+    run_with_server(tmp_path, client_func)
+
+
+def test_sync_server_many_clients(tmp_path, fake_times):
+    import asyncio
+    from alho.sync import sync_database
+    dbs = [create_db(loc) for loc in range(1, 9)]
+    for db in dbs:
+        make_edits(db)
+
+    async def sync_one(connect, db):
+        client = await connect()
+        try:
+            return await sync_database(db, client)
+        finally:
+            await client.close()
+
+    async def client_func(connect):
+        states = await asyncio.gather(*(sync_one(connect, db) for db in dbs))
+        client = await connect()
+        try:
+            for db, (pulled, pushed) in zip(dbs, states):
+                await sync_database(db, client, pulled, pushed)
+        finally:
+            await client.close()
+
+    run_with_server(tmp_path, client_func)
+    expected = sorted(dbs[0].export_changes(),
+                      key=lambda edit: edit.edited.as_int)
+    assert len(expected) == 4 * len(dbs)
+    for db in dbs:
+        assert sorted(db.export_changes(),
+                      key=lambda edit: edit.edited.as_int) == expected
+
+
+def test_sync_server_bad_request(tmp_path):
+    import pytest
+    from alho.sync import SyncError
+
+    async def client_func(connect):
+        client = await connect()
+        try:
+            with pytest.raises(SyncError):
+                await client.request({'op': 'explode'})
+            assert (await client.pull({}))[0] == []
+        finally:
+            await client.close()
+
+    run_with_server(tmp_path, client_func)
+
+
+def test_sync_server_bad_payloads(tmp_path, caplog):
+    import pytest
+    from alho.changeset import FLAG_ZLIB, HEADER, MAGIC, VERSION
+    from alho.sync import SyncError
+    bad_payloads = [
+        HEADER.pack(MAGIC, VERSION, FLAG_ZLIB) + b'not zlib at all',
+        HEADER.pack(MAGIC, VERSION, 0) + b'\x04' + bytes(24) + b'\x00',
+    ]
+
+    async def client_func(connect):
+        client = await connect()
+        try:
+            for payload in bad_payloads:
+                with pytest.raises(SyncError):
+                    await client.request({'op': 'push'}, payload)
+            assert (await client.pull({}))[0] == []
+        finally:
+            await client.close()
+
+    run_with_server(tmp_path, client_func)
+    assert 'Unhandled exception' not in caplog.text
+
+
+def test_sync_server_payload_limit(tmp_path):
+    import pytest
+    from alho.sync import SyncError
+
+    async def client_func(connect):
+        client = await connect()
+        try:
+            with pytest.raises(SyncError, match='over the limit'):
+                await client.request({'op': 'push', 'length': 1 << 40})
+        finally:
+            await client.close()
+
+    run_with_server(tmp_path, client_func, max_payload=1 << 20)
+
+
+def test_sync_server_close_disconnects_clients(tmp_path, caplog):
+    import asyncio
+    from alho.sync import SyncClient, SyncServer
+    filename = str(tmp_path / 'server.db')
+    SyncServer.create_database(filename)
+    path = str(tmp_path / 'sync.sock')
+
+    async def run():
+        server = SyncServer(filename, readers=1)
+        await server.start(path=path)
+        client = await SyncClient.connect(path=path)
+        try:
+            await client.locations()
+            await asyncio.wait_for(server.close(), 5)
+            assert server.clients == {}
+            assert await client.reader.read() == b''
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    assert 'Unhandled exception' not in caplog.text
+    assert 'Task was destroyed' not in caplog.text
+
+
+def test_digest_matches_between_replicas(db, fake_times):
+    from alho.db import DigestBucket
+    make_edits(db)
+    other = create_db(999)
+    assert db.get_digest(12345) != other.get_digest(12345)
+    other.import_changes(db.export_changes())
+    assert db.get_digest(12345) == other.get_digest(12345)
+    assert db.get_digest(12345).count == 4
+    assert other.get_digest(999) == db.get_digest(999) == (
+        0, other.get_digest(5).hash)
+    bucket = DigestBucket.ROOT
+    while bucket.children:
+        bucket = [child for child in bucket.children
+                  if db.get_digest(12345, child).count][0]
+    assert list(db.get_bucket_edits(12345, bucket)) == list(
+        db.export_changes())
+
+
+def test_digest_large_buckets_use_children(db, fake_times):
+    with db.batch():
+        for i in range(200):
+            db.set_span(i, i)
+    other = create_db(999)
+    edits = list(db.export_changes())
+    other.import_changes(edits[:100] + edits[101:])
+    assert db.get_digest(12345).count == 200
+    assert other.get_digest(12345).count == 199
+    other.import_changes(edits)
+    assert db.get_digest(12345) == other.get_digest(12345)
+
+
+def test_digest_cache(db, fake_time):
+    from alho.db import DigestBucket
+    fake_time.value = 10**8
+    other = create_db(999)
+    old = make_edits(other)
+    bucket = DigestBucket.ROOT
+    while bucket.children:
+        bucket = [child for child in bucket.children
+                  if other.get_digest(999, child).count][0]
+    fake_time.value += 10**6
+    before = db.get_digest(999, bucket)
+    assert (999, bucket) in db._digest_cache
+    db.import_changes(other.export_changes())
+    assert (999, bucket) not in db._digest_cache
+    after = db.get_digest(999, bucket)
+    assert before != after == other.get_digest(999, bucket)
+    assert db.get_tags(old.span_id) == set()
+
+
+def test_reconcile(tmp_path, db, fake_times):
+    from alho.sync import reconcile, sync_database
+    make_edits(db)
+    restored = create_db(777)
+    make_edits(restored)
+
+    async def client_func(connect):
+        client = await connect()
+        try:
+            await sync_database(db, client)
+            pulled, pushed = await reconcile(restored, client)
+            assert pulled.inserted == 4
+            assert pushed.inserted == 4
+            pulled, pushed = await reconcile(restored, client)
+            assert pulled.inserted == pushed.inserted == 0
+        finally:
+            await client.close()
+
+    run_with_server(tmp_path, client_func)
+    restored_edits = set(restored.export_changes())
+    assert len(restored_edits) == 8
+    assert set(db.export_changes()) <= restored_edits
@@ -0,0 +1,48 @@
+import pytest
+
+
+def tag_ids(db):
+    return dict(db.conn.execute('select name, tag_id from tag'))
+
+
+def test_tag_names_interned(db, fake_times):
+    s1 = db.set_span(1, 5)
+    s2 = db.set_span(2, 10)
+    db.add_tag(s1.span_id, 'work')
+    db.add_tag(s2.span_id, 'work')
+    db.add_tag(s2.span_id, 'home')
+    assert set(tag_ids(db)) == {'work', 'home'}
+    assert db.conn.execute(
+        'select count(distinct tag_id) from span_tag').fetchone()[0] == 2
+    assert db.get_tags(s2.span_id) == {'work', 'home'}
+    assert [edit.name for edit in db.get_tag_history(s2.span_id)] == [
+        'work', 'home']
+
+
+def test_tags_cached(db, fake_times):
+    s1 = db.set_span(1, 5)
+    db.add_tag(s1.span_id, 'work')
+    assert db.tags.ids == tag_ids(db)
+    assert db.tags.names == {v: k for k, v in tag_ids(db).items()}
+
+
+def test_tags_from_other_connection(db, fake_times):
+    from alho.db import Database
+    s1 = db.set_span(1, 5)
+    db.add_tag(s1.span_id, 'work')
+    other = Database(db.conn)
+    assert other.get_tags(s1.span_id) == {'work'}
+    assert other.tags.get_id('work', create=False) == db.tags.get_id('work')
+    assert other.tags.get_id('missing', create=False) is None
+
+
+def test_rolled_back_tags_forgotten(db, fake_times):
+    s1 = db.set_span(1, 5)
+    with pytest.raises(RuntimeError):
+        with db._transaction():
+            db.tags.get_id('doomed')
+            raise RuntimeError
+    assert 'doomed' not in db.tags.ids
+    assert 'doomed' not in tag_ids(db)
+    db.add_tag(s1.span_id, 'doomed')
+    assert db.get_tags(s1.span_id) == {'doomed'}
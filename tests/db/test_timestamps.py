@@ -0,0 +1,94 @@
+import sqlite3
+
+from alho.db import Database, SpanEdit, TimeStamp, create_tables
+
+
+def queries(db, action):
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        action()
+    finally:
+        db.conn.set_trace_callback(None)
+    return [sql for sql in statements if 'max(edit_time)' in sql]
+
+
+def test_no_query_after_first_write(db, fake_times):
+    assert len(queries(db, db.add_span)) == 1
+    assert queries(db, db.add_span) == []
+    span_id = db.get_last_span().span_id
+    assert queries(db, lambda: db.add_tag(span_id, 'x')) == []
+
+
+def test_seeded_from_existing(db, fake_time):
+    first = db.add_span()
+    db2 = Database(db.conn)
+    second = db2.add_span()
+    assert second.edited == first.edited.next
+
+
+def test_rollover(db, fake_time):
+    now = int(fake_time.value)
+    last = TimeStamp(now, db.location_id, 0xfffe)
+    with db.conn:
+        db.conn.execute(SpanEdit.INSERT, SpanEdit(last, 1, 10).as_row)
+    db.timestamps.reset()
+    stamps = [db.get_next_timestamp(now) for i in range(3)]
+    assert stamps == [TimeStamp(now, db.location_id, 0xffff),
+                      TimeStamp(now + 1, db.location_id, 0),
+                      TimeStamp(now + 1, db.location_id, 1)]
+    assert (db.get_next_timestamp(now + 1) ==
+            TimeStamp(now + 1, db.location_id, 2))
+
+
+def test_reserve_block(db):
+    first = db.reserve_timestamps(100, 0x10003)
+    assert first == TimeStamp(100, db.location_id, 0)
+    assert (db.get_next_timestamp(100) ==
+            first.advanced(0x10003) ==
+            TimeStamp(101, db.location_id, 3))
+
+
+def test_tables_share_sequence(db, fake_time):
+    span = db.add_span()
+    tag = db.add_tag(span.span_id, 'a')
+    assert tag.edited == span.edited.next
+    db2 = Database(db.conn)
+    assert db2.set_span(span.span_id, 5).edited == tag.edited.next
+
+
+def test_locations_sharing_low_bits(db, fake_time):
+    first = db.add_span()
+    db2 = Database(db.conn, db.location_id + 0x10000)
+    second = db2.add_span()
+    assert second.edited == first.edited.next._replace(loc=db2.location_id)
+    db.location_id = db2.location_id
+    assert db.add_span().edited == second.edited.next
+    db.location_id = 12345
+    assert (db.get_span(first.span_id).edited.as_int <
+            db.add_span().edited.as_int)
+
+
+def test_advanced_matches_next():
+    start = stamp = TimeStamp(5, 7, 0xfff0)
+    for count in range(40):
+        assert start.advanced(count) == stamp
+        stamp = stamp.next
+
+
+def test_as_ints_matches_advanced():
+    for start in TimeStamp(5, -7, 0xfff0), TimeStamp(-5, 7, 0):
+        assert start.as_ints(40) == [start.advanced(count).as_int
+                                     for count in range(40)]
+    assert TimeStamp(5, 7, 0).as_ints(0) == []
+
+
+def test_reseed_after_other_writer(tmp_path, fake_time):
+    filename = str(tmp_path / 'alho.db')
+    conn1 = sqlite3.connect(filename)
+    create_tables(conn1)
+    db1 = Database(conn1, 4321)
+    db2 = Database(sqlite3.connect(filename))
+    edits = [db1.add_span(), db2.add_span(), db1.add_span(), db2.add_span()]
+    stamps = [edit.edited for edit in edits]
+    assert sorted(set(stamps)) == stamps
@@ -1,5 +1,6 @@
 import time
 import tkinter as tk
+from contextlib import nullcontext
 from datetime import date, timedelta
 
 import pytest
@@ -38,6 +39,17 @@ def mock_db(fake_time):
     db.get_spans.return_value = []
     db.get_next_span.return_value = None
     db.get_tags.return_value = set()
+    db.batch.return_value = nullcontext()
+
+    def get_span_views(time_from, time_to):
+        from alho.db import SpanView
+        views = []
+        for edit in db.get_spans(time_from, time_to):
+            next_span = db.get_next_span(edit.span_id)
+            views.append(SpanView(edit, set(db.get_tags(edit.span_id)),
+                                  next_span and next_span.started))
+        return views
+    db.get_span_views.side_effect = get_span_views
     return db
 
 
@@ -250,7 +262,7 @@ class TestSpanListWidget:
         span_list.db.get_spans.return_value = span_edits
         mock_refresh = Mock()
         with mock.patch.object(SpanWidget, 'refresh',
-                               lambda sw: mock_refresh(sw)):
+                               lambda sw, view=None: mock_refresh(sw)):
             span_list.refresh()
         assert ([span.span_id for span in span_list.spans] ==
                 [edit.span_id for edit in span_edits])
@@ -319,6 +331,82 @@ class TestSpanListWidget:
         span_list.save_button.invoke()
         span_list.db.delete_span.assert_called_with(span.span_id)
 
+    def test_listens_for_changes(self, span_list):
+        span_list.db.add_listener.assert_called_with(span_list.on_changes)
+
+    def test_tag_change_patches_span(self, span_list_with_spans):
+        from alho.db import TagAdded
+        span_list = span_list_with_spans
+        db = span_list.db
+        span = span_list.spans[2]
+        db.get_tags_for_spans.return_value = {span.span_id: {'new'}}
+        views_calls = db.get_span_views.call_count
+        span_list.on_changes([TagAdded(span.span_id, 'new')])
+        assert db.get_span_views.call_count == views_calls
+        db.get_tags_for_spans.assert_called_with({span.span_id})
+        assert span.tag_entry.external_value == 'new'
+
+    def test_span_change_refreshes_changed_rows(self, span_list_with_spans):
+        from alho.db import SpanMoved
+        from alho.gui import SpanWidget
+        span_list = span_list_with_spans
+        db = span_list.db
+        spans = db.get_spans.return_value
+        moved = spans[2]._replace(started=spans[2].started + 1)
+        db.get_spans.return_value = spans[:2] + [moved] + spans[3:]
+        mock_refresh = Mock()
+        with mock.patch.object(SpanWidget, 'refresh',
+                               lambda sw, view=None: mock_refresh(sw)):
+            span_list.on_changes([SpanMoved(moved.span_id, moved.started)])
+        assert mock_refresh.call_args_list == [call(span_list.spans[2])]
+
+    def test_change_on_earlier_day_ignored(self, span_list_with_spans):
+        from alho.db import SpanCreated
+        span_list = span_list_with_spans
+        views_calls = span_list.db.get_span_views.call_count
+        span_list.on_changes([SpanCreated(999, span_list.start_time - 1)])
+        assert span_list.db.get_span_views.call_count == views_calls
+
+    def test_move_of_next_day_span_to_earlier_day(self,
+                                                  span_list_with_spans):
+        from alho.db import SpanMoved
+        span_list = span_list_with_spans
+        db = span_list.db
+        views_calls = db.get_span_views.call_count
+        span_list.on_changes([SpanMoved(999, span_list.start_time - 1)])
+        assert db.get_span_views.call_count == views_calls
+        last = span_list.spans[-1]
+        last.view = last.view._replace(next_started=last.view.started + 50)
+        span_list.on_changes([SpanMoved(999, span_list.start_time - 1)])
+        assert db.get_span_views.call_count == views_calls + 1
+
+    def test_refresh_with_reader(self, span_list_with_spans):
+        span_list = span_list_with_spans
+        db = span_list.db
+        old_spans = span_list.spans[:]
+        span_list.reader = reader = Mock()
+        span_list.refresh()
+        assert span_list.spans == old_spans
+        callbacks = [c[1]['callback'] for c in reader.call.call_args_list]
+        span_list.refresh()
+        callbacks.append(reader.call.call_args[1]['callback'])
+        views = db.get_span_views(0, 0)[:2]
+        callbacks[0](views)
+        assert span_list.spans == old_spans
+        callbacks[1](views)
+        assert span_list.spans == old_spans[:2]
+
+    def test_refresh_with_failing_reader(self, span_list_with_spans, caplog):
+        span_list = span_list_with_spans
+        db = span_list.db
+        old_spans = span_list.spans[:]
+        span_list.reader = reader = Mock()
+        span_list.refresh()
+        db.get_spans.return_value = db.get_spans.return_value[:2]
+        reader.call.call_args[1]['errback'](ValueError('locked'))
+        assert span_list.spans == old_spans[:2]
+        assert 'locked' in caplog.text
+
 
 TIME_FMT = '%Y-%m-%d %H:%M:%S'
 
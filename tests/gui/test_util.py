@@ -1,4 +1,5 @@
 import time
+import tkinter as tk
 from datetime import date, timedelta
 
 import pytest
@@ -293,3 +294,90 @@ class TestDateChooser:
         for widget in [chooser.inc_button, chooser.dec_button]:
             assert 'disabled' in widget.state()
         assert 'disabled' not in chooser.today_button.state()
+
+
+class TestCompletionList:
+
+    @pytest.fixture
+    def entry(self, tk_main_win):
+        from alho.gui import SavableEntry
+        entry = SavableEntry(tk_main_win, editable=True)
+        entry.widget.pack()
+        return entry
+
+    @pytest.fixture
+    def completions(self, entry):
+        from alho.gui import CompletionList
+        complete = Mock(side_effect=lambda word: [
+            name for name in ['walk', 'work', 'write']
+            if name.startswith(word)])
+        completions = CompletionList(entry, complete)
+        yield completions
+        completions.hide()
+
+    def type(self, entry, completions, text):
+        entry.entry.insert(tk.INSERT, text)
+        completions.update()
+
+    def test_shows_completions(self, entry, completions):
+        self.type(entry, completions, 'a, w')
+        completions.complete.assert_called_with('w')
+        assert completions.shown
+        assert completions.listbox.get(0, 'end') == ('walk', 'work', 'write')
+
+    def test_hides_without_completions(self, entry, completions):
+        self.type(entry, completions, 'w')
+        assert completions.shown
+        self.type(entry, completions, 'x')
+        assert not completions.shown
+
+    def test_not_shown_when_not_editable(self, entry, completions):
+        entry.editable = False
+        self.type(entry, completions, 'w')
+        assert not completions.shown
+
+    def test_accept(self, entry, completions):
+        self.type(entry, completions, 'a, wo')
+        completions.accept()
+        assert entry.edited_value == 'a, work'
+        assert not completions.shown
+
+    def test_select_next(self, entry, completions):
+        self.type(entry, completions, 'w')
+        completions.on_key_down()
+        completions.on_key_tab()
+        assert entry.edited_value == 'work'
+
+    def test_select_wraps(self, entry, completions):
+        self.type(entry, completions, 'w')
+        completions.on_key_up()
+        completions.accept()
+        assert entry.edited_value == 'write'
+
+
+class TestMainThreadQueue:
+
+    def test_runs_queued(self):
+        from alho.gui.util import MainThreadQueue
+        widget = Mock()
+        main_queue = MainThreadQueue(widget)
+        func = Mock()
+        main_queue(func)
+        main_queue(func)
+        main_queue.poll()
+        assert func.call_count == 2
+        assert widget.after.call_args == call(main_queue.POLL_MS,
+                                              main_queue.poll)
+
+    def test_polls_again_after_error(self):
+        from alho.gui.util import MainThreadQueue
+        widget = Mock()
+        main_queue = MainThreadQueue(widget)
+        func = Mock()
+        main_queue(Mock(side_effect=ValueError))
+        main_queue(func)
+        with pytest.raises(ValueError):
+            main_queue.poll()
+        assert widget.after.call_count == 2
+        main_queue.poll()
+        assert func.call_count == 1